@@ -1,24 +1,31 @@
+import argparse
 import re
 import sys
+import time
+from contextlib import nullcontext
 from getpass import getpass
 
-from src.database import Database
+from src.cache import ResponseCache, CACHE_SIZE
+from src.database import Database, MAX_CONNECTIONS, PAGE_SIZE
+from src.discovery import DISCOVERY_DEPTH, Discovery
+from src.export import FORMATS, export
+from src.journal import CrawlJournal, FAILED, PARSED, STORED
+from src.metrics import JsonDumper, profiled, serve_prometheus
 from src.scraper import Scraper, BLICK_URL, MIN_URL
+from src.urls import batched, read_urls, url_pattern
 from colorama import init, Fore, Style
 
 # Initialize colorama
 init()
 
-# URLS to scrape
+# Start pages of the article discovery
 URLS = [BLICK_URL, MIN_URL]
 
-# URL regex pattern to validate a wide range of URLs
-url_pattern = re.compile(
-    r'^(https?://)?'                                # optional http or https
-    r'([\w-]+\.)+'                                  # subdomain or domain
-    r'([a-z.]{2,6})(:[0-9]{1,5})?'                  # domain extension and optional port
-    r'(/[\w.,@?^=%&:;/~+#-]*[\w@?^=%&;/~+#-])?$'    # path
-)
+# Number of records written to the database per commit in batch mode
+BATCH_SIZE = 500
+
+# Number of URLs looked up in the database with one query in batch mode
+LOOKUP_SIZE = 10000
 
 # Database connection parameters
 db_params = {
@@ -37,24 +44,42 @@ def exit_app():
     sys.exit()
 
 
+def open_url_file(path, column=0):
+    """
+    Check if the file exists and open a stream of its validated and de-duplicated URLs
+    :param path: File path to read, .txt or .csv and optionally .gz compressed
+    :param column: Column name or index holding the URLs in a .csv file
+    :return: Generator of URLs from the file, None if the file can't be read
+    """
+    try:
+        return read_urls(path, column)
+    except ValueError as e:
+        print(Fore.RED + str(e) + Style.RESET_ALL)
+    except FileNotFoundError:
+        print(Fore.RED + "File not found." + Style.RESET_ALL)
+    return None
+
+
 def check_file(path):
     """
     Check if the file exists and read the file content if it exists
     :param path: File path to read
     :return: List of URLs from the file
     """
-    allowed_extensions = ['.txt', '.csv']
-    if not any(path.endswith(ext) for ext in allowed_extensions):
-        print(
-            Fore.RED + f"Invalid file extension. Allowed extensions are: {', '.join(allowed_extensions)}" + Style.RESET_ALL)
-        return None
+    urls = open_url_file(path)
+    return list(urls) if urls is not None else None
 
-    try:
-        with open(path, 'r') as f:
-            return [line.strip() for line in f.readlines()]
-    except FileNotFoundError:
-        print(Fore.RED + "File not found." + Style.RESET_ALL)
-        return None
+
+def skip_stored(urls, database):
+    """
+    Drop the URLs which are already stored in the database, looking them up in chunks
+    :param urls: Iterable of URLs
+    :param database: Database object
+    :return: Generator of the URLs which are not stored yet
+    """
+    for chunk in batched(urls, LOOKUP_SIZE):
+        stored = database.stored_urls(chunk)
+        yield from (url for url in chunk if url not in stored)
 
 
 def check_direcotry(file):
@@ -75,15 +100,317 @@ def scrape_data(url, scraper, database):
     :param database: Database object
     :return: None
     """
-    data = scraper.scrape(url)
-    print(*data)
+    articles = scraper.scrape(url)
+    for article in articles:
+        print(article.title, article.time, article.autor, article.text)
     while True:
         save = input("Do you want to save this data? (y/n): ")
         if save in ['y', 'Y', 'yes', 'Yes', 'n', 'N', 'no', 'No']:
             break
         print(Fore.RED + "Invalid input." + Style.RESET_ALL)
     if save in ['y', 'Y', 'yes', 'Yes']:
-        database.store_data(data, url)
+        database.store_data(articles)
+
+
+def print_articles(rows):
+    """
+    Print one line per article with its ID, time, author and title
+    :param rows: List of (id, title, time, autor, url) tuples
+    :return: None
+    """
+    for index, title, published, autor, url in rows:
+        print(f"{index:>8}  {published:%d.%m.%Y %H:%M}  {autor[:24]:24}  {title}")
+
+
+def browse(database, query=None, autor=None, page_size=PAGE_SIZE):
+    """
+    Show the search results or the newest articles page by page
+    :param database: Database object
+    :param query: Search terms, None to list the newest articles
+    :param autor: Only show articles of this author
+    :param page_size: Number of articles per page
+    :return: None
+    """
+    page, before = 0, None
+    while True:
+        if query:
+            rows = database.search(query, page, page_size, autor)
+        else:
+            rows = database.list_articles(page_size, before, autor)
+        if not rows:
+            message = "No more articles found." if page else "No articles found."
+            print(Fore.RED + message + Style.RESET_ALL)
+            return None
+        print_articles(rows)
+        if len(rows) < page_size or input("Press enter for the next page or 'q' to stop: ") in ['q', 'Q']:
+            return None
+        page, before = page + 1, (rows[-1][2], rows[-1][0])
+
+
+def run_batch(path, scraper, database, batch_size=BATCH_SIZE, workers=0, rescrape=False, column=0, journal=None,
+              retry_failed=False, bulk=False):
+    """
+    Scrape all URLs from the file without prompting and store the results in batches
+    :param path: File path with the URLs to scrape
+    :param scraper: Scraper object
+    :param database: Database object
+    :param batch_size: Number of records to store per commit
+    :param workers: Number of parser processes, 0 parses in the main process
+    :param rescrape: Scrape the URLs which are already stored in the database again
+    :param column: Column name or index holding the URLs in a .csv file
+    :param journal: CrawlJournal recording the state of every URL to resume an interrupted run, None to disable
+    :param retry_failed: Scrape the URLs which failed in an earlier run of the journal again
+    :param bulk: Load the records with COPY and skip the stored titles, for large backfills
+    :return: Tuple of the number of scraped and failed URLs
+    """
+    urls = open_url_file(path, column)
+    if urls is None:
+        return 0, 0
+    return scrape_urls(urls, scraper, database, batch_size, workers, rescrape, journal, retry_failed, bulk)
+
+
+def scrape_urls(urls, scraper, database, batch_size=BATCH_SIZE, workers=0, rescrape=False, journal=None,
+                retry_failed=False, bulk=False):
+    """
+    Scrape the URLs and store the results in batches
+    :param urls: Iterable of normalized URLs
+    :param scraper: Scraper object
+    :param database: Database object
+    :param batch_size: Number of records to store per commit
+    :param workers: Number of parser processes, 0 parses in the main process
+    :param rescrape: Scrape the URLs which are already stored in the database again
+    :param journal: CrawlJournal recording the state of every URL to resume an interrupted run, None to disable
+    :param retry_failed: Scrape the URLs which failed in an earlier run of the journal again
+    :param bulk: Load the records with COPY and skip the stored titles, for large backfills
+    :return: Tuple of the number of scraped and failed URLs
+    """
+    # The stored URLs are dropped before the journal queues the others, so they are never left queued
+    if not rescrape:
+        urls = skip_stored(urls, database)
+    if journal is not None:
+        urls = journal.pending(urls, retry_failed)
+
+    def store(records, pages):
+        if bulk:
+            try:
+                inserted, skipped, rejected = database.bulk_load(records)
+                print(Fore.GREEN + f"Loaded {inserted} articles, skipped {skipped} stored ones." + Style.RESET_ALL)
+                failed_pages = {article.url for article in rejected}
+            except Exception as e:
+                print(Fore.RED + f"An error occurred: {e}" + Style.RESET_ALL)
+                failed_pages = set(pages)
+        else:
+            failed_pages = {article.url for article in database.store_many(records)}
+        if journal is not None:
+            journal.mark_many([page for page in pages if page not in failed_pages], STORED)
+            journal.mark_many([page for page in pages if page in failed_pages], FAILED, "Failed to store the articles")
+            journal.commit()
+
+    batch = []
+    pages = []
+    scraped = failed = 0
+    try:
+        for url, data, error in scraper.scrape_many(urls, workers=workers):
+            if error is not None:
+                failed += 1
+                print(Fore.RED + f"Failed to scrape {url}: {error}" + Style.RESET_ALL)
+                if journal is not None:
+                    journal.mark(url, FAILED, str(error))
+                continue
+            scraped += 1
+            if journal is not None:
+                journal.mark(url, PARSED)
+            batch.extend(data)
+            pages.append(url)
+            if len(batch) >= batch_size:
+                store(batch, pages)
+                batch, pages = [], []
+        if pages:
+            store(batch, pages)
+    finally:
+        if journal is not None:
+            journal.commit()
+
+    print(Fore.GREEN + f"Scraped {scraped} URLs, {failed} failed." + Style.RESET_ALL)
+    return scraped, failed
+
+
+def run_discovery(scraper, database, depth=DISCOVERY_DEPTH, refresh=0, sitemaps=True, batch_size=BATCH_SIZE,
+                  workers=0, rescrape=False, journal=None, retry_failed=False):
+    """
+    Discover new articles on the start pages and sitemaps of the sites and scrape them, repeated every
+    refresh seconds until interrupted
+    :param scraper: Scraper object
+    :param database: Database object
+    :param depth: Levels of section pages and sitemaps fetched per round
+    :param refresh: Seconds between the discovery rounds, 0 for a single round
+    :param sitemaps: Read the sitemaps of the sites in addition to the section pages
+    :param batch_size: Number of records to store per commit
+    :param workers: Number of parser processes, 0 parses in the main process
+    :param rescrape: Scrape the URLs which are already stored in the database again
+    :param journal: CrawlJournal recording the state of every URL, None to disable
+    :param retry_failed: Scrape the URLs which failed in an earlier run of the journal again
+    :return: Tuple of the number of scraped and failed URLs of the last round
+    """
+    discovery = Discovery(scraper, URLS, depth, sitemaps)
+    while True:
+        urls = discovery.discover()
+        print(Fore.GREEN + f"Discovered {len(urls)} new articles." + Style.RESET_ALL)
+        result = scrape_urls(urls, scraper, database, batch_size, workers, rescrape, journal, retry_failed)
+        if not refresh:
+            return result
+        time.sleep(refresh)
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line arguments for the headless batch mode
+    :param argv: Arguments to parse, defaults to sys.argv
+    :return: Parsed arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Scrape news articles into PostgreSQL. Without --batch the interactive CLI is started.",
+        epilog="The database password is read from the PGPASSWORD environment variable in batch mode.")
+    parser.add_argument('--batch', metavar='PATH',
+                        help="scrape all URLs of the .txt/.csv file (optionally .gz) without prompting")
+    parser.add_argument('--discover', action='store_true',
+                        help="scrape the new articles found on the start pages and sitemaps of the sites")
+    parser.add_argument('--depth', type=int, default=DISCOVERY_DEPTH,
+                        help="levels of section pages and sitemaps followed by --discover")
+    parser.add_argument('--refresh', type=float, default=0,
+                        help="repeat --discover every REFRESH seconds until interrupted")
+    parser.add_argument('--no-sitemaps', action='store_true', help="only follow the section pages with --discover")
+    parser.add_argument('--column', default='0', help="column name or index of the URLs in a .csv file")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="records stored per commit")
+    parser.add_argument('--workers', type=int, default=0, help="parser processes, 0 parses in the main process")
+    parser.add_argument('--bulk', action='store_true',
+                        help="load the records with COPY and skip stored titles, for backfills (raise --batch-size)")
+    parser.add_argument('--rescrape', action='store_true', help="scrape URLs which are already stored again")
+    parser.add_argument('--journal', metavar='PATH', help="crawl journal file to resume interrupted batches")
+    parser.add_argument('--retry-failed', action='store_true', help="scrape URLs which failed in the journal again")
+    parser.add_argument('--list-failed', action='store_true', help="list the failed URLs of the journal and exit")
+    parser.add_argument('--stream', action='store_true',
+                        help="stop downloading a page once its article is complete")
+    parser.add_argument('--cache', metavar='PATH', help="response cache file for conditional requests")
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE // (1024 * 1024), help="response cache size in MB")
+    parser.add_argument('--metrics-port', type=int, help="serve Prometheus metrics on this port at /metrics")
+    parser.add_argument('--metrics-json', metavar='PATH', help="write the metrics as JSON to this file periodically")
+    parser.add_argument('--metrics-interval', type=float, default=30.0, help="seconds between JSON metrics dumps")
+    parser.add_argument('--profile', metavar='PATH', help="profile the batch run and save the result to this file")
+    parser.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default='cprofile',
+                        help="profiler used by --profile")
+    parser.add_argument('--search', metavar='TERMS', help="search the stored articles and exit")
+    parser.add_argument('--list', action='store_true', help="list the newest stored articles and exit")
+    parser.add_argument('--autor', help="only show articles of this author with --search or --list")
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help="articles per page with --search or --list")
+    parser.add_argument('--export', metavar='PATH', help="export the stored articles to a .jsonl(.gz) or .parquet file")
+    parser.add_argument('--export-format', choices=FORMATS, help="format of --export, by default from the file name")
+    parser.add_argument('--watermark', metavar='PATH',
+                        help="only export the articles after the last export recorded in this file")
+    parser.add_argument('--watermark-by', choices=['id', 'time'], default='id',
+                        help="follow new rows (id) or newly published articles (time) with --watermark")
+    parser.add_argument('--partitioned', action='store_true',
+                        help="create a new article table range-partitioned by month of the publication time")
+    parser.add_argument('--migrate-partitions', action='store_true',
+                        help="move the articles of the existing table into a partitioned table and exit")
+    parser.add_argument('--retention', type=int, metavar='MONTHS',
+                        help="remove the partitions older than MONTHS months before the current one and exit")
+    parser.add_argument('--archive-schema', metavar='SCHEMA',
+                        help="detach the partitions removed by --retention into this schema instead of dropping them")
+    parser.add_argument('--db-connections', type=int, default=MAX_CONNECTIONS, help="size of the connection pool")
+    parser.add_argument('--user', help="database user, defaults to PGUSER")
+    parser.add_argument('--dbname', default=db_params['dbname'], help="database name")
+    parser.add_argument('--host', default=db_params['host'], help="database host")
+    parser.add_argument('--port', default=db_params['port'], help="database port")
+    return parser.parse_args(argv)
+
+
+def cli(argv=None):
+    """
+    Entry point which runs the batch mode if requested and the interactive CLI otherwise
+    :param argv: Command line arguments, defaults to sys.argv
+    :return: None
+    """
+    args = parse_args(argv)
+    journal = CrawlJournal(args.journal) if args.journal else None
+    if args.list_failed:
+        if journal is None:
+            print(Fore.RED + "--list-failed requires --journal." + Style.RESET_ALL)
+            sys.exit(1)
+        for url, attempts, error in journal.failed():
+            print(f"{url}\t{attempts}\t{error}")
+        journal.close()
+        return None
+    maintenance = args.migrate_partitions or args.retention is not None
+    if not (args.batch or args.discover or args.search or args.list or args.export or maintenance):
+        main()
+        return None
+
+    db_params.update(dbname=args.dbname, host=args.host, port=args.port)
+    if args.user:
+        db_params['user'] = args.user
+    try:
+        database = Database(db_params, max_connections=args.db_connections, partitioned=args.partitioned)
+    except Exception as e:
+        print(Fore.RED + f"Could not connect to the database: {e}" + Style.RESET_ALL)
+        sys.exit(1)
+    if maintenance:
+        try:
+            if args.migrate_partitions:
+                migrated = database.migrate_to_partitioned()
+                print(Fore.GREEN + ("The table is already partitioned." if migrated is None
+                                    else f"Migrated {migrated} articles to the partitioned table.") + Style.RESET_ALL)
+            if args.retention is not None:
+                for name in database.apply_retention(args.retention, args.archive_schema):
+                    print(f"{'Archived' if args.archive_schema else 'Dropped'} {name}")
+        except Exception as e:
+            print(Fore.RED + str(e) + Style.RESET_ALL)
+            sys.exit(1)
+        finally:
+            database.close()
+        return None
+    if args.export:
+        try:
+            count = export(database, args.export, args.export_format, args.watermark, args.watermark_by)
+            print(Fore.GREEN + f"Exported {count} articles to {args.export}." + Style.RESET_ALL)
+        except ValueError as e:
+            print(Fore.RED + str(e) + Style.RESET_ALL)
+            sys.exit(1)
+        finally:
+            database.close()
+        return None
+    if not (args.batch or args.discover):
+        try:
+            browse(database, args.search, args.autor, args.page_size)
+        finally:
+            database.close()
+        return None
+
+    cache = ResponseCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+    server = serve_prometheus(args.metrics_port) if args.metrics_port else None
+    dumper = JsonDumper(args.metrics_json, args.metrics_interval).start() if args.metrics_json else None
+    try:
+        with profiled(args.profile, args.profiler) if args.profile else nullcontext():
+            scraper = Scraper(cache=cache, stream=args.stream)
+            if args.discover:
+                run_discovery(scraper, database, args.depth, args.refresh, not args.no_sitemaps, args.batch_size,
+                              args.workers, args.rescrape, journal, args.retry_failed)
+            else:
+                run_batch(args.batch, scraper, database, args.batch_size, args.workers, args.rescrape, args.column,
+                          journal, args.retry_failed, args.bulk)
+    finally:
+        if server is not None:
+            server.shutdown()
+        if dumper is not None:
+            dumper.stop()
+        print(f"Database pool: {database.pool_stats()}")
+        database.close()
+        if cache is not None:
+            print(f"Response cache: {cache.stats()}")
+            cache.close()
+        if journal is not None:
+            print(f"Journal: {journal.counts()}")
+            journal.close()
 
 
 def main():
@@ -119,6 +446,8 @@ def main():
                     Choose one of the following commands:
                     - exit: Exit the application.
                     - display: Display a record from the database.
+                    - search: Search the stored articles.
+                    - list: List the newest stored articles.
                     - path: Enter a file path to scrape multiple URLs.
                     - url: Enter a URL to scrape.
             """)
@@ -132,6 +461,13 @@ def main():
             print(f"Total records in the database: {database.count_rows()}")
             index = input("Enter the ID of the record you want to display: ")
             database.display(index)
+        elif re.match(r'search', command):
+            query = input("Enter the search terms: ")
+            autor = input("Only articles of the author (leave empty for all): ")
+            browse(database, query, autor or None)
+        elif re.match(r'list', command):
+            autor = input("Only articles of the author (leave empty for all): ")
+            browse(database, autor=autor or None)
         elif re.match(r'path', command):
             urls = input("Enter the file path: ")
             if check_direcotry(urls):
@@ -157,5 +493,5 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    cli()
     exit()
@@ -0,0 +1,35 @@
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from src.fingerprint import content_hash, simhash
+
+# Columns of an article in the database table, followed by the fetch metadata and the fingerprints of the text
+FIELDS = ['title', 'time', 'autor', 'text', 'url', 'fetched', 'content_hash', 'simhash']
+
+
+class Article(namedtuple('Article', FIELDS, defaults=(None, None, None, None))):
+    """
+    Article scraped from a page, every parser returns a list of them. The record is a tuple without
+    per-instance __dict__, so large batches stay compact and can be handed to the database as rows.
+    url and fetched hold the page the article was scraped from and when it was fetched, content_hash and
+    simhash the fingerprints of the text, computed by the parser so they are not computed again when storing.
+    """
+    __slots__ = ()
+
+    def stamp(self, url, fetched=None):
+        """
+        Attach the source page and the fetch time to the article
+        :param url: URL of the page
+        :param fetched: Time of the fetch, defaults to now
+        :return: New Article with the metadata
+        """
+        return self._replace(url=url, fetched=fetched or datetime.now(timezone.utc))
+
+    def fingerprint(self):
+        """
+        Attach the hash and the SimHash of the normalized text unless they are already set
+        :return: Article with the fingerprints
+        """
+        if self.content_hash is not None and self.simhash is not None:
+            return self
+        return self._replace(content_hash=content_hash(self.text), simhash=simhash(self.text))
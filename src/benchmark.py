@@ -0,0 +1,370 @@
+"""
+Benchmark runner for the fetch, parse and store stages of the web scraper.
+
+Run it from the repository root:
+
+    python -m src.benchmark --out bench.json [--compare previous.json] [--dsn "dbname=web_scraper user=..."]
+
+Without --dsn the store benchmarks run against an in-process stand-in of PostgreSQL, which measures the
+statement building and batching of the Database class but not the server. With --dsn they write to the
+scratch table lb2_m122_benchmark, which is dropped after the run.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from unittest.mock import Mock, patch
+
+from psycopg2.extensions import adapt
+
+from src.database import Database
+from src.scraper import Scraper, FALLBACK_PARSER, PARSER_BACKENDS
+from src.stream import STREAM_CHUNK
+
+# Size of the generated fixtures, comparable to real article pages
+PARAGRAPHS = 120
+BOILERPLATE_BLOCKS = 400
+STORE_ROWS = 2000
+
+# Article text of the non-ASCII store benchmark, about 11 kB
+GERMAN_TEXT = 'Grüße aus Zürich… «Über die Brücke» – Straßenbahn.\n' * 180
+
+# Scratch table of the database benchmarks against a real PostgreSQL database, dropped after the run
+BENCHMARK_TABLE = 'lb2_m122_benchmark'
+
+# Relative slowdown reported as a regression by --compare
+REGRESSION_THRESHOLD = 0.10
+
+
+def boilerplate(blocks):
+    """
+    Build the scripts, navigation and teaser widgets surrounding the article of a news page
+    :param blocks: Number of teaser blocks
+    :return: Tuple of the scripts, the navigation and the footer HTML
+    """
+    state = ', '.join(f'{{"id": {i}}}' for i in range(200))
+    script = f'<script>window.__STATE__ = {{"teasers": [{state}]}};</script>'
+    teasers = [
+        f'<div class="teaser"><a href="/story/teaser-{i}"><img src="/img/{i}.jpg" alt="Teaser {i}">'
+        f'<span>Teaser headline number {i}</span></a></div>' for i in range(blocks)]
+    # The navigation repeats whole teaser blocks, a cut through a tag would break the parsers
+    return script * 5, f'<nav>{"".join(teasers[:blocks // 4])}</nav>', f'<footer>{"".join(teasers)}</footer>'
+
+
+def blick_fixture(paragraphs=PARAGRAPHS, blocks=BOILERPLATE_BLOCKS):
+    """
+    Build a full-size Blick.ch article page matching the selectors in src/sites.json
+    :param paragraphs: Number of paragraphs of the article
+    :param blocks: Number of teaser blocks around the article
+    :return: HTML string
+    """
+    scripts, nav, footer = boilerplate(blocks)
+    body = ''.join(
+        (f'<h3>Zwischentitel {i}</h3>' if i % 10 == 0 else '') +
+        f'<div class="text"><p>Absatz {i} mit <a href="/link-{i}">einem Link</a> und <b>fettem</b> Text. '
+        f'{"Lorem ipsum dolor sit amet. " * 8}</p></div>' for i in range(paragraphs))
+    return (f'<!DOCTYPE html><html><head><title>Blick</title>{scripts}</head><body>{nav}<main>'
+            f'<h2 class="sc-42b0166d-0 htRjAb">Blick Benchmark Titel</h2>'
+            f'<div class="sc-bb3977dc-0 gsPNmc">12.06.2024 um 14:00 Uhr</div>'
+            f'<span class="sc-4e82f8ca-0 kyLqjh">Autor Name</span>'
+            f'<article class="sc-845e3996-0 gMfVCb">{body}</article></main>{footer}</body></html>')
+
+
+def min_fixture(paragraphs=PARAGRAPHS, blocks=BOILERPLATE_BLOCKS):
+    """
+    Build a full-size 20min.ch article page matching the selectors in src/sites.json
+    :param paragraphs: Number of paragraphs of the article
+    :param blocks: Number of teaser blocks around the article
+    :return: HTML string
+    """
+    scripts, nav, footer = boilerplate(blocks)
+    body = ''.join(
+        (f'<div class="Article_elementCrosshead__b9pyw"><h2>Zwischentitel {i}</h2></div>' if i % 10 == 0 else '') +
+        f'<div class="Article_elementTextblockarray__WNyan"><p>Absatz {i} mit <a href="/link-{i}">einem Link</a>. '
+        f'{"Lorem ipsum dolor sit amet. " * 8}</p></div>' for i in range(paragraphs))
+    return (f'<!DOCTYPE html><html><head><title>20min</title>{scripts}</head><body>{nav}<main>'
+            f'<article class="Article_article__sV3bX Article_siteAreaNews__Frmfx">'
+            f'<header class="Article_header__ckSlm">'
+            f'<div class="Article_elementTitle__9QPjy"><h2>20min Benchmark Titel</h2></div>'
+            f'<div class="Article_elementPublishdate__qcso_"><time datetime="2024-06-12T14:00:00.000Z">'
+            f'12.06.2024 um 14:00 Uhr</time></div>'
+            f'<div class="Article_elementAuthors__LsHcz"><dd>Autor Name</dd></div></header>'
+            f'<section class="Article_body__60Liu">{body}</section></article></main>{footer}</body></html>')
+
+
+class StandInCursor:
+    """
+    Cursor of the PostgreSQL stand-in, it renders the statements like psycopg2 but never sends them
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+
+    def mogrify(self, query, args=None):
+        """
+        Render the query with the quoted arguments
+        :param query: Query with %s placeholders
+        :param args: Arguments of the query
+        :return: Rendered query as bytes
+        """
+        if isinstance(query, bytes):
+            query = query.decode()
+        if args is not None:
+            quoted = []
+            for arg in args:
+                adapted = adapt(arg)
+                if hasattr(adapted, 'encoding'):
+                    adapted.encoding = 'utf8'
+                quoted.append(adapted.getquoted().decode())
+            query = query % tuple(quoted)
+        return query.encode()
+
+    def execute(self, query, args=None):
+        """
+        Render the query and count it as executed
+        :param query: Query to execute
+        :param args: Arguments of the query
+        :return: None
+        """
+        self.connection.statements += 1
+        self.connection.bytes_sent += len(self.mogrify(query, args))
+        self.rowcount = 0
+
+    def copy_expert(self, query, file, size=8192):
+        """
+        Read the whole COPY payload and count it as sent
+        :param query: COPY statement
+        :param file: File-like object with the rows
+        :param size: Characters read at once
+        :return: None
+        """
+        self.execute(query)
+        while chunk := file.read(size):
+            self.connection.bytes_sent += len(chunk.encode())
+
+    def fetchone(self):
+        """
+        :return: Row of a COUNT(*) query on an empty table
+        """
+        return (0,)
+
+    def fetchall(self):
+        """
+        :return: No rows
+        """
+        return []
+
+    def close(self):
+        """
+        :return: None
+        """
+
+
+class StandInConnection:
+    """
+    Connection of the PostgreSQL stand-in counting the statements and the bytes that would be sent
+    """
+    encoding = 'UTF8'
+
+    def __init__(self):
+        self.statements = 0
+        self.bytes_sent = 0
+
+    def cursor(self):
+        """
+        :return: New stand-in cursor
+        """
+        return StandInCursor(self)
+
+    def commit(self):
+        """
+        :return: None
+        """
+
+    def rollback(self):
+        """
+        :return: None
+        """
+
+
+class StandInPool:
+    """
+    Connection pool of the PostgreSQL stand-in, it can be passed to the Database class
+    """
+
+    def __init__(self):
+        self.connection = StandInConnection()
+
+    def getconn(self):
+        """
+        :return: The stand-in connection
+        """
+        return self.connection
+
+    def putconn(self, conn):
+        """
+        :param conn: Connection to return
+        :return: None
+        """
+
+    def closeall(self):
+        """
+        :return: None
+        """
+
+
+def measure(function, iterations, unit_count=1):
+    """
+    Time a function and record its peak memory
+    :param function: Function to benchmark, called without arguments
+    :param iterations: Number of timed calls
+    :param unit_count: Number of units (pages, rows) processed per call
+    :return: Dictionary with the timing and memory results
+    """
+    function()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    total = sum(timings)
+    return {
+        'iterations': iterations,
+        'mean_ms': total / iterations * 1000,
+        'min_ms': min(timings) * 1000,
+        'units_per_sec': unit_count * iterations / total,
+        'peak_memory_kb': peak / 1024,
+    }
+
+
+def run_benchmarks(iterations=20, dsn=None):
+    """
+    Run all benchmarks
+    :param iterations: Number of timed calls per benchmark
+    :param dsn: Connection string of a real PostgreSQL database, None to use the stand-in
+    :return: Dictionary of benchmark name and results
+    """
+    blick_html = blick_fixture()
+    min_html = min_fixture()
+    results = {}
+
+    for backend in dict.fromkeys([*PARSER_BACKENDS, FALLBACK_PARSER]):
+        scraper = Scraper(parser=backend)
+        if scraper.parser != backend:
+            continue
+        results[f'parse_blick_ch[{backend}]'] = measure(lambda: scraper.parse_blick_ch(blick_html), iterations)
+        results[f'parse_20min_ch[{backend}]'] = measure(lambda: scraper.parse_20min_ch(min_html), iterations)
+
+    # No rate limit, the benchmark measures the engine and not the politeness settings
+    scraper = Scraper(rates={}, default_rate=1e9)
+    results['parse_datetime_from_string'] = measure(
+        lambda: [scraper.parse_datetime_from_string('12.06.2024 um 14:00 Uhr') for _ in range(1000)],
+        iterations, 1000)
+
+    page = Mock(status_code=200, content=blick_html.encode(), headers={}, ok=True)
+    with patch.object(scraper.session, 'get', return_value=page):
+        results['scrape_many[fetch+parse]'] = measure(
+            lambda: list(scraper.scrape_many([f'https://www.blick.ch/story-{i}' for i in range(20)])),
+            max(1, iterations // 5), 20)
+
+    # Single page scrape with the full download against the streaming mode stopping after the article
+    streaming = Scraper(rates={}, default_rate=1e9, stream=True)
+    chunks = [page.content[i:i + STREAM_CHUNK] for i in range(0, len(page.content), STREAM_CHUNK)]
+    streamed = Mock(status_code=200, headers={}, ok=True, iter_content=lambda chunk_size: iter(chunks))
+    with patch.object(scraper.session, 'get', return_value=page):
+        results['scrape'] = measure(lambda: scraper.scrape('https://www.blick.ch/story'), iterations)
+    with patch.object(streaming.session, 'get', return_value=streamed):
+        results['scrape[stream]'] = measure(lambda: streaming.scrape('https://www.blick.ch/story'), iterations)
+
+    # The rows written against a real database go to a scratch table which is dropped afterwards
+    database = Database({'dsn': dsn}, table_name=BENCHMARK_TABLE) if dsn else Database({}, pool=StandInPool())
+    article = scraper.parse_blick_ch(blick_html)[0]
+    rows = [article._replace(title=f'{article.title} {i}', url=f'https://www.blick.ch/story-{i}')
+            for i in range(STORE_ROWS)]
+    # German text with umlauts and typographic characters, which is slower to escape than ASCII
+    umlauts = article._replace(text=GERMAN_TEXT, content_hash=None, simhash=None).fingerprint()
+    german = [umlauts._replace(title=f'{article.title} {i}', url=f'https://www.blick.ch/story-{i}')
+              for i in range(STORE_ROWS)]
+    try:
+        results['store_many'] = measure(lambda: database.store_many(rows), max(1, iterations // 5), STORE_ROWS)
+        results['store_data'] = measure(lambda: database.store_data(rows[:1]), iterations)
+        results['bulk_load'] = measure(lambda: database.bulk_load(rows), max(1, iterations // 5), STORE_ROWS)
+        results['bulk_load[non-ascii]'] = measure(lambda: database.bulk_load(german), max(1, iterations // 5),
+                                                  STORE_ROWS)
+    finally:
+        if dsn:
+            with database.transaction() as cur:
+                cur.execute(f"DROP TABLE IF EXISTS {database.table_name};")
+        database.close()
+
+    for name, html in [('blick_fixture', blick_html), ('20min_fixture', min_html)]:
+        results[name] = {'bytes': len(html.encode())}
+    return results
+
+
+def compare(results, previous, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare the results with an earlier run and list the benchmarks which got slower
+    :param results: Results of this run
+    :param previous: Results of the earlier run
+    :param threshold: Relative slowdown of the fastest call reported as a regression
+    :return: List of (name, previous min, current min) tuples
+    """
+    regressions = []
+    for name, result in results.items():
+        before = previous.get(name, {}).get('min_ms')
+        if before and 'min_ms' in result and result['min_ms'] > before * (1 + threshold):
+            regressions.append((name, before, result['min_ms']))
+    return regressions
+
+
+def main(argv=None):
+    """
+    Run the benchmarks, print and save the results as JSON and compare them with an earlier run
+    :param argv: Command line arguments, defaults to sys.argv
+    :return: Exit code, 1 if a regression was found
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the fetch, parse and store stages of the scraper.")
+    parser.add_argument('--iterations', type=int, default=20, help="timed calls per benchmark")
+    parser.add_argument('--out', metavar='PATH', help="save the results as JSON")
+    parser.add_argument('--compare', metavar='PATH', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--dsn', help="PostgreSQL connection string, the stand-in is used if omitted")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.iterations, args.dsn)
+    for name, result in results.items():
+        if 'mean_ms' in result:
+            print(f"{name:40} {result['mean_ms']:10.3f} ms {result['units_per_sec']:12.1f}/s "
+                  f"{result['peak_memory_kb']:10.1f} KiB peak")
+
+    if args.out:
+        report = {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'database': 'postgresql' if args.dsn else 'stand-in',
+            'results': results,
+        }
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+        regressions = compare(results, previous)
+        for name, before, after in regressions:
+            print(f"Regression: {name} {before:.3f} ms -> {after:.3f} ms")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
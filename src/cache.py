@@ -0,0 +1,139 @@
+import pickle
+import sqlite3
+import threading
+import time
+
+# Default size cap of the response cache in bytes
+CACHE_SIZE = 64 * 1024 * 1024
+
+
+class ResponseCache:
+    """
+    On-disk cache of the fetched pages to send conditional requests (ETag / Last-Modified).
+    Only the validators and the parsed data are kept, so an unchanged page is neither downloaded nor parsed again.
+    """
+
+    def __init__(self, path, max_bytes=CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                data BLOB,
+                size INTEGER NOT NULL DEFAULT 0,
+                accessed REAL NOT NULL
+            );
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);")
+        self.conn.commit()
+
+    def validators(self, url):
+        """
+        Get the conditional request headers for the URL if its parsed data is cached
+        :param url: URL of the page
+        :return: Dictionary with the If-None-Match / If-Modified-Since headers, empty if not cached
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified FROM responses WHERE url = ? AND data IS NOT NULL;", (url,)).fetchone()
+        headers = {}
+        if row:
+            etag, last_modified = row
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def hit(self, url):
+        """
+        Get the cached parsed data of a page the server reported as not modified
+        :param url: URL of the page
+        :return: Parsed data, None if the page is not cached anymore
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM responses WHERE url = ?;", (url,)).fetchone()
+            if not row or row[0] is None:
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE url = ?;", (time.time(), url))
+            self.conn.commit()
+        return pickle.loads(row[0])
+
+    def miss(self, url, response):
+        """
+        Remember the validators of a downloaded page until its parsed data is stored
+        :param url: URL of the page
+        :param response: Response of the download
+        :return: None
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with self.lock:
+            self.misses += 1
+            if not etag and not last_modified:
+                self.conn.execute("DELETE FROM responses WHERE url = ?;", (url,))
+            else:
+                self.conn.execute(
+                    """
+                    INSERT INTO responses (url, etag, last_modified, data, size, accessed)
+                    VALUES (?, ?, ?, NULL, 0, ?)
+                    ON CONFLICT (url) DO UPDATE SET
+                        etag = excluded.etag, last_modified = excluded.last_modified, data = NULL, size = 0,
+                        accessed = excluded.accessed;
+                    """,
+                    (url, etag, last_modified, time.time()))
+            self.conn.commit()
+
+    def store(self, url, data):
+        """
+        Store the parsed data of a downloaded page and evict the least recently used pages above the size cap
+        :param url: URL of the page
+        :param data: Parsed data of the page
+        :return: None
+        """
+        blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE responses SET data = ?, size = ?, accessed = ? WHERE url = ?;",
+                (blob, len(blob), time.time(), url))
+            if cursor.rowcount:
+                self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        """
+        Delete the least recently used pages until the cache fits into the size cap, the lock must be held
+        :return: None
+        """
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses;").fetchone()[0]
+        if total <= self.max_bytes:
+            return None
+        for url, size in self.conn.execute("SELECT url, size FROM responses ORDER BY accessed;").fetchall():
+            self.conn.execute("DELETE FROM responses WHERE url = ?;", (url,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        """
+        Get the hit and miss counters and the current size of the cache
+        :return: Dictionary with the cache statistics
+        """
+        with self.lock:
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses;").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': size}
+
+    def close(self):
+        """
+        Close the cache database
+        :return: None
+        """
+        self.conn.close()
@@ -0,0 +1,87 @@
+import json
+import os
+import socket
+
+# Settings of the daemon, each can be set in the config file or with an environment variable SCRAPER_<NAME>
+DEFAULTS = {
+    'dbname': 'web_scraper',
+    'host': 'localhost',
+    'port': '5432',
+    'user': '',
+    'password': '',
+    'db_connections': 10,
+    'partitioned': False,
+    'claim_size': 50,
+    'workers': 0,
+    'idle_sleep': 5.0,
+    'lease_seconds': 600,
+    'max_attempts': 3,
+    'cache': '',
+    'cache_size': 64,
+    'stream': False,
+    'metrics_port': 0,
+    'worker_id': '',
+    'discover_depth': 1,
+    'discover_interval': 300.0,
+    'sitemaps': True,
+}
+
+# Standard PostgreSQL environment variables, used if the SCRAPER_ variable is not set
+PG_ENVIRONMENT = {'dbname': 'PGDATABASE', 'host': 'PGHOST', 'port': 'PGPORT', 'user': 'PGUSER',
+                  'password': 'PGPASSWORD'}
+
+
+def convert(value, default):
+    """
+    Convert a setting given as a string to the type of its default value
+    :param value: Value from the environment
+    :param default: Default value of the setting
+    :return: Converted value
+    """
+    if isinstance(default, bool):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return type(default)(value)
+
+
+def load_config(path=None, environ=None):
+    """
+    Load the daemon settings from the defaults, the config file and the environment, later sources win
+    :param path: JSON or YAML config file (YAML requires PyYAML), None to use the defaults and the environment
+    :param environ: Environment variables, defaults to os.environ
+    :return: Dictionary of the settings
+    """
+    environ = os.environ if environ is None else environ
+    config = dict(DEFAULTS)
+    if path:
+        with open(path) as f:
+            if path.endswith(('.yaml', '.yml')):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ValueError("PyYAML is required to load the config from YAML files.")
+                values = yaml.safe_load(f) or {}
+            else:
+                values = json.load(f)
+        unknown = set(values) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown settings in {path}: {', '.join(sorted(unknown))}")
+        config.update(values)
+
+    for name, default in DEFAULTS.items():
+        for variable in (f'SCRAPER_{name.upper()}', PG_ENVIRONMENT.get(name)):
+            if variable and environ.get(variable):
+                config[name] = convert(environ[variable], default)
+                break
+
+    if not config['worker_id']:
+        config['worker_id'] = f'{socket.gethostname()}:{os.getpid()}'
+    return config
+
+
+def db_params(config):
+    """
+    Get the connection parameters of psycopg2 from the settings
+    :param config: Settings as returned by load_config
+    :return: Dictionary of connection parameters
+    """
+    return {name: config[name] for name in ('dbname', 'host', 'port', 'user', 'password') if config[name]}
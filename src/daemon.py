@@ -0,0 +1,219 @@
+"""
+Scraper daemon pulling URLs from the shared work queue in PostgreSQL.
+
+Run it from the repository root, the settings are read from the file and the environment (see src/config.py):
+
+    SCRAPER_CONFIG=scraper.json PGPASSWORD=secret python -m src.daemon
+    python -m src.daemon --config scraper.json --enqueue dummy_data/dummy_data.txt
+    python -m src.daemon --config scraper.json --discover
+
+Start as many daemons on as many machines as needed, they share the queue. SIGTERM or SIGINT stops a daemon
+after the pages in progress are stored, the URLs it claimed but did not scrape go back to the queue.
+With --discover the daemon adds the new articles of the sites to the queue every discover_interval seconds instead.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from colorama import Fore, Style, init
+
+from src.cache import ResponseCache
+from src.config import db_params, load_config
+from src.database import Database
+from src.discovery import Discovery
+from src.metrics import METRICS, serve_prometheus
+from src.scraper import Scraper
+from src.urls import batched, read_urls
+from src.variables import BLICK_URL, MIN_URL
+from src.workqueue import WorkQueue
+
+# Number of URLs added to the queue with one statement
+ENQUEUE_BATCH = 1000
+
+
+class Daemon:
+    """
+    Long-running worker which keeps its HTTP session and database pool open across jobs
+    """
+
+    def __init__(self, config, database=None, scraper=None):
+        self.config = config
+        self.worker = config['worker_id']
+        self.database = database or Database(db_params(config), max_connections=config['db_connections'],
+                                             partitioned=config['partitioned'])
+        self.cache = None
+        if scraper is None:
+            if config['cache']:
+                self.cache = ResponseCache(config['cache'], config['cache_size'] * 1024 * 1024)
+            scraper = Scraper(cache=self.cache, stream=config['stream'])
+        self.scraper = scraper
+        # The rate limits and the parser processes are kept warm across the claimed batches
+        self.scheduler = scraper.make_scheduler()
+        self.pool = ProcessPoolExecutor(max_workers=config['workers']) if config['workers'] else None
+        self.queue = WorkQueue(self.database, config['lease_seconds'], config['max_attempts'])
+        self.stopping = threading.Event()
+
+    def stop(self, *args):
+        """
+        Ask the daemon to stop after the pages in progress, used as signal handler
+        :return: None
+        """
+        if not self.stopping.is_set():
+            print(Fore.GREEN + "Stopping after the pages in progress..." + Style.RESET_ALL)
+        self.stopping.set()
+
+    def run(self):
+        """
+        Claim and scrape URLs until the daemon is stopped
+        :return: None
+        """
+        print(Fore.GREEN + f"Worker {self.worker} started." + Style.RESET_ALL)
+        try:
+            while not self.stopping.is_set():
+                claimed = self.queue.claim(self.worker, self.config['claim_size'])
+                if not claimed:
+                    self.stopping.wait(self.config['idle_sleep'])
+                    continue
+                self.process(claimed)
+        finally:
+            self.close()
+
+    def process(self, claimed):
+        """
+        Scrape the claimed URLs, store the results with one statement and update the queue
+        :param claimed: Dictionary of the claimed URLs and their attempt
+        :return: Tuple of the number of scraped and failed URLs
+        """
+        pending = dict(claimed)
+        articles = []
+        scraped = []
+        failed = 0
+        results = self.scraper.scrape_many(list(claimed), workers=self.config['workers'], scheduler=self.scheduler,
+                                           pool=self.pool)
+        try:
+            for url, data, error in results:
+                attempt = pending.pop(url)
+                if error is not None:
+                    failed += 1
+                    retry = self.queue.fail(self.worker, url, attempt, str(error))
+                    METRICS.inc('daemon_urls_total', result='retried' if retry else 'failed')
+                else:
+                    articles.extend(data)
+                    scraped.append(url)
+                if self.stopping.is_set():
+                    break
+        finally:
+            results.close()
+            self.store(articles, scraped, claimed)
+            # URLs left when the daemon stops go back to the queue for the other workers
+            self.queue.release(self.worker, list(pending))
+        return len(scraped), failed
+
+    def store(self, articles, urls, claimed):
+        """
+        Store the scraped articles and mark their pages as done, the pages of articles which could not be stored
+        are retried
+        :param articles: List of Articles
+        :param urls: List of the scraped URLs
+        :param claimed: Dictionary of the claimed URLs and their attempt
+        :return: None
+        """
+        if not urls:
+            return None
+        failed = {article.url for article in self.database.store_many(articles)}
+        stored = [url for url in urls if url not in failed]
+        if stored:
+            self.queue.complete(self.worker, stored)
+            METRICS.inc('daemon_urls_total', len(stored), result='done')
+        for url in urls:
+            if url in failed:
+                retry = self.queue.fail(self.worker, url, claimed[url], "Failed to store the articles")
+                METRICS.inc('daemon_urls_total', result='retried' if retry else 'failed')
+
+    def enqueue(self, path):
+        """
+        Add the URLs of a .txt or .csv file to the queue
+        :param path: File with the URLs
+        :return: Number of URLs added
+        """
+        return sum(self.queue.enqueue(chunk) for chunk in batched(read_urls(path), ENQUEUE_BATCH))
+
+    def discover(self):
+        """
+        Add the new articles of the sites to the queue every discover_interval seconds until the daemon is stopped
+        :return: None
+        """
+        config = self.config
+        discovery = Discovery(self.scraper, [BLICK_URL, MIN_URL], config['discover_depth'], config['sitemaps'])
+        try:
+            while not self.stopping.is_set():
+                added = sum(self.queue.enqueue(chunk) for chunk in batched(discovery.discover(), ENQUEUE_BATCH))
+                print(Fore.GREEN + f"Added {added} discovered articles to the queue." + Style.RESET_ALL)
+                self.stopping.wait(config['discover_interval'])
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Close the database pool, the parser processes and the response cache
+        :return: None
+        """
+        print(f"Queue: {self.queue.counts()}")
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+        self.database.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def main(argv=None):
+    """
+    Start the daemon, or add URLs to the queue and exit
+    :param argv: Command line arguments, defaults to sys.argv
+    :return: Exit code
+    """
+    parser = argparse.ArgumentParser(description="Scrape the URLs of the shared work queue until stopped.")
+    parser.add_argument('--config', default=os.environ.get('SCRAPER_CONFIG'),
+                        help="JSON or YAML settings file, defaults to SCRAPER_CONFIG")
+    parser.add_argument('--enqueue', metavar='PATH', help="add the URLs of the .txt/.csv file to the queue and exit")
+    parser.add_argument('--discover', action='store_true',
+                        help="add the new articles of the sites to the queue periodically instead of scraping")
+    args = parser.parse_args(argv)
+
+    init()
+    try:
+        config = load_config(args.config)
+        daemon = Daemon(config)
+    except Exception as e:
+        print(Fore.RED + f"Could not start the daemon: {e}" + Style.RESET_ALL)
+        return 1
+
+    if args.enqueue:
+        try:
+            print(Fore.GREEN + f"Added {daemon.enqueue(args.enqueue)} URLs to the queue." + Style.RESET_ALL)
+        except (ValueError, FileNotFoundError) as e:
+            print(Fore.RED + str(e) + Style.RESET_ALL)
+            return 1
+        finally:
+            daemon.close()
+        return 0
+
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    server = serve_prometheus(config['metrics_port']) if config['metrics_port'] else None
+    try:
+        if args.discover:
+            daemon.discover()
+        else:
+            daemon.run()
+    finally:
+        if server is not None:
+            server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,38 +1,481 @@
-import psycopg2
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from itertools import islice
+
 from colorama import Fore, Style
+from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+from src.dates import DEFAULT_TIMEZONE, get_timezone
+from src.fingerprint import NEAR_DUPLICATE_DISTANCE, bands, simhash
+from src.metrics import METRICS
+
+# Table of the articles
+TABLE_NAME = 'lb2_m122'
+
+# Columns of the table in the current version
+COLUMNS = ['id', 'title', 'time', 'autor', 'text', 'url', 'search', 'content_hash', 'simhash']
+
+# Default size of the connection pool and the seconds to wait for a free connection
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 10
+POOL_TIMEOUT = 30
+
+# Text search configuration of the articles and the number of articles shown per page
+SEARCH_CONFIG = 'german'
+PAGE_SIZE = 20
+
+# Rows fetched per round trip when the articles are streamed with a server-side cursor
+EXPORT_ITERSIZE = 2000
+
+# Tables with more rows than this report the planner's estimate instead of an exact count
+ESTIMATE_THRESHOLD = 100000
+
+# Articles copied into the staging table and merged per transaction by the bulk loader
+BULK_CHUNK = 50000
+
+# Months of partitions created ahead of the current month when the table is partitioned by time
+PARTITIONS_AHEAD = 3
+
+# Maximum length of the title and autor columns
+TEXT_LENGTH = 255
+
+
+def copy_text(value):
+    """
+    Write a value in the text format of COPY
+    :param value: Value of a column
+    :return: Escaped text
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bytes):
+        return '\\\\x' + value.hex()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    # Chained replace stays fast on non-ASCII text, unlike str.translate with multi-character replacements
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def invalid_reason(article):
+    """
+    Check an article against the constraints of the table before it is written
+    :param article: Article to check
+    :return: Reason why the article can't be stored, None if it is valid
+    """
+    for field in ('title', 'autor', 'text'):
+        if not getattr(article, field):
+            return f"{field} is missing"
+    if article.time is None:
+        return "publication time is missing"
+    for field in ('title', 'autor'):
+        if len(getattr(article, field)) > TEXT_LENGTH:
+            return f"{field} is longer than {TEXT_LENGTH} characters"
+    return None
+
+
+def valid_articles(articles, rejected):
+    """
+    Skip the articles which violate the constraints of the table and report them
+    :param articles: Iterable of Articles
+    :param rejected: List receiving the skipped Articles
+    :return: Generator of the valid Articles
+    """
+    for article in articles:
+        reason = invalid_reason(article)
+        if reason is None:
+            yield article
+            continue
+        print(Fore.RED + f"Skipped the article {article.title!r} of {article.url}: {reason}" + Style.RESET_ALL)
+        METRICS.inc('database_rows_total', result='invalid')
+        rejected.append(article)
+
+
+def article_row(article):
+    """
+    Build the row of an article, the fingerprints are only computed if the parser didn't attach them
+    :param article: Article carrying its URL
+    :return: Tuple of the title, time, autor, text, url, content_hash and simhash columns
+    """
+    article = article.fingerprint()
+    return *article[:5], article.content_hash, article.simhash
+
+
+def add_months(month, count):
+    """
+    Move the first day of a month by a number of months
+    :param month: First day of the month
+    :param count: Number of months, negative to go back
+    :return: First day of the resulting month
+    """
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
 
-from src.variables import MIN_URL
+
+def month_of(value):
+    """
+    Get the month of a publication time in the timezone the partitions are cut in
+    :param value: Timezone-aware datetime
+    :return: First day of the month
+    """
+    local = value.astimezone(get_timezone(DEFAULT_TIMEZONE))
+    return date(local.year, local.month, 1)
+
+
+class CopyStream:
+    """
+    File-like object handing rows to COPY FROM STDIN as they are read, so the payload is never built in memory
+    """
+
+    def __init__(self, rows):
+        self.lines = ('\t'.join(map(copy_text, row)) + '\n' for row in rows)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        """
+        Read the next rows in the text format of COPY
+        :param size: Maximum number of characters, -1 for all remaining rows
+        :return: Text of the rows, empty at the end
+        """
+        pieces = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            pieces.append(line)
+            length += len(line)
+        data = ''.join(pieces)
+        if size < 0:
+            self.buffer = ''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
 
 
 class Database:
     """
-    Database class to handle the database connection and operations for the web scraper
+    Database class to handle the database connection and operations for the web scraper.
+    Every operation checks out its own connection from a pool, so it can be used from many threads.
+    The table can be range-partitioned by month of the publication time, an existing table keeps its layout.
     """
 
-    def __init__(self, db_params):
-        self.table_name = 'lb2_m122'
+    def __init__(self, db_params, min_connections=MIN_CONNECTIONS, max_connections=MAX_CONNECTIONS,
+                 pool_timeout=POOL_TIMEOUT, pool=None, partitioned=False, table_name=TABLE_NAME):
+        self.table_name = table_name
+        self.partitioned = partitioned
+        # Months whose partition is known to exist
+        self.partitions = set()
         self.db_params = db_params
-        self.conn = psycopg2.connect(**self.db_params)
-        self.cur = self.conn.cursor()
+        self.max_connections = max_connections
+        self.pool_timeout = pool_timeout
+        self.pool = pool or ThreadedConnectionPool(min_connections, max_connections, **self.db_params)
+        self.free_connections = threading.BoundedSemaphore(max_connections)
+        self.metrics_lock = threading.Lock()
+        self.metrics = {'checkouts': 0, 'in_use': 0, 'wait_seconds_total': 0.0, 'wait_seconds_max': 0.0,
+                        'timeouts': 0}
         self.create_table()
 
+    @contextmanager
+    def transaction(self, name=None):
+        """
+        Check out a connection from the pool for one operation and commit it, or roll it back on an error
+        :param name: Name of a server-side cursor, None for a client-side cursor
+        :return: Context manager yielding a cursor
+        """
+        start = time.perf_counter()
+        if not self.free_connections.acquire(timeout=self.pool_timeout):
+            with self.metrics_lock:
+                self.metrics['timeouts'] += 1
+            raise PoolError(f"No database connection available after {self.pool_timeout} seconds")
+        waited = time.perf_counter() - start
+        with self.metrics_lock:
+            self.metrics['checkouts'] += 1
+            self.metrics['in_use'] += 1
+            self.metrics['wait_seconds_total'] += waited
+            self.metrics['wait_seconds_max'] = max(self.metrics['wait_seconds_max'], waited)
+
+        try:
+            conn = self.pool.getconn()
+            try:
+                cur = conn.cursor(name) if name else conn.cursor()
+                try:
+                    yield cur
+                finally:
+                    cur.close()
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self.pool.putconn(conn)
+        finally:
+            with self.metrics_lock:
+                self.metrics['in_use'] -= 1
+            self.free_connections.release()
+
+    def pool_stats(self):
+        """
+        Get the pool sizing and the time spent waiting for a free connection
+        :return: Dictionary with the pool metrics
+        """
+        with self.metrics_lock:
+            return {'max_connections': self.max_connections, **self.metrics}
+
+    @property
+    def unique_key(self):
+        """
+        Columns identifying an article, unique constraints of a partitioned table must contain the time
+        :return: Comma-separated column names
+        """
+        return 'title, time' if self.partitioned else 'title'
+
     def create_table(self):
         """
-        Create the table if it doesn't exist in the database
+        Create the table if it doesn't exist in the database, partitioned by time if requested.
+        The layout of an existing table is detected, so every client follows a migration. The schema statements
+        are only sent if a column or index is missing: ALTER TABLE locks the table even if it changes nothing,
+        which would block every start behind a running export.
         :return: None
         """
-        self.cur.execute(
-            f"""
-            CREATE TABLE IF NOT EXISTS {self.table_name} (
-                id SERIAL PRIMARY KEY,
-                title varchar(255) UNIQUE NOT NULL,
-                time TIMESTAMP NOT NULL,
-                autor varchar(255) NOT NULL,
-                text text NOT NULL
-            );
+        with self.transaction() as cur:
+            cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (self.table_name,))
+            row = cur.fetchone()
+            if row:
+                self.partitioned = row[0] == 'p'
+            if not (row and self.schema_current(cur)):
+                cur.execute(self.partitioned_sql() if self.partitioned else self.flat_sql())
+            created = set()
+            if self.partitioned:
+                self.partitions |= {month for month in map(self.partition_month, self.partition_names(cur))
+                                    if month is not None}
+                current = month_of(datetime.now(timezone.utc))
+                created = self.create_partitions(cur, [add_months(current, i) for i in range(PARTITIONS_AHEAD + 1)])
+        self.partitions |= created
+
+    def schema_current(self, cur):
+        """
+        Check if the existing table has all columns and indexes of the current version
+        :param cur: Cursor of the running transaction
+        :return: True if no schema statement is needed
+        """
+        indexes = sorted(self.index_names())
+        cur.execute(
             """
-        )
-        self.conn.commit()
+            SELECT (SELECT COUNT(*) FROM information_schema.columns
+                    WHERE table_name = %s AND column_name = ANY(%s)) = %s
+                AND EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = %s
+                            AND column_name = 'time' AND data_type = 'timestamp with time zone')
+                AND (SELECT COUNT(*) FROM pg_indexes WHERE tablename = %s AND indexname = ANY(%s)) = %s;
+            """,
+            (self.table_name, COLUMNS, len(COLUMNS), self.table_name, self.table_name, indexes, len(indexes)))
+        return cur.fetchone()[0] is True
+
+    def index_names(self):
+        """
+        :return: Set of the names of the indexes created by flat_sql and partitioned_sql
+        """
+        names = {f'{self.table_name}_{name}_idx' for name in ('url', 'search', 'time', 'autor', 'hash')}
+        return names | {f'{self.table_name}_simhash{i}_idx' for i in range(len(bands(0)))}
+
+    def flat_sql(self):
+        """
+        Build the statements creating the unpartitioned table and migrating the columns of older versions
+        :return: SQL statements
+        """
+        return f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    id SERIAL PRIMARY KEY,
+                    title varchar(255) UNIQUE NOT NULL,
+                    time TIMESTAMPTZ NOT NULL,
+                    autor varchar(255) NOT NULL,
+                    text text NOT NULL,
+                    url text
+                );
+                ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS url text;
+                CREATE INDEX IF NOT EXISTS {self.table_name}_url_idx ON {self.table_name} (url);
+                ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS search tsvector GENERATED ALWAYS AS (
+                    setweight(to_tsvector('{SEARCH_CONFIG}', title), 'A') ||
+                    setweight(to_tsvector('{SEARCH_CONFIG}', text), 'B')
+                ) STORED;
+                CREATE INDEX IF NOT EXISTS {self.table_name}_search_idx ON {self.table_name} USING GIN (search);
+                CREATE INDEX IF NOT EXISTS {self.table_name}_time_idx ON {self.table_name} (time, id);
+                CREATE INDEX IF NOT EXISTS {self.table_name}_autor_idx ON {self.table_name} (autor, time);
+                ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS content_hash bytea;
+                ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS simhash bigint;
+                CREATE INDEX IF NOT EXISTS {self.table_name}_hash_idx ON {self.table_name} (url, content_hash);
+{self.simhash_indexes()}
+                DO $$ BEGIN
+                    IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = '{self.table_name}'
+                               AND column_name = 'time' AND data_type = 'timestamp without time zone') THEN
+                        -- 20min.ch published UTC times, all other rows are Swiss local time
+                        ALTER TABLE {self.table_name} ALTER COLUMN time TYPE TIMESTAMPTZ
+                            USING time AT TIME ZONE CASE WHEN url LIKE '%20min.ch%' THEN 'UTC'
+                                ELSE '{DEFAULT_TIMEZONE}' END;
+                    END IF;
+                END $$;
+                """
+
+    def partitioned_sql(self):
+        """
+        Build the statements creating the table partitioned by month of the publication time
+        :return: SQL statements
+        """
+        return f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    id SERIAL,
+                    title varchar(255) NOT NULL,
+                    time TIMESTAMPTZ NOT NULL,
+                    autor varchar(255) NOT NULL,
+                    text text NOT NULL,
+                    url text,
+                    search tsvector GENERATED ALWAYS AS (
+                        setweight(to_tsvector('{SEARCH_CONFIG}', title), 'A') ||
+                        setweight(to_tsvector('{SEARCH_CONFIG}', text), 'B')
+                    ) STORED,
+                    content_hash bytea,
+                    simhash bigint,
+                    PRIMARY KEY (id, time),
+                    UNIQUE (title, time)
+                ) PARTITION BY RANGE (time);
+                CREATE INDEX IF NOT EXISTS {self.table_name}_url_idx ON {self.table_name} (url);
+                CREATE INDEX IF NOT EXISTS {self.table_name}_search_idx ON {self.table_name} USING GIN (search);
+                CREATE INDEX IF NOT EXISTS {self.table_name}_time_idx ON {self.table_name} (time, id);
+                CREATE INDEX IF NOT EXISTS {self.table_name}_autor_idx ON {self.table_name} (autor, time);
+                CREATE INDEX IF NOT EXISTS {self.table_name}_hash_idx ON {self.table_name} (url, content_hash);
+{self.simhash_indexes()}
+                """
+
+    def partition_names(self, cur):
+        """
+        List the partitions of the table
+        :param cur: Cursor of the running transaction
+        :return: List of the names of the partitions
+        """
+        cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+                    " WHERE i.inhparent = to_regclass(%s);", (self.table_name,))
+        return [row[0] for row in cur.fetchall()]
+
+    def partition_month(self, name):
+        """
+        :param name: Name of a partition
+        :return: First day of the month the partition holds, None if it isn't a monthly partition
+        """
+        suffix = name[len(f'{self.table_name}_p'):]
+        if not name.startswith(f'{self.table_name}_p') or len(suffix) != 6 or not suffix.isdigit():
+            return None
+        return date(int(suffix[:4]), int(suffix[4:]), 1)
+
+    def partition_name(self, month):
+        """
+        :param month: First day of the month
+        :return: Name of the partition holding the articles of the month
+        """
+        return f'{self.table_name}_p{month:%Y%m}'
+
+    def create_partitions(self, cur, months):
+        """
+        Create the partitions of the given months unless they are known to exist
+        :param cur: Cursor of the running transaction
+        :param months: Iterable of first days of months
+        :return: Set of the months whose partition was created, to be added to self.partitions after the commit
+        """
+        created = set(months) - self.partitions
+        for month in sorted(created):
+            cur.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.partition_name(month)} PARTITION OF {self.table_name}"
+                f" FOR VALUES FROM ('{month} 00:00 {DEFAULT_TIMEZONE}')"
+                f" TO ('{add_months(month, 1)} 00:00 {DEFAULT_TIMEZONE}');")
+        return created
+
+    def migrate_to_partitioned(self):
+        """
+        Move the articles of the unpartitioned table into a new table partitioned by month, in one transaction.
+        The old table is kept as {table_name}_flat with its indexes renamed, drop it once the migration is checked.
+        :return: Number of migrated articles, None if the table is already partitioned
+        """
+        if self.partitioned:
+            return None
+        flat = f'{self.table_name}_flat'
+        columns = 'id, title, time, autor, text, url, content_hash, simhash'
+        with self.transaction() as cur:
+            cur.execute(f"LOCK TABLE {self.table_name} IN ACCESS EXCLUSIVE MODE;")
+            cur.execute(
+                f"""
+                ALTER TABLE {self.table_name} RENAME TO {flat};
+                ALTER SEQUENCE IF EXISTS {self.table_name}_id_seq RENAME TO {flat}_id_seq;
+                DO $$ DECLARE index_name text; BEGIN
+                    FOR index_name IN SELECT indexrelid::regclass::text FROM pg_index
+                                      WHERE indrelid = '{flat}'::regclass LOOP
+                        EXECUTE format('ALTER INDEX %I RENAME TO %I', index_name, index_name || '_flat');
+                    END LOOP;
+                END $$;
+                """
+            )
+            cur.execute(self.partitioned_sql())
+            cur.execute(f"SELECT MIN(time), MAX(time) FROM {flat};")
+            first, last = cur.fetchone()
+            current = month_of(datetime.now(timezone.utc))
+            month = month_of(first) if first else current
+            end = add_months(max(month_of(last), current) if last else current, PARTITIONS_AHEAD)
+            months = []
+            while month <= end:
+                months.append(month)
+                month = add_months(month, 1)
+            self.partitions = set()
+            created = self.create_partitions(cur, months)
+            cur.execute(f"INSERT INTO {self.table_name} ({columns}) SELECT {columns} FROM {flat};")
+            migrated = cur.rowcount
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{self.table_name}', 'id'),"
+                        f" COALESCE((SELECT MAX(id) FROM {self.table_name}), 0) + 1, false);")
+        self.partitioned = True
+        self.partitions = created
+        return migrated
+
+    def apply_retention(self, keep_months, archive_schema=None):
+        """
+        Remove the partitions older than the given number of months, in constant time per partition:
+        they are dropped, or detached and moved to the archive schema where they stay queryable as plain tables
+        :param keep_months: Number of months kept before the current one
+        :param archive_schema: Schema receiving the detached partitions, None to drop them
+        :return: List of the names of the removed partitions
+        """
+        if not self.partitioned:
+            raise ValueError("Retention requires the partitioned table, migrate it with --migrate-partitions first.")
+        cutoff = add_months(month_of(datetime.now(timezone.utc)), -keep_months)
+        with self.transaction() as cur:
+            old = sorted(name for name in self.partition_names(cur) if name < self.partition_name(cutoff))
+            if archive_schema:
+                cur.execute(f"CREATE SCHEMA IF NOT EXISTS {archive_schema};")
+            for name in old:
+                if archive_schema:
+                    cur.execute(f"ALTER TABLE {self.table_name} DETACH PARTITION {name};")
+                    cur.execute(f"ALTER TABLE {name} SET SCHEMA {archive_schema};")
+                else:
+                    cur.execute(f"DROP TABLE {name};")
+        self.partitions = {month for month in self.partitions if month >= cutoff}
+        return old
+
+    def simhash_indexes(self):
+        """
+        Build the statements creating one expression index per SimHash band, used to find near-duplicates
+        :return: SQL statements
+        """
+        return '\n'.join(
+            f"                CREATE INDEX IF NOT EXISTS {self.table_name}_simhash{i}_idx"
+            f" ON {self.table_name} (({self.band_sql(i)}));" for i in range(len(bands(0))))
+
+    @staticmethod
+    def band_sql(index):
+        """
+        SQL expression of one band of the SimHash, matching fingerprint.bands
+        :param index: Number of the band
+        :return: SQL expression
+        """
+        width = 64 // len(bands(0))
+        return f"(simhash >> {index * width}) & {(1 << width) - 1}"
 
     def display(self, index):
         """
@@ -41,8 +484,9 @@ class Database:
         :return: None
         """
         try:
-            self.cur.execute(f"SELECT * FROM {self.table_name} WHERE id = {index};")
-            result = self.cur.fetchone()
+            with self.transaction() as cur:
+                cur.execute(f"SELECT id, title, time, autor, text FROM {self.table_name} WHERE id = %s;", (index,))
+                result = cur.fetchone()
             if result:
                 print(result[1], result[4], '\n', result[2], '\n', result[3])
             else:
@@ -57,41 +501,281 @@ class Database:
 
     def count_rows(self):
         """
-        Count the total number of records in the database table
+        Count the total number of records in the database table, large tables report the planner's estimate
         :return: Total number of records
         """
         count_query = f"SELECT COUNT(*) FROM {self.table_name};"
-        self.cur.execute(count_query)
-        count = self.cur.fetchone()[0]
+        with self.transaction() as cur:
+            if self.partitioned:
+                # The parent of a partitioned table holds no rows, its estimate is the sum of the partitions
+                cur.execute("SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint FROM pg_inherits i"
+                            " JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s);",
+                            (self.table_name,))
+            else:
+                cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass;", (self.table_name,))
+            estimate = cur.fetchone()[0]
+            if estimate >= ESTIMATE_THRESHOLD:
+                return estimate
+            cur.execute(count_query)
+            count = cur.fetchone()[0]
         return count
 
-    def store_data(self, data, url):
+    def search(self, query, page=0, page_size=PAGE_SIZE, autor=None):
         """
-        Store the scraped data in the database table if it doesn't already exist
-        :param data: Data to store in the database
-        :param url: URL of the page from which the data was scraped
-        :return: None
+        Full-text search over the titles and texts, the best matches first
+        :param query: Search terms, quotes, OR and - are supported like in web search engines
+        :param page: Number of the page, starting at 0
+        :param page_size: Number of articles per page
+        :param autor: Only return articles of this author
+        :return: List of (id, title, time, autor, url) tuples
         """
-        insert_query = f"""
-            INSERT INTO {self.table_name} (title, time, autor, text)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (title) DO NOTHING;
+        with self.transaction() as cur:
+            cur.execute(
+                f"""
+                SELECT id, title, time, autor, url
+                FROM {self.table_name}, websearch_to_tsquery('{SEARCH_CONFIG}', %(query)s) query
+                WHERE search @@ query AND (%(autor)s::text IS NULL OR autor = %(autor)s)
+                ORDER BY ts_rank(search, query) DESC, time DESC, id DESC
+                LIMIT %(limit)s OFFSET %(offset)s;
+                """,
+                {'query': query, 'autor': autor, 'limit': page_size, 'offset': page * page_size})
+            return cur.fetchall()
+
+    def list_articles(self, page_size=PAGE_SIZE, before=None, autor=None):
         """
-        try:
-            if MIN_URL in url:
-                data_to_insert = data[0]
-            else:
-                data_to_insert = data
+        List the newest articles, paging with the last row of the previous page so deep pages stay fast
+        :param page_size: Number of articles per page
+        :param before: Tuple of time and id of the last article of the previous page, None for the first page
+        :param autor: Only return articles of this author
+        :return: List of (id, title, time, autor, url) tuples
+        """
+        conditions, params = [], []
+        if before is not None:
+            conditions.append("(time, id) < (%s, %s)")
+            params.extend(before)
+        if autor is not None:
+            conditions.append("autor = %s")
+            params.append(autor)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.transaction() as cur:
+            cur.execute(
+                f"SELECT id, title, time, autor, url FROM {self.table_name}{where}"
+                f" ORDER BY time DESC, id DESC LIMIT %s;",
+                (*params, page_size))
+            return cur.fetchall()
 
-            self.cur.execute(insert_query, data_to_insert)
-            self.conn.commit()
+    def stored_urls(self, urls):
+        """
+        Look up which of the given URLs are already stored in the database table with a single query
+        :param urls: List of URLs to look up
+        :return: Set of the URLs which are already stored
+        """
+        if not urls:
+            return set()
+        with self.transaction() as cur:
+            cur.execute(f"SELECT DISTINCT url FROM {self.table_name} WHERE url = ANY(%s);", (list(urls),))
+            return {row[0] for row in cur.fetchall()}
+
+    def store_data(self, articles):
+        """
+        Store all scraped articles of a page in the database table if they don't already exist
+        :param articles: List of Articles as returned by the scraper
+        :return: List of the Articles which could not be stored
+        """
+        return self.store_many(articles)
+
+    def store_many(self, articles):
+        """
+        Store the articles of many scraped pages with one statement and a single commit.
+        Every row carries a hash of its normalized text: an article with a known title is only updated when the
+        hash changed, and an article whose headline was edited is renamed instead of being inserted again.
+        Articles violating the constraints of the table are skipped, and if the statement fails the articles are
+        stored one by one, so a bad row never drops the rest of the batch.
+        :param articles: Iterable of Articles carrying their URL, e.g. of many pages
+        :return: List of the Articles which could not be stored, empty if all were stored
+        """
+        rejected = []
+        # A title may only be written once per statement, the last version of an article wins
+        valid = list({article.title: article for article in valid_articles(articles, rejected)}.values())
+        if not valid:
+            return rejected
+        try:
+            self.write_many(valid)
         except Exception as e:
-            print(Fore.RED + f"An error occurred: {e}" + Style.RESET_ALL)
+            if len(valid) == 1:
+                print(Fore.RED + f"Could not store the article {valid[0].title!r} of {valid[0].url}: {e}"
+                      + Style.RESET_ALL)
+                METRICS.inc('database_rows_total', result='failed')
+                return rejected + valid
+            print(Fore.RED + f"An error occurred, storing the {len(valid)} articles one by one: {e}"
+                  + Style.RESET_ALL)
+            for article in valid:
+                rejected.extend(self.store_many([article]))
+        return rejected
+
+    def write_many(self, articles):
+        """
+        Write valid articles with one statement, see store_many
+        :param articles: List of Articles with unique titles
+        :return: None
+        """
+        key_match = ' AND '.join(f't.{column} = s.{column}' for column in self.unique_key.split(', '))
+        store_query = f"""
+            WITH v (title, time, autor, text, url, content_hash, simhash) AS (VALUES %s),
+            candidates AS (
+                SELECT DISTINCT ON (v.title) v.title, t.id, t.time FROM v
+                JOIN {self.table_name} t ON t.url = v.url AND t.content_hash = v.content_hash AND t.title <> v.title
+                WHERE NOT EXISTS (SELECT 1 FROM {self.table_name} WHERE title = v.title)
+                ORDER BY v.title, t.id DESC
+            ),
+            renames AS (
+                -- Every incoming title renames at most one stored article and every article is renamed once
+                SELECT DISTINCT ON (id, time) title, id, time FROM candidates ORDER BY id, time, title
+            ),
+            renamed AS (
+                UPDATE {self.table_name} t SET title = r.title FROM renames r
+                WHERE t.id = r.id AND t.time = r.time
+                RETURNING r.title
+            ),
+            stored AS (
+                INSERT INTO {self.table_name} (title, time, autor, text, url, content_hash, simhash)
+                SELECT * FROM v WHERE title NOT IN (SELECT title FROM renamed)
+                ON CONFLICT ({self.unique_key}) DO UPDATE SET
+                    time = excluded.time, autor = excluded.autor, text = excluded.text, url = excluded.url,
+                    content_hash = excluded.content_hash, simhash = excluded.simhash
+                WHERE {self.table_name}.content_hash IS DISTINCT FROM excluded.content_hash
+                RETURNING {self.unique_key}
+            ),
+            -- The table is read before the statement's changes, so a stored row without a match there was inserted.
+            -- xmax can't tell this on partitioned tables, which don't return system columns.
+            counted AS (
+                SELECT NOT EXISTS (SELECT 1 FROM {self.table_name} t WHERE {key_match}) AS inserted FROM stored s
+            )
+            SELECT (SELECT COUNT(*) FROM renamed),
+                COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM counted;
+        """
+        template = "(%s, %s::timestamptz, %s, %s, %s, %s::bytea, %s::bigint)"
+        rows = [article_row(article) for article in articles]
+        with METRICS.timer('database_store_seconds'), self.transaction() as cur:
+            created = set()
+            if self.partitioned:
+                created = self.create_partitions(
+                    cur, {month_of(row[1]) for row in rows if isinstance(row[1], datetime)})
+            counts = execute_values(cur, store_query, rows, template, page_size=len(rows), fetch=True)
+        self.partitions |= created
+        renamed, inserted, updated = counts[0] if counts else (0, 0, 0)
+        results = {'inserted': inserted, 'updated': updated, 'renamed': renamed,
+                   'unchanged': len(rows) - inserted - updated - renamed}
+        for result, count in results.items():
+            if count:
+                METRICS.inc('database_rows_total', count, result=result)
+
+    def bulk_load(self, articles, chunk_size=BULK_CHUNK):
+        """
+        Load a large backfill: the articles are streamed into a temporary staging table with COPY and merged
+        with one INSERT ... SELECT per chunk. Articles whose title is already stored are skipped, not updated,
+        articles violating the constraints of the table are reported and rejected before they are copied.
+        :param articles: Iterable of Articles carrying their URL, consumed lazily
+        :param chunk_size: Number of articles copied and merged per transaction
+        :return: Tuple of the number of inserted and skipped articles and the list of the rejected Articles
+        """
+        staging = f'{self.table_name}_staging'
+        columns = 'title, time, autor, text, url, content_hash, simhash'
+        rejected = []
+        rows = (article_row(article) for article in valid_articles(articles, rejected))
+        inserted = skipped = 0
+        while True:
+            staged = 0
+
+            def counted(chunk):
+                nonlocal staged
+                for row in chunk:
+                    staged += 1
+                    yield row
+
+            with METRICS.timer('database_bulk_load_seconds'), self.transaction() as cur:
+                cur.execute(
+                    f"CREATE TEMP TABLE {staging} (n bigserial, title text, time timestamptz, autor text, text text,"
+                    f" url text, content_hash bytea, simhash bigint) ON COMMIT DROP;")
+                cur.copy_expert(f"COPY {staging} ({columns}) FROM STDIN;",
+                                CopyStream(counted(islice(rows, chunk_size))))
+                created = set()
+                if self.partitioned:
+                    # The local time is truncated, a timestamptz would be cast to a date in the session's timezone
+                    cur.execute(f"SELECT DISTINCT date_trunc('month', time AT TIME ZONE %s)::date FROM {staging};",
+                                (DEFAULT_TIMEZONE,))
+                    created = self.create_partitions(cur, [row[0] for row in cur.fetchall()])
+                # Within the load the last version of an article wins, like in store_many
+                cur.execute(
+                    f"""
+                    WITH inserted AS (
+                        INSERT INTO {self.table_name} ({columns})
+                        SELECT DISTINCT ON ({self.unique_key}) {columns} FROM {staging}
+                        ORDER BY {self.unique_key}, n DESC
+                        ON CONFLICT ({self.unique_key}) DO NOTHING
+                        RETURNING 1
+                    )
+                    SELECT COUNT(*) FROM inserted;
+                    """
+                )
+                added = cur.fetchone()[0]
+            self.partitions |= created
+            inserted += added
+            skipped += staged - added
+            if staged < chunk_size:
+                break
+        for result, count in {'inserted': inserted, 'skipped': skipped}.items():
+            if count:
+                METRICS.inc('database_rows_total', count, result=result)
+        return inserted, skipped, rejected
+
+    def near_duplicates(self, text, max_distance=NEAR_DUPLICATE_DISTANCE, limit=PAGE_SIZE):
+        """
+        Find the stored articles whose text is nearly the same as the given one
+        :param text: Article text
+        :param max_distance: Maximum number of different SimHash bits
+        :param limit: Maximum number of articles returned
+        :return: List of (id, title, url, distance) tuples, the closest first
+        """
+        value = simhash(text)
+        candidates = ' OR '.join(f"{self.band_sql(i)} = %s" for i in range(len(bands(value))))
+        with self.transaction() as cur:
+            cur.execute(
+                f"""
+                SELECT id, title, url, bit_count((simhash # %s)::bit(64)) AS distance
+                FROM {self.table_name}
+                WHERE ({candidates}) AND bit_count((simhash # %s)::bit(64)) <= %s
+                ORDER BY distance, id
+                LIMIT %s;
+                """,
+                (value, *bands(value), value, max_distance, limit))
+            return cur.fetchall()
+
+    def iter_articles(self, after=None, by='id', itersize=EXPORT_ITERSIZE):
+        """
+        Stream the stored articles with a server-side cursor, so only itersize rows are held in memory at once
+        :param after: Dictionary with the id and time of the last article already read, None to read all articles
+        :param by: Order of the articles, 'id' or 'time' (ties broken by id)
+        :param itersize: Number of rows fetched from the server per round trip
+        :return: Generator of (id, title, time, autor, text, url) tuples
+        """
+        if by not in ('id', 'time'):
+            raise ValueError(f"Articles can only be read by id or time, not {by}")
+        order = "id" if by == 'id' else "time, id"
+        condition, params = "", ()
+        if after:
+            condition = " WHERE id > %s" if by == 'id' else " WHERE (time, id) > (%s::timestamptz, %s)"
+            params = (after['id'],) if by == 'id' else (after['time'], after['id'])
+        with self.transaction(name=f'{self.table_name}_export') as cur:
+            cur.itersize = itersize
+            cur.execute(
+                f"SELECT id, title, time, autor, text, url FROM {self.table_name}{condition} ORDER BY {order};",
+                params)
+            yield from cur
 
     def close(self):
         """
-        Close the database connection
+        Close all connections of the pool
         :return: None
         """
-        self.cur.close()
-        self.conn.close()
+        self.pool.closeall()
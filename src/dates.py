@@ -0,0 +1,78 @@
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# Timezone of the times shown on the pages of the supported sites
+DEFAULT_TIMEZONE = 'Europe/Zurich'
+
+# Number of distinct time strings remembered, pages of the same day share most of them
+DATE_CACHE_SIZE = 4096
+
+# Formats shown on the pages: "12.06.2024 um 14:00 Uhr", "12.06.2024, 14:00" and "14:00 Uhr" for today
+DATETIME_PATTERN = re.compile(r'(\d{1,2})\.(\d{1,2})\.(\d{4})\D+?(\d{1,2}):(\d{2})')
+TIME_PATTERN = re.compile(r'(\d{1,2}):(\d{2}) Uhr')
+ISO_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}')
+
+
+@lru_cache(maxsize=None)
+def get_timezone(name):
+    """
+    Load the timezone with the given name once
+    :param name: IANA name of the timezone, e.g. 'Europe/Zurich'
+    :return: ZoneInfo object
+    """
+    return ZoneInfo(name)
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_cached(value, tz_name, current_date):
+    """
+    Parse a time string, memoized per day because "14:00 Uhr" refers to the current date
+    :param value: Time string to parse
+    :param tz_name: Timezone of times without an offset
+    :param current_date: Current date in the timezone
+    :return: Timezone-aware datetime, None if the format is unknown
+    """
+    tz = get_timezone(tz_name)
+    if ISO_PATTERN.match(value):
+        # fromisoformat only accepts the Z suffix from Python 3.11 on
+        if value.endswith(('Z', 'z')):
+            value = value[:-1] + '+00:00'
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        # Machine-readable timestamps without an offset are given in UTC
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+    match = DATETIME_PATTERN.search(value)
+    if match:
+        day, month, year, hour, minute = map(int, match.groups())
+        return datetime(year, month, day, hour, minute, tzinfo=tz)
+
+    match = TIME_PATTERN.search(value)
+    if match:
+        hour, minute = map(int, match.groups())
+        return datetime(current_date.year, current_date.month, current_date.day, hour, minute, tzinfo=tz)
+    return None
+
+
+def today(tz_name=DEFAULT_TIMEZONE):
+    """
+    Get the current date in the timezone
+    :param tz_name: IANA name of the timezone
+    :return: Date
+    """
+    return datetime.now(get_timezone(tz_name)).date()
+
+
+def parse_date(value, tz_name=DEFAULT_TIMEZONE):
+    """
+    Normalize a time shown on a page or given in a datetime attribute to a timezone-aware datetime
+    :param value: Time string, e.g. "12.06.2024 um 14:00 Uhr", "14:00 Uhr" or "2024-06-12T14:00:00.000Z"
+    :param tz_name: Timezone of the site, used for times without an offset
+    :return: Timezone-aware datetime, None if the format is unknown
+    """
+    return parse_cached(value.strip(), tz_name, today(tz_name))
+
@@ -0,0 +1,170 @@
+import gzip
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from xml.etree import ElementTree
+
+from colorama import Fore, Style
+
+from src.fetcher import AsyncFetcher, iterate_async
+from src.metrics import METRICS
+from src.scheduler import PolitenessScheduler
+from src.urls import SeenUrls, normalize_url
+
+# Levels of pages fetched per round: 1 fetches the start pages and sitemaps, 2 also the sections and
+# sitemaps linked from them, and so on
+DISCOVERY_DEPTH = 1
+
+
+def local_name(tag):
+    """
+    Strip the XML namespace from a tag
+    :param tag: Tag as returned by ElementTree, e.g. {http://www.sitemaps.org/schemas/sitemap/0.9}loc
+    :return: Tag without namespace
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_sitemap(content):
+    """
+    Read the locations of a sitemap, optionally gzip compressed
+    :param content: Body of the sitemap
+    :return: Tuple of the nested sitemaps (of a sitemap index) and the page URLs
+    """
+    if content[:2] == b'\x1f\x8b':
+        content = gzip.decompress(content)
+    root = ElementTree.fromstring(content)
+    locations = [element.text.strip() for element in root.iter()
+                 if local_name(element.tag) == 'loc' and element.text]
+    if local_name(root.tag) == 'sitemapindex':
+        return locations, []
+    return [], locations
+
+
+def parse_robots(content):
+    """
+    Read the sitemaps announced in a robots.txt file
+    :param content: Body of the robots.txt file
+    :return: List of sitemap URLs
+    """
+    lines = content.decode('utf-8', errors='replace').splitlines()
+    return [line.split(':', 1)[1].strip() for line in lines if line.lower().startswith('sitemap:')]
+
+
+class Discovery:
+    """
+    Discovery of new article URLs on the section pages and in the sitemaps of the configured sites.
+    Every round fetches the pages level by level with the scraper's rate limits and returns only the
+    article URLs which were not discovered in an earlier round.
+    """
+
+    def __init__(self, scraper, start_urls, depth=DISCOVERY_DEPTH, sitemaps=True):
+        self.scraper = scraper
+        self.sites = scraper.sites
+        sections = [url for adapter in self.sites.adapters.values() for url in adapter.sections]
+        self.start_urls = list(dict.fromkeys(normalize_url(url) for url in [*start_urls, *sections]))
+        self.depth = depth
+        self.sitemaps = sitemaps
+        self.seen = SeenUrls()
+
+    def fetch(self, url):
+        """
+        Fetch a section page, sitemap or robots.txt file
+        :param url: URL to fetch
+        :return: Body of the response
+        """
+        return self.scraper.fetch_response(url).content
+
+    def fetch_all(self, urls):
+        """
+        Fetch the URLs concurrently within the rate limits of their hosts, failed URLs are reported and skipped
+        :param urls: List of URLs
+        :return: Generator of (url, content) tuples in completion order
+        """
+        scraper = self.scraper
+        scheduler = PolitenessScheduler(scraper.rates, scraper.default_rate, max_per_host=scraper.max_per_host,
+                                        max_retries=scraper.max_retries)
+        fetcher = AsyncFetcher(self.fetch, scheduler, scraper.max_connections)
+        for url, content, error in iterate_async(fetcher.fetch_many(urls)):
+            if error is not None:
+                METRICS.inc('discovery_errors_total')
+                print(Fore.RED + f"Failed to discover links on {url}: {error}" + Style.RESET_ALL)
+                continue
+            yield url, content
+
+    def site(self, url):
+        """
+        Get the adapter of a URL found during discovery
+        :param url: Normalized URL
+        :return: SiteAdapter, None if the site is not configured
+        """
+        try:
+            return self.sites.match(url)
+        except ValueError:
+            return None
+
+    def links(self, url, content):
+        """
+        Extract the normalized links of a page
+        :param url: URL of the page, relative links are resolved against it
+        :param content: HTML content of the page
+        :return: Generator of URLs
+        """
+        for anchor in self.scraper.make_soup(content).find_all('a', href=True):
+            link = urljoin(url, anchor['href'])
+            if link.startswith(('http://', 'https://')):
+                yield normalize_url(link)
+
+    def sitemap_urls(self):
+        """
+        Get the sitemaps of the sites, as configured in their adapter or announced in their robots.txt
+        :return: List of sitemap URLs
+        """
+        sitemaps = []
+        robots = []
+        for adapter in self.sites.adapters.values():
+            if adapter.sitemaps is not None:
+                sitemaps.extend(adapter.sitemaps)
+            elif adapter.article_pattern is not None:
+                robots.append(f'https://{adapter.hosts[0]}/robots.txt')
+        for url, content in self.fetch_all(robots):
+            sitemaps.extend(parse_robots(content))
+        return sitemaps
+
+    def discover(self):
+        """
+        Run one discovery round
+        :return: List of the article URLs which were not discovered before
+        """
+        pages = list(self.start_urls)
+        sitemaps = set(self.sitemap_urls()) if self.sitemaps else set()
+        visited = set()
+        found = []
+        for level in range(self.depth):
+            visited.update(pages, sitemaps)
+            next_pages = []
+            next_sitemaps = set()
+            for url, content in self.fetch_all([*pages, *sitemaps]):
+                if url in sitemaps:
+                    try:
+                        nested, links = parse_sitemap(content)
+                    except ElementTree.ParseError as e:
+                        print(Fore.RED + f"Invalid sitemap {url}: {e}" + Style.RESET_ALL)
+                        continue
+                    next_sitemaps.update(nested)
+                else:
+                    links = self.links(url, content)
+                for link in links:
+                    adapter = self.site(link)
+                    if adapter is None:
+                        continue
+                    if adapter.is_article(link):
+                        # The query of article links only carries tracking parameters
+                        parts = urlsplit(link)
+                        found.append(urlunsplit((parts.scheme, parts.netloc, parts.path, '', '')))
+                    elif link not in visited:
+                        next_pages.append(link)
+            pages = list(dict.fromkeys(next_pages))
+            sitemaps = next_sitemaps - visited
+
+        new = [url for url in found if self.seen.add(url)]
+        METRICS.inc('discovery_urls_total', len(new))
+        return new
@@ -0,0 +1,140 @@
+import gzip
+import json
+import os
+
+from src.urls import batched
+
+# Rows written to the file at once
+EXPORT_BATCH = 10000
+
+COLUMNS = ['id', 'title', 'time', 'autor', 'text', 'url']
+FORMATS = ['jsonl', 'parquet']
+
+
+def read_watermark(path):
+    """
+    Read the position of the last export
+    :param path: Watermark file
+    :return: Dictionary with the id and time of the last exported article, empty if there was no export yet
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_watermark(path, watermark):
+    """
+    Save the position of the last export, replacing the file atomically
+    :param path: Watermark file
+    :param watermark: Dictionary with the id and time of the last exported article
+    :return: None
+    """
+    with open(path + '.tmp', 'w') as f:
+        json.dump(watermark, f)
+    os.replace(path + '.tmp', path)
+
+
+class JsonlWriter:
+    """
+    Writer of one JSON object per line, gzip compressed if the file name ends with .gz
+    """
+
+    def __init__(self, path):
+        opener = gzip.open if path.endswith('.gz') else open
+        self.file = opener(path, 'wt', encoding='utf-8')
+
+    def write(self, rows):
+        """
+        Append the rows to the file
+        :param rows: List of tuples in the order of COLUMNS
+        :return: None
+        """
+        for row in rows:
+            record = dict(zip(COLUMNS, row))
+            record['time'] = record['time'].isoformat()
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def close(self):
+        """
+        :return: None
+        """
+        self.file.close()
+
+
+class ParquetWriter:
+    """
+    Writer of a zstd compressed Parquet file, every batch becomes a row group
+    """
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("pyarrow is required for Parquet exports, use the jsonl format instead.")
+        self.pa = pa
+        self.schema = pa.schema([('id', pa.int64()), ('title', pa.string()), ('time', pa.timestamp('us', tz='UTC')),
+                                 ('autor', pa.string()), ('text', pa.string()), ('url', pa.string())])
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, rows):
+        """
+        Append the rows to the file as one row group
+        :param rows: List of tuples in the order of COLUMNS
+        :return: None
+        """
+        columns = dict(zip(COLUMNS, map(list, zip(*rows))))
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        """
+        :return: None
+        """
+        self.writer.close()
+
+
+def open_writer(path, export_format=None):
+    """
+    Open the writer of the export format, by default derived from the file name
+    :param path: Output file
+    :param export_format: 'jsonl' or 'parquet', None to use the file extension
+    :return: Writer object
+    """
+    if export_format is None:
+        export_format = 'parquet' if path.endswith('.parquet') else 'jsonl'
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format {export_format}. Supported formats are: {', '.join(FORMATS)}")
+    return ParquetWriter(path) if export_format == 'parquet' else JsonlWriter(path)
+
+
+def export(database, path, export_format=None, watermark_path=None, by='id', batch_size=EXPORT_BATCH):
+    """
+    Stream the stored articles into a file in batches of bounded size. With a watermark file only the
+    articles after the last export are written and the watermark is advanced when the file is complete.
+    :param database: Database object
+    :param path: Output file
+    :param export_format: 'jsonl' or 'parquet', None to use the file extension
+    :param watermark_path: Watermark file for incremental exports, None to export all articles
+    :param by: Column the watermark follows, 'id' for new rows or 'time' for newly published articles
+    :param batch_size: Number of rows written at once
+    :return: Number of exported articles
+    """
+    watermark = read_watermark(watermark_path) if watermark_path else {}
+    if watermark.get('by', by) != by:
+        raise ValueError(f"The watermark {watermark_path} follows {watermark['by']}, not {by}.")
+
+    writer = open_writer(path, export_format)
+    count = 0
+    last = None
+    try:
+        for rows in batched(database.iter_articles(watermark, by), batch_size):
+            writer.write(rows)
+            count += len(rows)
+            last = rows[-1]
+    finally:
+        writer.close()
+
+    if watermark_path and last is not None:
+        write_watermark(watermark_path, {'by': by, 'id': last[0], 'time': last[2].isoformat()})
+    return count
@@ -0,0 +1,133 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.scheduler import RetryableError
+
+# Default limits for the concurrent fetch engine
+MAX_CONNECTIONS = 32
+MAX_CONNECTIONS_PER_HOST = 8
+
+# Number of URLs read ahead from the input so that every host can be scheduled
+LOOKAHEAD = 1000
+
+# Marks the end of the items handed over by iterate_async
+_DONE = object()
+
+
+class AsyncFetcher:
+    """
+    Asyncio fetch engine that runs a blocking fetch function for many URLs concurrently.
+    The scheduler decides which host is requested next, so the rate limits and the backoff of one host
+    never hold back the others. Connections are only occupied while a request is actually running.
+    """
+
+    def __init__(self, fetch, scheduler, max_connections=MAX_CONNECTIONS, lookahead=LOOKAHEAD):
+        self.fetch = fetch
+        self.scheduler = scheduler
+        self.max_connections = max_connections
+        self.lookahead = lookahead
+
+    async def fetch_one(self, url, attempt, executor):
+        """
+        Fetch a single URL in the executor
+        :param url: URL to fetch
+        :param attempt: Number of earlier attempts of the URL
+        :param executor: Executor running the blocking fetch function
+        :return: Tuple of the URL, the attempt, the page content and the error (None if successful)
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            content = await loop.run_in_executor(executor, self.fetch, url)
+        except Exception as e:
+            return url, attempt, None, e
+        return url, attempt, content, None
+
+    async def fetch_many(self, urls):
+        """
+        Fetch all given URLs concurrently and yield the results as soon as each page finishes.
+        Retryable errors are put back into the scheduler until the URL runs out of retries.
+        :param urls: Iterable of URLs to fetch, consumed lazily
+        :return: Async generator of (url, content, error) tuples in completion order
+        """
+        urls = iter(urls)
+        exhausted = False
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            while True:
+                # Read ahead so that every host with waiting URLs can be scheduled
+                while not exhausted and self.scheduler.pending < self.lookahead:
+                    url = next(urls, None)
+                    if url is None:
+                        exhausted = True
+                    else:
+                        self.scheduler.push(url, time.monotonic())
+
+                wait_time = None
+                while len(running) < self.max_connections:
+                    url, attempt, wait_time = self.scheduler.pop(time.monotonic())
+                    if url is None:
+                        break
+                    running.add(asyncio.ensure_future(self.fetch_one(url, attempt, executor)))
+
+                if not running:
+                    if exhausted and not self.scheduler.pending:
+                        break
+                    await asyncio.sleep(wait_time or 0)
+                    continue
+
+                done, running = await asyncio.wait(running, timeout=wait_time, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    url, attempt, content, error = task.result()
+                    now = time.monotonic()
+                    if isinstance(error, RetryableError) and self.scheduler.retry(url, attempt, error.retry_after, now):
+                        continue
+                    self.scheduler.done(url, now)
+                    yield url, content, error
+
+
+def iterate_async(async_iterable, buffer_size=MAX_CONNECTIONS):
+    """
+    Run an async iterable on an event loop in a background thread and consume it from synchronous code.
+    The loop keeps fetching while the caller is busy until the buffer is full.
+    :param async_iterable: Async iterable to consume
+    :param buffer_size: Maximum number of items buffered for the caller
+    :return: Generator yielding the items of the async iterable
+    """
+    items = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def pump():
+        try:
+            async for item in async_iterable:
+                if not put((item, None)):
+                    break
+        except Exception as e:
+            put((None, e))
+        finally:
+            put((_DONE, None))
+
+    thread = threading.Thread(target=asyncio.run, args=(pump(),), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,67 @@
+import re
+from hashlib import blake2b
+
+# Words per shingle of the SimHash, short enough to survive small edits
+SHINGLE_SIZE = 3
+SIMHASH_BITS = 64
+
+# SimHashes at most this many bits apart are treated as near-duplicates
+NEAR_DUPLICATE_DISTANCE = 3
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def normalize_text(text):
+    """
+    Normalize the article text so that whitespace, punctuation and case changes don't change its fingerprint
+    :param text: Article text
+    :return: List of lowercase words
+    """
+    return WORD_PATTERN.findall(text.casefold())
+
+
+def content_hash(text):
+    """
+    Hash the normalized article text
+    :param text: Article text
+    :return: 16 byte digest
+    """
+    return blake2b(' '.join(normalize_text(text)).encode(), digest_size=16).digest()
+
+
+def simhash(text):
+    """
+    Compute the SimHash of the article text from its word shingles, similar texts get hashes with few different bits
+    :param text: Article text
+    :return: Signed 64 bit integer, so it fits a PostgreSQL bigint
+    """
+    words = normalize_text(text)
+    shingles = [' '.join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))]
+    # A bit of the result is set if it is set in the hashes of most shingles. The hashes are concatenated as bit
+    # strings, so every bit column is a strided slice counted in C instead of a transposed tuple
+    bits = ''.join([f"{int.from_bytes(blake2b(shingle.encode(), digest_size=8).digest(), 'big'):064b}"
+                    for shingle in shingles])
+    half = len(shingles) / 2
+    result = int(''.join('1' if bits[i::SIMHASH_BITS].count('1') > half else '0' for i in range(SIMHASH_BITS)), 2)
+    return result - (1 << SIMHASH_BITS) if result >= 1 << (SIMHASH_BITS - 1) else result
+
+
+def hamming_distance(a, b):
+    """
+    Count the bits in which two SimHashes differ
+    :param a: First SimHash
+    :param b: Second SimHash
+    :return: Number of different bits
+    """
+    return ((a ^ b) & ((1 << SIMHASH_BITS) - 1)).bit_count()
+
+
+def bands(value, count=NEAR_DUPLICATE_DISTANCE + 1):
+    """
+    Split a SimHash into bands; two hashes within NEAR_DUPLICATE_DISTANCE bits share at least one band
+    :param value: SimHash
+    :param count: Number of bands
+    :return: List of the band values
+    """
+    width = SIMHASH_BITS // count
+    return [(value >> (i * width)) & ((1 << width) - 1) for i in range(count)]
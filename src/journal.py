@@ -0,0 +1,135 @@
+import sqlite3
+import threading
+import time
+
+from src.urls import batched
+
+# States of a URL in the crawl journal
+QUEUED = 'queued'
+PARSED = 'parsed'
+STORED = 'stored'
+FAILED = 'failed'
+
+# Number of URLs looked up in the journal at once
+JOURNAL_CHUNK = 1000
+
+
+class CrawlJournal:
+    """
+    Crash-safe on-disk journal of the state of every URL of a batch, so an interrupted run resumes
+    with the unfinished URLs only. Changes are committed together with the database writes.
+    """
+
+    def __init__(self, path):
+        # The URL stream is read on the fetch engine's thread, the states are recorded on the caller's thread
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS journal (
+                url TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated REAL NOT NULL
+            );
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS journal_state ON journal (state);")
+        self.conn.commit()
+
+    def pending(self, urls, retry_failed=False):
+        """
+        Drop the URLs which are already stored (and failed unless retried) and mark the others as queued
+        :param urls: Iterable of URLs
+        :param retry_failed: Queue the URLs which failed in an earlier run again
+        :return: Generator of the URLs which still have to be scraped
+        """
+        finished = (STORED,) if retry_failed else (STORED, FAILED)
+        for chunk in batched(urls, JOURNAL_CHUNK):
+            placeholders = ', '.join('?' * len(chunk))
+            with self.lock:
+                done = {row[0] for row in self.conn.execute(
+                    f"SELECT url FROM journal WHERE url IN ({placeholders})"
+                    f" AND state IN ({', '.join('?' * len(finished))});",
+                    (*chunk, *finished))}
+                todo = [url for url in chunk if url not in done]
+                self.mark_many(todo, QUEUED)
+                self.commit()
+            yield from todo
+
+    def mark(self, url, state, error=None):
+        """
+        Record the state of a URL, committed with the next call to commit
+        :param url: URL to update
+        :param state: New state of the URL
+        :param error: Error message if the URL failed
+        :return: None
+        """
+        self.mark_many([url], state, error)
+
+    def mark_many(self, urls, state, error=None):
+        """
+        Record the same state for many URLs, committed with the next call to commit
+        :param urls: URLs to update
+        :param state: New state of the URLs
+        :param error: Error message if the URLs failed
+        :return: None
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                """
+                INSERT INTO journal (url, state, attempts, error, updated)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    state = excluded.state,
+                    attempts = journal.attempts + excluded.attempts,
+                    error = excluded.error,
+                    updated = excluded.updated;
+                """,
+                [(url, state, int(state == FAILED), error, now) for url in urls])
+
+    def commit(self):
+        """
+        Write the recorded states to disk
+        :return: None
+        """
+        with self.lock:
+            self.conn.commit()
+
+    def failed(self):
+        """
+        List the URLs which failed with their error and number of failed attempts
+        :return: List of (url, attempts, error) tuples
+        """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT url, attempts, error FROM journal WHERE state = ? ORDER BY updated;", (FAILED,)).fetchall()
+
+    def unfinished(self):
+        """
+        List the URLs which were queued or parsed but not stored when the last run ended
+        :return: List of URLs
+        """
+        with self.lock:
+            return [row[0] for row in self.conn.execute(
+                "SELECT url FROM journal WHERE state IN (?, ?) ORDER BY updated;", (QUEUED, PARSED))]
+
+    def counts(self):
+        """
+        Count the URLs per state
+        :return: Dictionary of state and number of URLs
+        """
+        with self.lock:
+            return dict(self.conn.execute("SELECT state, COUNT(*) FROM journal GROUP BY state;").fetchall())
+
+    def close(self):
+        """
+        Commit and close the journal
+        :return: None
+        """
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
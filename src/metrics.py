@@ -0,0 +1,282 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def label_key(labels):
+    """
+    Turn the labels into a hashable and sorted key
+    :param labels: Dictionary of label names and values
+    :return: Tuple of (name, value) pairs
+    """
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key, extra=()):
+    """
+    Format the labels in the Prometheus text format
+    :param key: Label key as returned by label_key
+    :param extra: Additional (name, value) pairs, e.g. the bucket bound
+    :return: Label string including the braces, empty if there are no labels
+    """
+    pairs = [*key, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Add a value to the histogram
+        :param value: Observed value in seconds
+        :return: None
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and latency histograms, exported as Prometheus text or JSON
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increase a counter
+        :param name: Name of the counter
+        :param value: Amount to add
+        :param labels: Labels of the counter
+        :return: None
+        """
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Record a duration in a histogram
+        :param name: Name of the histogram
+        :param seconds: Duration in seconds
+        :param labels: Labels of the histogram
+        :return: None
+        """
+        key = (name, label_key(labels))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Time the block and record its duration in a histogram, failures are counted separately
+        :param name: Name of the histogram
+        :param labels: Labels of the histogram
+        :return: Context manager
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(name.removesuffix('_seconds') + '_errors_total', **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """
+        Get the current values of all metrics
+        :return: Dictionary which can be serialized as JSON
+        """
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(key), 'value': value}
+                        for (name, key), value in self.counters.items()]
+            histograms = [{'name': name, 'labels': dict(key), 'count': histogram.count, 'sum': histogram.sum,
+                           'buckets': dict(zip([*map(str, histogram.buckets), '+Inf'], histogram.counts))}
+                          for (name, key), histogram in self.histograms.items()]
+        return {'time': time.time(), 'counters': counters, 'histograms': histograms}
+
+    def prometheus(self):
+        """
+        Render all metrics in the Prometheus text exposition format
+        :return: Metrics as text
+        """
+        lines = []
+        typed = set()
+        with self.lock:
+            for (name, key), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} counter')
+                    typed.add(name)
+                lines.append(f'{name}{format_labels(key)} {value}')
+            for (name, key), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} histogram')
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip([*map(str, histogram.buckets), '+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(key, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(key)} {histogram.sum}')
+                lines.append(f'{name}_count{format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """
+        Remove all recorded metrics
+        :return: None
+        """
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+# Registry used by the scraper and the database
+METRICS = Metrics()
+
+
+def timed(name, **labels):
+    """
+    Decorator recording the duration of every call of the function in the metrics registry
+    :param name: Name of the histogram
+    :param labels: Labels of the histogram
+    :return: Decorator
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with METRICS.timer(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def serve_prometheus(port, metrics=METRICS, host=''):
+    """
+    Serve the metrics as Prometheus text on /metrics from a background thread
+    :param port: Port to listen on
+    :param metrics: Metrics registry to export
+    :param host: Address to bind, all interfaces by default
+    :return: HTTP server, call shutdown() to stop it
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class JsonDumper:
+    """
+    Background thread writing a JSON snapshot of the metrics to a file at a fixed interval
+    """
+
+    def __init__(self, path, interval=30.0, metrics=METRICS):
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def dump(self):
+        """
+        Write the current snapshot to the file
+        :return: None
+        """
+        with open(self.path, 'w') as f:
+            json.dump(self.metrics.snapshot(), f, indent=2)
+
+    def run(self):
+        """
+        Dump the metrics until the dumper is stopped
+        :return: None
+        """
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def start(self):
+        """
+        Start the background thread
+        :return: The dumper
+        """
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the background thread and write a final snapshot
+        :return: None
+        """
+        self.stopped.set()
+        self.thread.join()
+        self.dump()
+
+
+@contextmanager
+def profiled(path, profiler='cprofile'):
+    """
+    Profile the block with cProfile or pyinstrument and save the result
+    :param path: Output file, pstats data for cProfile and HTML for pyinstrument
+    :param profiler: 'cprofile' or 'pyinstrument'
+    :return: Context manager
+    """
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ValueError("pyinstrument is not installed, use the cprofile profiler instead.")
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(path, 'w') as f:
+                f.write(profile.output_html())
+        return
+
+    import cProfile
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
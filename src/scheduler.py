@@ -0,0 +1,249 @@
+import heapq
+import itertools
+import random
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# Default politeness settings for hosts without a configured rate
+DEFAULT_RATE = 2.0
+DEFAULT_BURST = 2
+MAX_RETRIES = 3
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 120.0
+
+# HTTP status codes which are retried with backoff instead of failing the URL
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    """
+    Error of a fetch that may succeed when it is retried later, e.g. HTTP 429/503 or a timeout
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value, now=None):
+    """
+    Parse the Retry-After header given either in seconds or as an HTTP date
+    :param value: Value of the Retry-After header
+    :param now: Current time as an aware datetime, defaults to the system time
+    :return: Seconds to wait, None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = now or datetime.now(timezone.utc)
+    return max(0.0, (date - now).total_seconds())
+
+
+def backoff_delay(attempt, retry_after=None, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """
+    Get the delay before the next attempt, honouring the Retry-After of the server
+    :param attempt: Number of the attempt which failed, starting at 0
+    :param retry_after: Seconds the server asked to wait, None if not given
+    :param base: Delay of the first retry in seconds
+    :param cap: Maximum delay in seconds
+    :return: Seconds to wait
+    """
+    delay = min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.0)
+    if retry_after is not None:
+        delay = max(delay, min(cap, retry_after))
+    return delay
+
+
+class TokenBucket:
+    """
+    Token bucket allowing a steady number of requests per second with short bursts
+    """
+
+    def __init__(self, rate, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = None
+
+    def refill(self, now):
+        """
+        Add the tokens earned since the last update
+        :param now: Current monotonic time
+        :return: None
+        """
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_in(self, now):
+        """
+        Get the seconds until a token is available
+        :param now: Current monotonic time
+        :return: Seconds to wait, 0 if a token is available
+        """
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        """
+        Take one token from the bucket
+        :param now: Current monotonic time
+        :return: None
+        """
+        self.refill(now)
+        self.tokens -= 1
+
+
+class HostQueue:
+    """
+    Waiting URLs, rate limit and backoff state of a single host
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.urls = deque()
+        self.in_flight = 0
+        self.not_before = 0.0
+
+    def ready_at(self, now):
+        """
+        Get the monotonic time at which the next request to the host may be sent
+        :param now: Current monotonic time
+        :return: Monotonic time
+        """
+        return max(now + self.bucket.ready_in(now), self.not_before)
+
+
+class PolitenessScheduler:
+    """
+    Scheduler handing out URLs per host with a token bucket rate limit and backoff after errors.
+    A priority queue ordered by the time each host is ready makes sure a slow or throttled host
+    never holds back the others.
+    """
+
+    def __init__(self, rates=None, default_rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_per_host=None,
+                 max_retries=MAX_RETRIES):
+        self.rates = rates or {}
+        self.default_rate = default_rate
+        self.burst = burst
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self.hosts = {}
+        self.ready = []
+        self.counter = itertools.count()
+        self.pending = 0
+
+    def host_queue(self, host):
+        """
+        Get the queue of the host and create it with the configured rate if needed
+        :param host: Hostname
+        :return: HostQueue of the host
+        """
+        if host not in self.hosts:
+            rate = self.rates.get(host, self.default_rate)
+            self.hosts[host] = HostQueue(TokenBucket(rate, self.burst))
+        return self.hosts[host]
+
+    def schedule(self, host, now):
+        """
+        Put the host into the priority queue if it has waiting URLs and a free connection
+        :param host: Hostname
+        :param now: Current monotonic time
+        :return: None
+        """
+        queue = self.hosts[host]
+        if queue.urls and (self.max_per_host is None or queue.in_flight < self.max_per_host):
+            heapq.heappush(self.ready, (queue.ready_at(now), next(self.counter), host))
+
+    def reset(self):
+        """
+        Drop the waiting URLs and the requests of an abandoned run, the rate limits and backoffs of the hosts are kept
+        :return: None
+        """
+        for queue in self.hosts.values():
+            queue.urls.clear()
+            queue.in_flight = 0
+        self.ready = []
+        self.pending = 0
+
+    def push(self, url, now, attempt=0):
+        """
+        Add a URL to the queue of its host
+        :param url: URL to fetch
+        :param now: Current monotonic time
+        :param attempt: Number of earlier attempts of the URL
+        :return: None
+        """
+        host = urlsplit(url).hostname or ''
+        queue = self.host_queue(host)
+        queue.urls.append((url, attempt))
+        self.pending += 1
+        if len(queue.urls) == 1:
+            self.schedule(host, now)
+
+    def pop(self, now):
+        """
+        Take the next URL whose host may be requested now
+        :param now: Current monotonic time
+        :return: Tuple of the URL, its attempt and the seconds to wait if no URL is ready (URL None)
+        """
+        while self.ready:
+            ready_at, _, host = self.ready[0]
+            queue = self.hosts[host]
+            if not queue.urls or (self.max_per_host is not None and queue.in_flight >= self.max_per_host):
+                heapq.heappop(self.ready)
+                continue
+            actual = queue.ready_at(now)
+            if actual > ready_at:
+                heapq.heapreplace(self.ready, (actual, next(self.counter), host))
+                continue
+            if ready_at > now:
+                return None, 0, ready_at - now
+
+            heapq.heappop(self.ready)
+            queue.bucket.take(now)
+            queue.in_flight += 1
+            url, attempt = queue.urls.popleft()
+            self.pending -= 1
+            self.schedule(host, now)
+            return url, attempt, None
+        return None, 0, None
+
+    def done(self, url, now):
+        """
+        Mark a request to the host of the URL as finished
+        :param url: URL which was fetched
+        :param now: Current monotonic time
+        :return: None
+        """
+        host = urlsplit(url).hostname or ''
+        queue = self.hosts[host]
+        queue.in_flight -= 1
+        self.schedule(host, now)
+
+    def retry(self, url, attempt, retry_after, now):
+        """
+        Put a failed URL back into the queue and pause its host
+        :param url: URL which failed
+        :param attempt: Number of the attempt which failed
+        :param retry_after: Seconds the server asked to wait, None if not given
+        :param now: Current monotonic time
+        :return: True if the URL is retried, False if it ran out of retries
+        """
+        if attempt >= self.max_retries:
+            return False
+        host = urlsplit(url).hostname or ''
+        queue = self.hosts[host]
+        queue.not_before = max(queue.not_before, now + backoff_delay(attempt, retry_after))
+        queue.urls.appendleft((url, attempt + 1))
+        self.pending += 1
+        self.done(url, now)
+        return True
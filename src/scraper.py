@@ -1,11 +1,59 @@
-import re
-from datetime import datetime
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
 
 import requests
 from bs4 import BeautifulSoup
-from colorama import Fore, Style
-from src.variables import BLICK_ARTICLE, BLICK_AUTOR, BLICK_TIME, BLICK_TITLE, BLICK_URL, MIN_ARTICLE, MIN_AUTOR, \
-    MIN_PARAGRAPH, MIN_SUB_TITLE, MIN_TEXT, MIN_TIME, MIN_TITLE, MIN_UNWANTED_VON_ELEMENT, MIN_URL
+from bs4.builder import builder_registry
+from requests.adapters import HTTPAdapter
+
+from src.article import Article
+from src.dates import parse_date
+from src.fetcher import AsyncFetcher, MAX_CONNECTIONS, MAX_CONNECTIONS_PER_HOST, iterate_async
+from src.scheduler import DEFAULT_RATE, MAX_RETRIES, RETRY_STATUS, PolitenessScheduler, RetryableError, \
+    parse_retry_after
+from src.metrics import METRICS, timed
+from src.sites import SITES, SiteRegistry
+from src.stream import read_until
+from src.variables import BLICK_URL, MIN_URL
+
+# HTML parser backends of BeautifulSoup, the fastest one is used by default
+PARSER_BACKENDS = ['lxml', 'html.parser']
+FALLBACK_PARSER = 'html.parser'
+
+
+def resolve_parser(parser):
+    """
+    Check if the library of the parser backend is installed and fall back to the built-in parser otherwise
+    :param parser: Name of the parser backend, e.g. 'lxml'
+    :return: Name of the parser backend to use
+    """
+    if builder_registry.lookup(parser) is None:
+        return FALLBACK_PARSER
+    return parser
+
+
+# Scraper of a parser worker process
+_worker_scraper = None
+
+
+def parse_in_worker(site, html_content, parser, sites_path):
+    """
+    Parse the HTML content of a site in a parser worker process, the scraper is created once per process
+    :param site: Site the content was fetched from, as returned by Scraper.match_site
+    :param html_content: HTML content of the page
+    :param parser: Name of the parser backend
+    :param sites_path: Configuration file of the site adapters
+    :return: Tuple of the parsed Articles and the parse time in seconds, recorded by the calling process
+    """
+    global _worker_scraper
+    if _worker_scraper is None or (_worker_scraper.parser, _worker_scraper.sites.path) != (parser, sites_path):
+        sites = SITES if sites_path == SITES.path else SiteRegistry.load(sites_path)
+        _worker_scraper = Scraper(parser=parser, sites=sites)
+    start = time.perf_counter()
+    data = _worker_scraper.parse_site(site, html_content)
+    return data, time.perf_counter() - start
 
 
 class Scraper:
@@ -13,136 +61,325 @@ class Scraper:
     Scraper class to handle the scraping of the web pages and parsing the data
     """
 
-    def __init__(self):
+    def __init__(self, timeout=(5, 30), max_connections=MAX_CONNECTIONS, max_per_host=MAX_CONNECTIONS_PER_HOST,
+                 parser=PARSER_BACKENDS[0], cache=None, rates=None, default_rate=DEFAULT_RATE,
+                 max_retries=MAX_RETRIES, sites=None, stream=False):
+        self.parser = resolve_parser(parser)
+        self.stream = stream
+        self.sites = SITES if sites is None else sites
+        self.rates = self.sites.rates() if rates is None else rates
+        self.default_rate = default_rate
+        self.max_retries = max_retries
+        self.cache = cache
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
-    def fetch_page(self, url):
+    @timed('scraper_fetch_seconds')
+    def fetch_response(self, url, headers=None, stream=False):
         """
-        Fetch the page content from the given URL using the requests library
+        Send the GET request for the given URL using the requests library
         :param url: URL of the page to fetch
-        :return: HTML content of the page
+        :param headers: Additional request headers
+        :param stream: Return after the headers and leave the body to be read in chunks
+        :return: Response of the request
         """
         try:
-            response = self.session.get(url)
+            response = self.session.get(url, timeout=self.timeout, headers=headers, stream=stream)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise RetryableError(f"Failed to load page {url}")
         except requests.RequestException as e:
-            raise Exception(Fore.RED + f"Failed to load page {url}" + Style.RESET_ALL)
-        return response.content
+            raise Exception(f"Failed to load page {url}")
 
-    def parse_20min_ch(self, html_content):
+        METRICS.inc('scraper_responses_total', status=response.status_code)
+        if response.status_code in RETRY_STATUS:
+            raise RetryableError(f"Failed to load page {url}: HTTP {response.status_code}",
+                                 parse_retry_after(response.headers.get('Retry-After')))
+        if not response.ok:
+            raise Exception(f"Failed to load page {url}: HTTP {response.status_code}")
+        return response
+
+    def fetch_page(self, url):
         """
-        Parse the HTML content from 20min.ch and extract the title, time, author, and text
-        :param html_content: HTML content of the page
-        :return: Parsed data
+        Fetch the page content from the given URL using the requests library
+        :param url: URL of the page to fetch
+        :return: HTML content of the page
         """
-        soup = BeautifulSoup(html_content, 'html.parser')
-        articles = soup.select(MIN_ARTICLE)
-        data = []
-
-        for article in articles:
-            title_elem = article.select_one(MIN_TITLE)
-            title = title_elem.get_text(strip=True)
-
-            time_elem = article.select_one(MIN_TIME)
-            time = time_elem['datetime']
+        return self.read_content(url, self.fetch_response(url, stream=self.stream))
 
-            # uncomment the following lines to pass the tests and comment the line above
-            # time_string = time_elem['datetime']
-            # time = datetime.fromisoformat(time_string[:-1])
-
-            autor_elem = article.select_one(MIN_AUTOR)
-            if autor_elem:
-                for unwanted in autor_elem.find_all(class_=MIN_UNWANTED_VON_ELEMENT):
-                    unwanted.decompose()
-            autor = autor_elem.get_text(strip=True)
+    def read_content(self, url, response):
+        """
+        Read the body of the response, in streaming mode only up to the end of the article of the site
+        :param url: URL of the page
+        :param response: Response of the request
+        :return: HTML content of the page
+        """
+        if not self.stream:
+            return response.content
+        try:
+            selector = self.sites.match(url).stream_end
+        except ValueError:
+            selector = None
+        if selector is None:
+            content = response.content
+        else:
+            content, truncated = read_until(response, selector)
+            if truncated:
+                METRICS.inc('scraper_truncated_total')
+        METRICS.inc('scraper_bytes_total', len(content))
+        return content
 
-            text = ''
-            current_tag = article.select_one(
-                MIN_TEXT)
+    def fetch(self, url):
+        """
+        Fetch the page with a conditional request if a response cache is configured
+        :param url: URL of the page to fetch
+        :return: Tuple of the HTML content and the cached data, the data is None if the page has to be parsed
+        """
+        if self.cache is None:
+            return self.fetch_page(url), None
 
-            while current_tag:
-                if current_tag.name == 'div' and MIN_PARAGRAPH in current_tag.get('class', []):
-                    text += current_tag.get_text(strip=True) + '\n'
-                elif current_tag.name == 'div' and MIN_SUB_TITLE in current_tag.get('class', []):
-                    text += f'\n{current_tag.get_text(strip=True)}\n'
+        response = self.fetch_response(url, self.cache.validators(url), self.stream)
+        if response.status_code == 304:
+            # The connection of the empty response goes back to the pool before the page is fetched again
+            response.close()
+            data = self.cache.hit(url)
+            # Data cached before the Article records is parsed again
+            if data is not None and all(isinstance(article, Article) for article in data):
+                METRICS.inc('scraper_cache_hits_total')
+                return None, data
+            response = self.fetch_response(url, stream=self.stream)
+        self.cache.miss(url, response)
+        return self.read_content(url, response), None
 
-                current_tag = current_tag.find_next()
-                if current_tag and not article in current_tag.parents or current_tag is None:
-                    break
+    def make_soup(self, html_content):
+        """
+        Parse the HTML content into a BeautifulSoup tree with the configured parser backend
+        :param html_content: HTML content of the page
+        :return: BeautifulSoup object
+        """
+        return BeautifulSoup(html_content, self.parser)
 
-            data.append((title, time, autor, text))
+    def parse_20min_ch(self, html_content):
+        """
+        Parse the HTML content from 20min.ch and extract the title, time, author, and text
+        :param html_content: HTML content of the page
+        :return: List of Articles
+        """
+        return self.parse_site('20min', html_content)
 
-        return data
+    @staticmethod
+    def extract_text(tags, is_paragraph, is_subtitle):
+        """
+        Build the article text from the paragraphs and subtitles in a single pass over the tags
+        :param tags: Tags of the article subtree in document order
+        :param is_paragraph: Function returning True if the tag is a paragraph
+        :param is_subtitle: Function returning True if the tag is a subtitle
+        :return: Article text
+        """
+        pieces = []
+        for tag in tags:
+            if is_paragraph(tag):
+                pieces.append(tag.get_text(strip=True) + '\n')
+            elif is_subtitle(tag):
+                pieces.append(f'\n{tag.get_text(strip=True)}\n')
+        return ''.join(pieces)
 
     @staticmethod
     def parse_datetime_from_string(time_string):
         """
         Parse the datetime from the given string in the format "dd.mm.yyyy um hh:mm Uhr" or "hh:mm Uhr"
         :param time_string: Time string to parse the datetime from
-        :return: Parsed datetime
-        """
-        datetime_pattern = re.compile(r'(\d{2}\.\d{2}\.\d{4}) um (\d{2}:\d{2}) Uhr')
-        time_pattern = re.compile(r'(\d{2}:\d{2}) Uhr')
-        datetime_match = datetime_pattern.search(time_string)
-        if datetime_match:
-            date_str, time_str = datetime_match.groups()
-            combined_datetime = datetime.strptime(f"{date_str} {time_str}", "%d.%m.%Y %H:%M")
-            return combined_datetime
-
-        time_match = time_pattern.search(time_string)
-        if time_match:
-            time_str = time_match.group(1)
-            hours, minutes = map(int, time_str.split(':'))
-            current_date = datetime.today()
-            combined_datetime = current_date.replace(hour=hours, minute=minutes, second=0, microsecond=0)
-            return combined_datetime
-
-        return None
+        :return: Parsed timezone-aware datetime
+        """
+        return parse_date(time_string)
 
     def parse_blick_ch(self, html_content):
         """
         Parse the HTML content from Blick.ch and extract the title, time, author, and text
         :param html_content: HTML content of the page
-        :return: Parsed data
+        :return: List of Articles
         """
-        soup = BeautifulSoup(html_content, 'html.parser')
+        return self.parse_site('blick', html_content)
 
-        title = soup.find('h2', class_=BLICK_TITLE).get_text(strip=True)
-        time = soup.find('div', class_=BLICK_TIME).get_text(strip=True)
+    def match_site(self, url):
+        """
+        Match the URL against the hostnames of the site adapters
+        :param url: URL to match
+        :return: Name of the site adapter
+        """
+        return self.sites.match(url).name
+
+    def parse_site(self, site, html_content):
+        """
+        Parse the HTML content with the adapter of the given site
+        :param site: Name of the site adapter, as returned by match_site
+        :param html_content: HTML content of the page
+        :return: List of Articles with the fingerprints of their text, without the fetch metadata
+        """
+        with METRICS.timer('scraper_parse_seconds', site=site):
+            # The fingerprints are computed here, in the parser processes, instead of in the store call
+            return [article.fingerprint() for article in self.sites.adapters[site].parse(
+                self.make_soup(html_content), self.extract_text)]
 
-        time = self.parse_datetime_from_string(time)
+    def parse(self, url, html_content):
+        """
+        Parse the HTML content with the parser matching the URL pattern
+        :param url: URL the content was fetched from
+        :param html_content: HTML content of the page
+        :return: List of Articles carrying the URL and the fetch time
+        """
+        return self.stamp(url, self.parse_site(self.match_site(url), html_content))
 
-        autor = soup.find('span', class_=BLICK_AUTOR).get_text(strip=True)
+    @staticmethod
+    def stamp(url, articles):
+        """
+        Attach the URL and the fetch time to the parsed articles of a page
+        :param url: URL the page was fetched from
+        :param articles: List of Articles
+        :return: List of Articles with the metadata
+        """
+        fetched = datetime.now(timezone.utc)
+        return [article.stamp(url, fetched) for article in articles]
 
-        article = soup.find('article', class_=BLICK_ARTICLE)
+    def scrape(self, url):
+        """
+        Scrape the given URL and return the parsed data based on the URL pattern
+        :param url: URL to scrape
+        :return: List of Articles
+        """
+        html_content, data = self.fetch(url)
+        if data is None:
+            data = self.parse(url, html_content)
+            if self.cache is not None:
+                self.cache.store(url, data)
+        return data
 
-        current_tag = article.find()
+    def make_scheduler(self):
+        """
+        Create a politeness scheduler with the rate limits of the scraper
+        :return: PolitenessScheduler
+        """
+        return PolitenessScheduler(self.rates, self.default_rate, max_per_host=self.max_per_host,
+                                   max_retries=self.max_retries)
 
-        text = ''
+    def scrape_many(self, urls, workers=0, ordered=False, scheduler=None, pool=None):
+        """
+        Scrape many URLs concurrently and yield the parsed data as soon as each page finishes
+        :param urls: Iterable of URLs to scrape
+        :param workers: Number of parser processes, with 0 the pages are parsed in the calling process
+        :param ordered: Yield the results in the order of the URLs instead of the completion order
+        :param scheduler: Scheduler kept across calls so the rate limits carry over, a new one is created if None
+        :param pool: Process pool of the parsers kept across calls, a new one is created if None
+        :return: Generator of (url, data, error) tuples, error is None if successful
+        """
+        order = deque()
 
-        while True:
-            if current_tag.name == 'p':
-                text += current_tag.get_text(strip=True) + '\n'
-            elif current_tag.name == 'h3':
-                text += f'\n{current_tag.get_text(strip=True)}\n'
+        def track(items):
+            for item in items:
+                order.append(item)
+                yield item
 
-            current_tag = current_tag.find_next()
+        if scheduler is None:
+            scheduler = self.make_scheduler()
+        else:
+            scheduler.reset()
+        fetcher = AsyncFetcher(self.fetch, scheduler, self.max_connections)
+        fetched = iterate_async(fetcher.fetch_many(track(urls) if ordered else urls))
+        if workers:
+            results = self.parse_in_pool(fetched, workers, pool)
+        else:
+            results = (self.parse_fetched(url, page, error) for url, page, error in fetched)
+        if not ordered:
+            yield from results
+            return
 
-            if current_tag and not article in current_tag.parents or current_tag is None:
-                break
+        finished = {}
+        for result in results:
+            finished.setdefault(result[0], deque()).append(result)
+            while order and finished.get(order[0]):
+                yield finished[order.popleft()].popleft()
 
-        return title, time, autor, text
+    def parse_fetched(self, url, page, error):
+        """
+        Parse a fetched page unless its data was cached and catch the parse errors
+        :param url: URL the content was fetched from
+        :param page: Tuple of the HTML content and the cached data as returned by fetch, None if the fetch failed
+        :param error: Error of the fetch, None if successful
+        :return: Tuple of the URL, the parsed data and the error
+        """
+        if error is not None:
+            return url, None, error
+        html_content, data = page
+        if data is not None:
+            return url, data, None
+        try:
+            data = self.parse(url, html_content)
+        except Exception as e:
+            return url, None, e
+        if self.cache is not None:
+            self.cache.store(url, data)
+        return url, data, None
 
-    def scrape(self, url):
+    def parse_in_pool(self, fetched, workers, pool=None):
         """
-        Scrape the given URL and return the parsed data based on the URL pattern
-        :param url: URL to scrape
-        :return: Parsed data
-        """
-        html_content = self.fetch_page(url)
-        match url:
-            case url if MIN_URL in url:
-                return self.parse_20min_ch(html_content)
-            case url if BLICK_URL in url:
-                return self.parse_blick_ch(html_content)
-            case _:
-                raise ValueError(f"URL not supported: {url}")
+        Hand the fetched pages to a pool of parser processes and yield the results as they complete
+        :param fetched: Iterable of (url, page, error) tuples from the fetch engine
+        :param workers: Number of parser processes
+        :param pool: Process pool to use, a pool is created and shut down afterwards if None
+        :return: Generator of (url, data, error) tuples in completion order
+        """
+        if pool is None:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                yield from self.parse_in_pool(fetched, workers, pool)
+            return
+
+        def collect(future):
+            url, site = futures.pop(future)
+            try:
+                data, seconds = future.result()
+            except Exception as e:
+                METRICS.inc('scraper_parse_errors_total', site=site)
+                return url, None, e
+            METRICS.observe('scraper_parse_seconds', seconds, site=site)
+            data = self.stamp(url, data)
+            if self.cache is not None:
+                self.cache.store(url, data)
+            return url, data, None
+
+        futures = {}
+        try:
+            for url, page, error in fetched:
+                if error is None:
+                    html_content, data = page
+                    if data is not None:
+                        yield url, data, None
+                        continue
+                    try:
+                        site = self.match_site(url)
+                    except ValueError as e:
+                        error = e
+                if error is not None:
+                    yield url, None, error
+                    continue
+                futures[pool.submit(parse_in_worker, site, html_content, self.parser, self.sites.path)] = url, site
+
+                # Keep the number of pages waiting for a parser bounded
+                if len(futures) >= workers * 2:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                else:
+                    done = [future for future in futures if future.done()]
+                for future in done:
+                    yield collect(future)
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield collect(future)
+        finally:
+            # Pages of an abandoned run must not hold up the parsers of a shared pool
+            for future in futures:
+                future.cancel()
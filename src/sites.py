@@ -0,0 +1,145 @@
+import json
+import os
+import re
+from itertools import dropwhile
+from urllib.parse import urlsplit
+
+import soupsieve
+
+from src.article import Article
+from src.dates import DEFAULT_TIMEZONE, parse_date
+from src.stream import parse_simple_selector
+
+# Site adapters shipped with the scraper
+SITES_PATH = os.path.join(os.path.dirname(__file__), 'sites.json')
+
+# Selectors of a site adapter, compiled once when the adapter is loaded
+SELECTORS = ['article', 'title', 'time', 'autor', 'autor_unwanted', 'body', 'paragraph', 'subtitle']
+REQUIRED = ['name', 'hosts', 'title', 'time', 'autor', 'body', 'paragraph', 'subtitle']
+
+
+class SiteAdapter:
+    """
+    Selectors and settings of one news site, the selectors are compiled with soupsieve when the adapter is created.
+    Sites with an article selector return all articles of a page, the others the single article of the page.
+    """
+
+    def __init__(self, config):
+        missing = [key for key in REQUIRED if key not in config]
+        if missing:
+            raise ValueError(f"Site adapter {config.get('name')} is missing: {', '.join(missing)}")
+        self.name = config['name']
+        self.hosts = config['hosts']
+        self.rate = config.get('rate')
+        self.time_attribute = config.get('time_attribute')
+        self.timezone = config.get('timezone', DEFAULT_TIMEZONE)
+        self.selectors = {key: soupsieve.compile(config[key]) for key in SELECTORS if config.get(key)}
+        # Element closing the article (or the container of all articles of sites with an article selector),
+        # the streaming mode stops downloading the page after it
+        self.stream_end = parse_simple_selector(config['stream_end']) if config.get('stream_end') else None
+        # Discovery: paths of article pages, section pages to start from and sitemaps (default: from robots.txt)
+        self.article_pattern = re.compile(config['article_pattern']) if config.get('article_pattern') else None
+        self.sections = config.get('sections', [])
+        self.sitemaps = config.get('sitemaps')
+
+    def parse(self, soup, extract_text):
+        """
+        Extract the articles of a parsed page
+        :param soup: BeautifulSoup object of the page
+        :param extract_text: Function building the article text, see Scraper.extract_text
+        :return: List of Articles, a single one unless the site has an article selector
+        """
+        if 'article' not in self.selectors:
+            return [self.parse_article(soup, extract_text)]
+        return [self.parse_article(article, extract_text)
+                for article in self.selectors['article'].select(soup)]
+
+    def parse_article(self, scope, extract_text):
+        """
+        Extract the title, time, author and text of one article
+        :param scope: Tag containing the article
+        :param extract_text: Function building the article text, see Scraper.extract_text
+        :return: Article without the fetch metadata
+        """
+        selectors = self.selectors
+        title = selectors['title'].select_one(scope).get_text(strip=True)
+
+        time_elem = selectors['time'].select_one(scope)
+        time_string = time_elem[self.time_attribute] if self.time_attribute else time_elem.get_text(strip=True)
+        time = parse_date(time_string, self.timezone)
+
+        autor_elem = selectors['autor'].select_one(scope)
+        if autor_elem and 'autor_unwanted' in selectors:
+            for unwanted in selectors['autor_unwanted'].select(autor_elem):
+                unwanted.decompose()
+        autor = autor_elem.get_text(strip=True)
+
+        body = selectors['body'].select_one(scope)
+        if body is None:
+            tags = ()
+        elif 'article' in selectors:
+            # The text runs from the body section to the end of the article, blocks after the section included
+            tags = dropwhile(lambda tag: tag is not body, scope.find_all(True))
+        else:
+            tags = body.find_all(True)
+        text = extract_text(tags, selectors['paragraph'].match, selectors['subtitle'].match)
+        return Article(title, time, autor, text)
+
+    def is_article(self, url):
+        """
+        Check if the URL of the site points to an article page
+        :param url: Normalized URL of the site
+        :return: True if the path matches the article pattern of the site
+        """
+        return self.article_pattern is not None and bool(self.article_pattern.search(urlsplit(url).path))
+
+
+class SiteRegistry:
+    """
+    Registry of the site adapters, a URL is matched to its adapter with a single lookup of its hostname
+    """
+
+    def __init__(self, adapters, path=None):
+        self.path = path
+        self.adapters = {adapter.name: adapter for adapter in adapters}
+        self.hosts = {host: adapter for adapter in adapters for host in adapter.hosts}
+
+    @classmethod
+    def load(cls, path=SITES_PATH):
+        """
+        Load the site adapters from a JSON or YAML file (YAML requires PyYAML)
+        :param path: Path of the configuration file
+        :return: SiteRegistry with the adapters of the file
+        """
+        with open(path) as f:
+            if path.endswith(('.yaml', '.yml')):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ValueError("PyYAML is required to load site adapters from YAML files.")
+                config = yaml.safe_load(f)
+            else:
+                config = json.load(f)
+        return cls([SiteAdapter(site) for site in config['sites']], path)
+
+    def match(self, url):
+        """
+        Get the adapter of the site the URL belongs to
+        :param url: URL to match
+        :return: SiteAdapter of the URL
+        """
+        adapter = self.hosts.get(urlsplit(url).hostname)
+        if adapter is None:
+            raise ValueError(f"URL not supported: {url}")
+        return adapter
+
+    def rates(self):
+        """
+        Get the configured requests per second of every host
+        :return: Dictionary of hostname and rate
+        """
+        return {host: adapter.rate for host, adapter in self.hosts.items() if adapter.rate}
+
+
+# Adapters of the configured sites, loaded once per process
+SITES = SiteRegistry.load()
@@ -0,0 +1,83 @@
+import re
+from collections import Counter
+
+try:
+    from lxml.etree import HTMLPullParser
+except ImportError:
+    HTMLPullParser = None
+
+# Bytes read from the connection at once in streaming mode
+STREAM_CHUNK = 16 * 1024
+
+# Selectors the streaming mode understands: a tag name and/or classes, e.g. "article.story.main"
+SIMPLE_SELECTOR = re.compile(r'^([a-zA-Z][\w-]*)?((?:\.[\w-]+)*)$')
+
+
+def parse_simple_selector(selector):
+    """
+    Split a simple selector into its tag name and classes
+    :param selector: Selector like "article.story" or ".story"
+    :return: Tuple of the tag name (None for any tag) and the set of classes
+    """
+    match = SIMPLE_SELECTOR.match(selector)
+    if not selector or not match:
+        raise ValueError(f"Only tag and class selectors are supported for streaming: {selector}")
+    tag, classes = match.groups()
+    return tag and tag.lower(), set(filter(None, classes.split('.')))
+
+
+def matches(element, selector):
+    """
+    Check if an element of the lxml tree matches a simple selector
+    :param element: lxml element
+    :param selector: Tuple of tag name and classes as returned by parse_simple_selector
+    :return: True if the element matches
+    """
+    tag, classes = selector
+    if tag is not None and element.tag != tag:
+        return False
+    return classes <= set((element.get('class') or '').split())
+
+
+def cut_after(content, tag, count):
+    """
+    Cut the content after the closing tag of an element, so a partially read element after it is not parsed
+    :param content: Content read so far
+    :param tag: Tag name of the element
+    :param count: Number of elements with this tag closed up to and including the element
+    :return: Content up to the closing tag, the whole content if the tag was closed implicitly
+    """
+    ends = re.finditer(rb'</' + re.escape(tag.encode()) + rb'\s*>', content, re.IGNORECASE)
+    for index, end in enumerate(ends, 1):
+        if index == count:
+            return content[:end.end()]
+    return content
+
+
+def read_until(response, selector, chunk_size=STREAM_CHUNK):
+    """
+    Read a streamed response in chunks and feed them to an incremental lxml parser, stopping the download
+    as soon as the first element matching the selector is closed. The content read after the element is dropped.
+    :param response: Response of a request sent with stream=True
+    :param selector: Tuple of tag name and classes as returned by parse_simple_selector
+    :param chunk_size: Bytes read at once
+    :return: Tuple of the content read and True if the download was stopped early
+    """
+    if HTMLPullParser is None:
+        return response.content, False
+
+    parser = HTMLPullParser(events=('end',))
+    chunks = []
+    closed = Counter()
+    try:
+        for chunk in response.iter_content(chunk_size):
+            chunks.append(chunk)
+            parser.feed(chunk)
+            for _, element in parser.read_events():
+                closed[element.tag] += 1
+                if matches(element, selector):
+                    return cut_after(b''.join(chunks), element.tag, closed[element.tag]), True
+        return b''.join(chunks), False
+    finally:
+        # Closing the response drops the connection instead of downloading the rest of the page
+        response.close()
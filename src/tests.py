@@ -1,12 +1,79 @@
+import os
 import unittest
-from datetime import datetime
-from unittest.mock import patch, Mock, MagicMock, call
-from main import exit_app, check_file, scrape_data, main
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from unittest.mock import patch, Mock, MagicMock, call, ANY
+from main import exit_app, check_file, scrape_data, main, run_batch
+from src.urls import normalize_url, read_urls
 import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from requests import RequestException
 
-from scraper import Scraper
-from database import Database
+from src.cache import ResponseCache
+from src.journal import CrawlJournal, FAILED, PARSED, STORED
+from src.scheduler import PolitenessScheduler, RetryableError, parse_retry_after
+from scraper import Scraper, PARSER_BACKENDS, FALLBACK_PARSER, resolve_parser
+from database import COLUMNS, Database
+from src.fingerprint import content_hash, hamming_distance, simhash
+from src.article import Article
+
+# Sample HTML content used by the parser tests
+BLICK_HTML = """
+    <h2 class="sc-42b0166d-0 htRjAb">Blick Test Title</h2>
+    <div class="sc-bb3977dc-0 gsPNmc">12.06.2024 um 14:00 Uhr</div>
+    <span class="sc-4e82f8ca-0 kyLqjh">Autor Name</span>
+    <article class="sc-845e3996-0 gMfVCb">
+        <p>First paragraph of the article.</p>
+        <h3>Subheading</h3>
+        <p>Second paragraph of the article.</p>
+    </article>
+"""
+
+MIN_HTML = """
+    <article class="Article_article__sV3bX Article_siteAreaNews__Frmfx">
+        <header class="Article_header__ckSlm">
+            <div class="Article_elementTitle__9QPjy">
+                  <h2>20min Test Title</h2>
+            </div>
+            <div class="Article_elementPublishdate__qcso_">
+                <div class="sc-d721210-0 glCzFI">
+                    <time datetime="2024-06-12T14:00:00.000">12.06.2024 um 14:00 Uhr</time>
+                </div>
+            </div>
+            <div class="Article_elementAuthors__LsHcz">
+                <section class="sc-edde8439-1 ghCqoI">
+                    <div class="sc-edde8439-0 bokODS">
+                        <dl class="sc-bea1a0f7-0 eGqAWD">
+                            <div class="sc-bea1a0f7-3 gdDZBe">
+                                <a class="sc-bea1a0f7-6 iPEoXP">
+                                    <dd class="sc-bea1a0f7-2 hOUMxP">
+                                        Autor Name
+                                    </dd>
+                                </a>
+                            </div>
+                        </dl>
+                    </div>
+                </section>
+            </div>
+        </header>
+        <section class="Article_body__60Liu">
+            <div class="Article_elementTextblockarray__WNyan">
+                <p>
+                    First paragraph of the article.
+                </p>
+            </div>
+            <div class="Article_elementCrosshead__b9pyw">
+                <h2>Subheading</h2>
+            </div>
+            <div class="Article_elementTextblockarray__WNyan">
+                <p>
+                    Second paragraph of the article.
+                </p>
+            </div>
+        </section>
+    </article>
+"""
 
 
 class TestScraper(unittest.TestCase):
@@ -20,24 +87,15 @@ class TestScraper(unittest.TestCase):
         Test the parse_blick_ch method of the Scraper class with a sample HTML content
         """
         scraper = Scraper()
-        html_content_blick = """
-           <h2 class="sc-42b0166d-0 htRjAb">Blick Test Title</h2>
-           <div class="sc-bb3977dc-0 gsPNmc">12.06.2024 um 14:00 Uhr</div>
-           <span class="sc-4e82f8ca-0 kyLqjh">Autor Name</span>
-           <article class="sc-845e3996-0 gMfVCb">
-               <p>First paragraph of the article.</p>
-               <h3>Subheading</h3>
-               <p>Second paragraph of the article.</p>
-           </article>
-           """
-        data = scraper.parse_blick_ch(html_content_blick)
-        expected_data = (
+        data = scraper.parse_blick_ch(BLICK_HTML)
+        expected_data = Article(
             'Blick Test Title',
-            datetime(2024, 6, 12, 14, 0),
+            datetime(2024, 6, 12, 14, 0, tzinfo=ZoneInfo('Europe/Zurich')),
             'Autor Name',
             'First paragraph of the article.\n\nSubheading\nSecond paragraph of the article.\n'
-        )
-        assert data == expected_data
+        ).fingerprint()
+        assert data == [expected_data]
+        assert data[0].simhash == simhash(data[0].text)
 
     @staticmethod
     def test_parse_20min_ch():
@@ -45,61 +103,23 @@ class TestScraper(unittest.TestCase):
         Test the parse_20min_ch method of the Scraper class with a sample HTML content
         """
         scraper = Scraper()
-        html_content_20min = """
-        <article class="Article_article__sV3bX Article_siteAreaNews__Frmfx">
-            <header class="Article_header__ckSlm">
-                <div class="Article_elementTitle__9QPjy">
-                      <h2>20min Test Title</h2>
-                </div>
-                <div class="Article_elementPublishdate__qcso_">
-                    <div class="sc-d721210-0 glCzFI">
-                        <time datetime="2024-06-12T14:00:00.000">12.06.2024 um 14:00 Uhr</time>
-                    </div>
-                </div>
-                <div class="Article_elementAuthors__LsHcz">
-                    <section class="sc-edde8439-1 ghCqoI">
-                        <div class="sc-edde8439-0 bokODS">
-                            <dl class="sc-bea1a0f7-0 eGqAWD">
-                                <div class="sc-bea1a0f7-3 gdDZBe">
-                                    <a class="sc-bea1a0f7-6 iPEoXP">
-                                        <dd class="sc-bea1a0f7-2 hOUMxP">
-                                            Autor Name
-                                        </dd>
-                                    </a>
-                                </div>
-                            </dl>
-                        </div>
-                    </section>
-                </div>
-            </header>
-            <section class="Article_body__60Liu">
-                <div class="Article_elementTextblockarray__WNyan">
-                    <p>
-                        First paragraph of the article.
-                    </p>
-                </div>
-                <div class="Article_elementCrosshead__b9pyw">
-                    <h2>Subheading</h2>
-                </div>
-                <div class="Article_elementTextblockarray__WNyan">
-                    <p>
-                        Second paragraph of the article.
-                    </p>
-                </div>
-            </section>
-        </article>
-                """
-        data = scraper.parse_20min_ch(html_content_20min)
+
+        data = scraper.parse_20min_ch(MIN_HTML)
         print("Returned data: ", data)
-        expected_data = (
+        expected_data = Article(
             '20min Test Title',
-            datetime(2024, 6, 12, 14, 0),
+            datetime(2024, 6, 12, 14, 0, tzinfo=timezone.utc),
             'Autor Name',
             'First paragraph of the article.\n\nSubheading\nSecond paragraph of the article.\n'
-        )
+        ).fingerprint()
         print("Expected data: ", expected_data)
         assert data[0] == expected_data
 
+        # Blocks after the body section still belong to the article
+        trailer = '<div class="Article_elementTextblockarray__WNyan"><p>Nachtrag.</p></div></article>'
+        data = scraper.parse_20min_ch(MIN_HTML.replace('</article>', trailer))
+        assert data[0].text == expected_data.text + 'Nachtrag.\n'
+
     @staticmethod
     def test_parse_datetime_from_string():
         """
@@ -108,7 +128,7 @@ class TestScraper(unittest.TestCase):
         scraper = Scraper()
         time_string = '12.06.2024 um 14:00 Uhr'
         data = scraper.parse_datetime_from_string(time_string)
-        assert str(data) == '2024-06-12 14:00:00'
+        assert str(data) == '2024-06-12 14:00:00+02:00'
 
     @staticmethod
     @patch('webScraper.requests.Session.get')
@@ -136,6 +156,684 @@ class TestScraper(unittest.TestCase):
         with pytest.raises(Exception, match="Failed to load page https://example.com"):
             scraper.fetch_page(url)
 
+    @staticmethod
+    def test_fetch_error_message():
+        """
+        Test that the fetch errors carry plain messages, they are stored in the journal and the work queue
+        """
+        scraper = Scraper()
+        with patch.object(scraper.session, 'get', return_value=Mock(status_code=404, ok=False)):
+            with pytest.raises(Exception) as error:
+                scraper.fetch_response('https://www.blick.ch/a')
+        assert str(error.value) == "Failed to load page https://www.blick.ch/a: HTTP 404"
+
+    @staticmethod
+    def test_scrape_many():
+        """
+        Test the scrape_many method of the Scraper class with a mocked fetch_page method
+        """
+        scraper = Scraper(max_connections=2, max_per_host=1)
+        urls = ['https://www.blick.ch/a', 'https://www.blick.ch/b', 'https://www.blick.ch/c']
+
+        def fetch_page(url):
+            if url.endswith('b'):
+                raise Exception(f"Failed to load page {url}")
+            return BLICK_HTML
+
+        with patch.object(scraper, 'fetch_page', side_effect=fetch_page):
+            results = {url: (data, error) for url, data, error in scraper.scrape_many(urls)}
+
+        assert set(results) == set(urls)
+        article = results['https://www.blick.ch/a'][0][0]
+        assert (article.title, article.url) == ('Blick Test Title', 'https://www.blick.ch/a')
+        assert article.fetched.tzinfo is timezone.utc
+        assert results['https://www.blick.ch/b'][0] is None
+        assert str(results['https://www.blick.ch/b'][1]) == "Failed to load page https://www.blick.ch/b"
+        assert results['https://www.blick.ch/c'][1] is None
+
+    @staticmethod
+    def test_scrape_many_ordered_with_workers():
+        """
+        Test the scrape_many method of the Scraper class with parser processes and ordered results
+        """
+        scraper = Scraper()
+        urls = ['https://www.blick.ch/a', 'https://www.20min.ch/b', 'https://example.com/c', 'https://www.blick.ch/d']
+        pages = {'https://www.blick.ch/a': BLICK_HTML, 'https://www.20min.ch/b': MIN_HTML,
+                 'https://example.com/c': '<html></html>', 'https://www.blick.ch/d': '<html></html>'}
+
+        with patch.object(scraper, 'fetch_page', side_effect=pages.get):
+            results = list(scraper.scrape_many(urls, workers=2, ordered=True))
+
+        assert [url for url, data, error in results] == urls
+        assert results[0][1] == [article.stamp(urls[0], results[0][1][0].fetched)
+                                 for article in scraper.parse_blick_ch(BLICK_HTML)]
+        assert [article.url for article in results[1][1]] == [urls[1]]
+        assert results[1][1][0][:4] == scraper.parse_20min_ch(MIN_HTML)[0][:4]
+        assert isinstance(results[2][2], ValueError)
+        assert isinstance(results[3][2], AttributeError)
+
+        # A pool and a scheduler passed in stay usable for the next batch
+        scheduler = scraper.make_scheduler()
+        with ProcessPoolExecutor(max_workers=2) as pool, patch.object(scraper, 'fetch_page', side_effect=pages.get):
+            for _ in range(2):
+                batch = list(scraper.scrape_many(urls[:2], workers=2, ordered=True, scheduler=scheduler, pool=pool))
+                assert [data[0][:4] for url, data, error in batch] == [results[0][1][0][:4], results[1][1][0][:4]]
+
+    @staticmethod
+    def test_stream_stops_after_article():
+        """
+        Test that the streaming mode stops reading the page once the article is closed
+        """
+        page = (BLICK_HTML + '<footer>' + '<div>Teaser</div>' * 5000 + '</footer>').encode()
+        chunks = [page[i:i + 256] for i in range(0, len(page), 256)]
+        remaining = iter(chunks)
+        response = Mock(status_code=200, ok=True, iter_content=Mock(return_value=remaining))
+        scraper = Scraper(stream=True)
+        with patch.object(scraper.session, 'get', return_value=response) as mock_get:
+            data = scraper.scrape('https://www.blick.ch/story')
+
+        assert mock_get.call_args.kwargs['stream'] is True
+        assert [article[:4] for article in data] == [article[:4] for article in Scraper().parse_blick_ch(BLICK_HTML)]
+        assert len(list(remaining)) > len(chunks) // 2
+        response.close.assert_called_once_with()
+
+    @staticmethod
+    def test_stream_keeps_all_articles():
+        """
+        Test that the streaming mode reads all articles of a 20min page and drops the partial content after them
+        """
+        from src.benchmark import min_fixture
+        html = min_fixture(paragraphs=5, blocks=50)
+        start, end = html.index('<article'), html.index('</main>')
+        second = html[start:end].replace('20min Benchmark Titel', 'Zweiter Titel')
+        page = (html[:end] + second + html[end:]).encode()
+        chunks = [page[i:i + 256] for i in range(0, len(page), 256)]
+        response = Mock(status_code=200, ok=True, iter_content=Mock(return_value=iter(chunks)))
+        scraper = Scraper(stream=True)
+        with patch.object(scraper.session, 'get', return_value=response):
+            data = scraper.scrape('https://www.20min.ch/story')
+
+        assert [article.title for article in data] == ['20min Benchmark Titel', 'Zweiter Titel']
+        assert [article[:4] for article in data] == [article[:4] for article in Scraper().parse_20min_ch(page)]
+
+
+class TestParserBackends(unittest.TestCase):
+    """
+    Test cases checking that every parser backend of the Scraper class returns the same data
+    """
+
+    def test_backend_parity(self):
+        """
+        Test that each available parser backend returns the same tuples for the Blick and 20min samples
+        """
+        reference = Scraper(parser=FALLBACK_PARSER)
+        for backend in PARSER_BACKENDS:
+            with self.subTest(backend=backend):
+                scraper = Scraper(parser=backend)
+                assert scraper.parse_blick_ch(BLICK_HTML) == reference.parse_blick_ch(BLICK_HTML)
+                assert scraper.parse_20min_ch(MIN_HTML) == reference.parse_20min_ch(MIN_HTML)
+
+    def test_missing_backend_falls_back(self):
+        """
+        Test that an unavailable parser backend falls back to the built-in parser
+        """
+        assert resolve_parser('not-installed') == FALLBACK_PARSER
+        assert Scraper(parser='not-installed').parser == FALLBACK_PARSER
+
+
+class TestSiteRegistry(unittest.TestCase):
+    """
+    Test cases for the site adapters in sites.py
+    """
+
+    def test_match_by_hostname(self):
+        """
+        Test that URLs are matched to their adapter by hostname and unknown hosts are rejected
+        """
+        scraper = Scraper()
+        assert scraper.match_site('https://www.blick.ch/story') == 'blick'
+        assert scraper.match_site('http://20min.ch/story') == '20min'
+        with pytest.raises(ValueError, match="URL not supported"):
+            scraper.match_site('https://example.com/www.blick.ch')
+
+    def test_load_yaml_adapter(self):
+        """
+        Test that a site adapter is loaded from a YAML file and used by the scraper
+        """
+        import tempfile
+        from src.sites import SiteRegistry
+        config = """
+sites:
+  - name: example
+    hosts: [news.example.com]
+    rate: 1.0
+    title: h1
+    time: .date
+    autor: .author
+    body: .story
+    paragraph: p
+    subtitle: h2
+"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'sites.yaml')
+            with open(path, 'w') as f:
+                f.write(config)
+            scraper = Scraper(sites=SiteRegistry.load(path))
+        html = ('<h1>Title</h1><span class="date">12.06.2024 um 14:00 Uhr</span><span class="author">Autor</span>'
+                '<div class="story"><p>One.</p><h2>Sub</h2><p>Two.</p></div>')
+        assert scraper.rates == {'news.example.com': 1.0}
+        [article] = scraper.parse('https://news.example.com/a', html)
+        assert article[:5] == ('Title', datetime(2024, 6, 12, 14, 0, tzinfo=ZoneInfo('Europe/Zurich')), 'Autor',
+                               'One.\n\nSub\nTwo.\n', 'https://news.example.com/a')
+
+
+class TestDates(unittest.TestCase):
+    """
+    Test cases for the date normalization in dates.py
+    """
+
+    def test_known_formats(self):
+        """
+        Test that the page and attribute formats return timezone-aware datetimes
+        """
+        from src.dates import parse_date
+        zurich = ZoneInfo('Europe/Zurich')
+        assert parse_date('12.06.2024 um 14:00 Uhr') == datetime(2024, 6, 12, 14, 0, tzinfo=zurich)
+        assert parse_date(' 1.2.2024, 9:05 ') == datetime(2024, 2, 1, 9, 5, tzinfo=zurich)
+        assert parse_date('2024-06-12T14:00:00.000Z') == datetime(2024, 6, 12, 14, 0, tzinfo=timezone.utc)
+        # The suffix is replaced by an offset, fromisoformat of Python 3.10 rejects it
+        assert parse_date('2024-06-12T14:00:00z') == datetime(2024, 6, 12, 14, 0, tzinfo=timezone.utc)
+        assert parse_date('2024-06-12T16:00:00+02:00') == datetime(2024, 6, 12, 14, 0, tzinfo=timezone.utc)
+        assert parse_date('gestern') is None
+
+    def test_time_only_uses_current_date(self):
+        """
+        Test that a memoized "hh:mm Uhr" string follows the current date
+        """
+        from datetime import date
+        from src import dates
+        with patch.object(dates, 'today', return_value=date(2024, 6, 12)):
+            assert dates.parse_date('14:00 Uhr').date() == date(2024, 6, 12)
+        with patch.object(dates, 'today', return_value=date(2024, 6, 13)):
+            assert dates.parse_date('14:00 Uhr').date() == date(2024, 6, 13)
+
+
+class TestFingerprint(unittest.TestCase):
+    """
+    Test cases for the content fingerprints in fingerprint.py
+    """
+
+    def test_content_hash_and_simhash(self):
+        """
+        Test that formatting changes keep the hash and small edits keep the SimHash close
+        """
+        from src.fingerprint import NEAR_DUPLICATE_DISTANCE, bands
+        text = 'Der Bundesrat hat am Mittwoch entschieden, die Massnahmen ab Montag zu lockern. ' * 20
+        edited = text.replace('Mittwoch', 'Dienstag', 1)
+        assert content_hash(text) == content_hash(text.upper().replace(' ', '  '))
+        assert content_hash(text) != content_hash(edited)
+        assert hamming_distance(simhash(text), simhash(edited)) <= NEAR_DUPLICATE_DISTANCE
+        assert hamming_distance(simhash(text), simhash('Der FC Basel gewinnt das Cup-Finale klar. ' * 20)) > 10
+        assert -2 ** 63 <= simhash(text) < 2 ** 63
+        assert set(bands(simhash(text))) & set(bands(simhash(edited)))
+
+
+class TestResponseCache(unittest.TestCase):
+    """
+    Test cases for the ResponseCache class in cache.py
+    """
+
+    def setUp(self):
+        self.cache = ResponseCache(':memory:')
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_not_modified_skips_parse(self):
+        """
+        Test that a 304 response returns the cached data without downloading and parsing the page again
+        """
+        scraper = Scraper(cache=self.cache)
+        url = 'https://www.blick.ch/a'
+        modified = Mock(status_code=200, content=BLICK_HTML, headers={'ETag': '"v1"'})
+        not_modified = Mock(status_code=304, content=b'', headers={})
+
+        with patch.object(scraper.session, 'get', side_effect=[modified, not_modified]) as mock_get:
+            first = scraper.scrape(url)
+            with patch.object(scraper, 'parse') as mock_parse:
+                second = scraper.scrape(url)
+
+        assert first == second
+        mock_parse.assert_not_called()
+        assert mock_get.call_args_list[1].kwargs['headers'] == {'If-None-Match': '"v1"'}
+        assert self.cache.stats()['hits'] == 1
+        assert self.cache.stats()['misses'] == 1
+        not_modified.close.assert_called_once_with()
+
+        # A 304 without cached data is closed before the page is fetched again
+        not_modified.reset_mock()
+        with patch.object(scraper.session, 'get', side_effect=[not_modified, modified]), \
+                patch.object(self.cache, 'hit', return_value=None):
+            assert [article._replace(fetched=None) for article in scraper.scrape(url)] == \
+                [article._replace(fetched=None) for article in first]
+        not_modified.close.assert_called_once_with()
+
+    def test_lru_eviction(self):
+        """
+        Test that the least recently used pages are evicted above the size cap
+        """
+        response = Mock(headers={'Last-Modified': 'Wed, 12 Jun 2024 14:00:00 GMT'})
+        for url in ['a', 'b', 'c']:
+            self.cache.miss(url, response)
+            self.cache.store(url, 'x' * 100)
+        self.cache.max_bytes = self.cache.stats()['bytes']
+        self.cache.hit('a')
+        self.cache.miss('d', response)
+        self.cache.store('d', 'x' * 100)
+
+        assert self.cache.validators('b') == {}
+        assert self.cache.validators('a') == {'If-Modified-Since': 'Wed, 12 Jun 2024 14:00:00 GMT'}
+        assert self.cache.stats()['entries'] == 3
+
+
+class TestPolitenessScheduler(unittest.TestCase):
+    """
+    Test cases for the PolitenessScheduler class in scheduler.py
+    """
+
+    def test_rate_limit_per_host(self):
+        """
+        Test that a rate limited host waits for its tokens while another host is served
+        """
+        scheduler = PolitenessScheduler({'www.blick.ch': 1.0}, default_rate=100.0, burst=1)
+        for url in ['https://www.blick.ch/a', 'https://www.blick.ch/b', 'https://www.20min.ch/c']:
+            scheduler.push(url, 0.0)
+
+        first = scheduler.pop(0.0)[0]
+        second = scheduler.pop(0.0)[0]
+        assert {first, second} == {'https://www.blick.ch/a', 'https://www.20min.ch/c'}
+        url, attempt, wait_time = scheduler.pop(0.0)
+        assert url is None and wait_time == pytest.approx(1.0)
+        assert scheduler.pop(1.0)[0] == 'https://www.blick.ch/b'
+
+    def test_retry_after_pauses_only_the_host(self):
+        """
+        Test that a throttled host is paused for the Retry-After time and retried, without blocking other hosts
+        """
+        scheduler = PolitenessScheduler(default_rate=100.0, max_retries=1)
+        scheduler.push('https://www.blick.ch/a', 0.0)
+        url, attempt, _ = scheduler.pop(0.0)
+
+        assert scheduler.retry(url, attempt, 30.0, 0.0)
+        scheduler.push('https://www.20min.ch/b', 0.0)
+        assert scheduler.pop(0.0)[0] == 'https://www.20min.ch/b'
+        assert scheduler.pop(29.0)[0] is None
+        url, attempt, _ = scheduler.pop(30.0)
+        assert (url, attempt) == ('https://www.blick.ch/a', 1)
+        assert not scheduler.retry(url, attempt, None, 30.0)
+
+    def test_reset_keeps_rate_limits(self):
+        """
+        Test that resetting the scheduler drops an abandoned run but keeps the rate limit and the backoff of the hosts
+        """
+        scheduler = PolitenessScheduler({'www.blick.ch': 1.0}, default_rate=100.0, burst=1, max_per_host=1)
+        for url in ['https://www.blick.ch/a', 'https://www.blick.ch/b', 'https://www.20min.ch/c']:
+            scheduler.push(url, 0.0)
+        scheduler.pop(0.0)
+        scheduler.pop(0.0)
+        assert scheduler.retry('https://www.20min.ch/c', 0, 30.0, 0.0)
+
+        scheduler.reset()
+        assert scheduler.pending == 0 and scheduler.pop(0.0)[0] is None
+        scheduler.push('https://www.blick.ch/d', 0.0)
+        scheduler.push('https://www.20min.ch/e', 0.0)
+        assert scheduler.pop(0.5)[0] is None
+        assert scheduler.pop(1.0)[0] == 'https://www.blick.ch/d'
+        assert scheduler.pop(30.0)[0] == 'https://www.20min.ch/e'
+
+    def test_parse_retry_after(self):
+        """
+        Test the parse_retry_after function in scheduler.py with seconds and HTTP dates
+        """
+        now = datetime(2024, 6, 12, 14, 0, tzinfo=timezone.utc)
+        assert parse_retry_after('120') == 120.0
+        assert parse_retry_after('Wed, 12 Jun 2024 14:01:00 GMT', now) == 60.0
+        assert parse_retry_after('soon') is None
+
+    def test_fetch_response_retryable_status(self):
+        """
+        Test that the fetch_response method of the Scraper class raises a RetryableError on HTTP 429
+        """
+        scraper = Scraper()
+        throttled = Mock(status_code=429, headers={'Retry-After': '5'})
+        with patch.object(scraper.session, 'get', return_value=throttled):
+            with pytest.raises(RetryableError) as error:
+                scraper.fetch_response('https://www.blick.ch/a')
+        assert error.value.retry_after == 5.0
+
+
+class TestCrawlJournal(unittest.TestCase):
+    """
+    Test cases for the CrawlJournal class in journal.py
+    """
+
+    def setUp(self):
+        self.journal = CrawlJournal(':memory:')
+
+    def tearDown(self):
+        self.journal.close()
+
+    def test_resume_unfinished(self):
+        """
+        Test that stored URLs are skipped on restart and failed URLs only if they are retried
+        """
+        urls = ['https://www.blick.ch/a', 'https://www.blick.ch/b', 'https://www.blick.ch/c']
+        assert list(self.journal.pending(urls)) == urls
+        self.journal.mark('https://www.blick.ch/a', STORED)
+        self.journal.mark('https://www.blick.ch/b', FAILED, 'AttributeError')
+        self.journal.mark('https://www.blick.ch/c', PARSED)
+        self.journal.commit()
+
+        assert self.journal.unfinished() == ['https://www.blick.ch/c']
+        assert list(self.journal.pending(urls)) == ['https://www.blick.ch/c']
+        assert list(self.journal.pending(urls, retry_failed=True)) == \
+            ['https://www.blick.ch/b', 'https://www.blick.ch/c']
+
+        self.journal.mark('https://www.blick.ch/b', FAILED, 'AttributeError')
+        assert self.journal.failed() == [('https://www.blick.ch/b', 2, 'AttributeError')]
+
+    @patch('builtins.print')
+    def test_run_batch_with_journal(self, mock_print):
+        """
+        Test that run_batch records the state of every URL and only stores the unfinished URLs again
+        :param mock_print: Mocked print method
+        """
+        with open('test_journal.txt', 'w') as f:
+            f.write('https://www.blick.ch/a\nhttps://www.blick.ch/b')
+        article = Article('title', 'time', 'author', 'text', 'https://www.blick.ch/a')
+        scraper = MagicMock()
+        scraper.scrape_many.side_effect = lambda urls, workers: [
+            (url, None, Exception("Failed")) if url.endswith('b') else (url, [article], None) for url in urls]
+        database = MagicMock()
+        database.stored_urls.return_value = set()
+        database.store_many.return_value = []
+
+        assert run_batch('test_journal.txt', scraper, database, journal=self.journal) == (1, 1)
+        assert self.journal.counts() == {STORED: 1, FAILED: 1}
+        assert run_batch('test_journal.txt', scraper, database, journal=self.journal) == (0, 0)
+        assert run_batch('test_journal.txt', scraper, database, journal=self.journal, retry_failed=True) == (0, 1)
+        database.store_many.assert_called_once_with([article])
+
+        # Pages of articles the bulk loader rejected are failed, not stored
+        other = CrawlJournal(':memory:')
+        database.bulk_load.return_value = (0, 0, [article])
+        assert run_batch('test_journal.txt', scraper, database, journal=other, bulk=True) == (1, 1)
+        assert other.counts() == {FAILED: 2}
+        other.close()
+
+        # URLs already stored in the database are skipped without being queued in the journal
+        other = CrawlJournal(':memory:')
+        database.stored_urls.return_value = {'https://www.blick.ch/a'}
+        assert run_batch('test_journal.txt', scraper, database, journal=other) == (0, 1)
+        assert other.counts() == {FAILED: 1}
+        assert other.unfinished() == []
+        other.close()
+        os.remove('test_journal.txt')
+
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Test cases for the benchmark fixtures and helpers in benchmark.py
+    """
+
+    def test_fixtures_match_selectors(self):
+        """
+        Test that the generated full-size fixtures are parsed by the scraper
+        """
+        from src.benchmark import blick_fixture, min_fixture
+        scraper = Scraper()
+        [article] = scraper.parse_blick_ch(blick_fixture(paragraphs=20))
+        assert (article.title, article.autor) == ('Blick Benchmark Titel', 'Autor Name')
+        assert article.text.count('Absatz') == 20
+        assert scraper.parse_20min_ch(min_fixture(paragraphs=20))[0].text.count('Absatz') == 20
+
+        # Few teaser blocks must not cut the navigation inside a tag
+        for blocks in (1, 7):
+            assert scraper.parse_blick_ch(blick_fixture(paragraphs=20, blocks=blocks))[0].text.count('Absatz') == 20
+            assert scraper.parse_20min_ch(min_fixture(paragraphs=20, blocks=blocks))[0].text.count('Absatz') == 20
+
+    def test_store_with_stand_in(self):
+        """
+        Test that the Database class runs against the PostgreSQL stand-in and the regressions are detected
+        """
+        from src.benchmark import StandInPool, compare
+        pool = StandInPool()
+        db = Database({}, pool=pool)
+        article = Article('Title', datetime(2024, 6, 12, 14, 0), 'Autor', 'Text', 'https://www.blick.ch/a')
+        assert db.store_many([article]) == []
+        assert pool.connection.statements == 4
+        assert compare({'a': {'min_ms': 2.0}, 'b': {'min_ms': 1.0}}, {'a': {'min_ms': 1.0}, 'b': {'min_ms': 1.0}}) \
+            == [('a', 1.0, 2.0)]
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Test cases for the metrics registry in metrics.py
+    """
+
+    def setUp(self):
+        from src.metrics import METRICS
+        self.metrics = METRICS
+        self.metrics.reset()
+
+    def test_prometheus_text(self):
+        """
+        Test that counters and histograms are rendered in the Prometheus text format
+        """
+        from src.metrics import Metrics
+        metrics = Metrics()
+        metrics.inc('scraper_responses_total', status=200)
+        metrics.inc('scraper_responses_total', status=200)
+        metrics.observe('scraper_fetch_seconds', 0.02)
+        metrics.observe('scraper_fetch_seconds', 3.0)
+        text = metrics.prometheus()
+        assert 'scraper_responses_total{status="200"} 2' in text
+        assert '# TYPE scraper_fetch_seconds histogram' in text
+        assert 'scraper_fetch_seconds_bucket{le="0.025"} 1' in text
+        assert 'scraper_fetch_seconds_bucket{le="+Inf"} 2' in text
+        assert 'scraper_fetch_seconds_count 2' in text
+
+    def test_hot_paths_recorded(self):
+        """
+        Test that fetching, parsing and storing record their latency, and failures are counted
+        """
+        from src.benchmark import StandInPool
+        scraper = Scraper()
+        with patch.object(scraper.session, 'get', return_value=Mock(status_code=200, content=BLICK_HTML, ok=True)):
+            scraper.scrape('https://www.blick.ch/story')
+        with patch.object(scraper.session, 'get', side_effect=RequestException):
+            with pytest.raises(Exception):
+                scraper.fetch_page('https://www.blick.ch/missing')
+        Database({}, pool=StandInPool()).store_data(
+            [Article('Title', datetime(2024, 6, 12, 14, 0), 'Autor', 'Text', 'https://www.blick.ch/story')])
+
+        snapshot = self.metrics.snapshot()
+        counts = {(h['name'], tuple(h['labels'].items())): h['count'] for h in snapshot['histograms']}
+        assert counts[('scraper_fetch_seconds', ())] == 2
+        assert counts[('scraper_parse_seconds', (('site', 'blick'),))] == 1
+        assert counts[('database_store_seconds', ())] == 1
+        counters = {c['name']: c['value'] for c in snapshot['counters']}
+        assert counters['scraper_fetch_errors_total'] == 1
+        assert counters['database_rows_total'] == 1
+
+
+class TestExport(unittest.TestCase):
+    """
+    Test cases for the article export in export.py
+    """
+
+    def test_incremental_jsonl_export(self):
+        """
+        Test that a JSONL export writes all rows in batches and the next export starts after the watermark
+        """
+        import json
+        import tempfile
+        from src.export import export
+        time = datetime(2024, 6, 12, 14, 0, tzinfo=timezone.utc)
+        articles = [(i, f'Title {i}', time, 'Autor', 'Text', f'https://www.blick.ch/{i}') for i in range(1, 6)]
+        database = MagicMock()
+        database.iter_articles.side_effect = lambda after, by: iter(
+            [row for row in articles if not after or row[0] > after['id']])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            watermark = os.path.join(tmp, 'watermark.json')
+            assert export(database, os.path.join(tmp, 'first.jsonl.gz'), watermark_path=watermark, batch_size=2) == 5
+            articles.append((6, 'Title 6', time, 'Autor', 'Text', 'https://www.blick.ch/6'))
+            assert export(database, os.path.join(tmp, 'second.jsonl'), watermark_path=watermark) == 1
+            with open(os.path.join(tmp, 'second.jsonl')) as f:
+                assert json.loads(f.readline())['title'] == 'Title 6'
+            with open(watermark) as f:
+                assert json.load(f) == {'by': 'id', 'id': 6, 'time': '2024-06-12T14:00:00+00:00'}
+            with pytest.raises(ValueError, match="follows id"):
+                export(database, os.path.join(tmp, 'third.jsonl'), watermark_path=watermark, by='time')
+
+
+class TestDaemon(unittest.TestCase):
+    """
+    Test cases for the settings, the work queue and the daemon in config.py, workqueue.py and daemon.py
+    """
+
+    def test_load_config(self):
+        """
+        Test that the environment overrides the config file, which overrides the defaults
+        """
+        import json
+        import tempfile
+        from src.config import db_params, load_config
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'scraper.json')
+            with open(path, 'w') as f:
+                json.dump({'host': 'db.internal', 'claim_size': 20, 'stream': True}, f)
+            config = load_config(path, environ={'SCRAPER_CLAIM_SIZE': '80', 'PGPASSWORD': 'secret',
+                                                'SCRAPER_WORKER_ID': 'worker-1'})
+            assert config['claim_size'] == 80
+            assert config['stream'] is True
+            assert config['worker_id'] == 'worker-1'
+            assert db_params(config) == {'dbname': 'web_scraper', 'host': 'db.internal', 'port': '5432',
+                                         'password': 'secret'}
+
+            with open(path, 'w') as f:
+                json.dump({'claim_sise': 20}, f)
+            with pytest.raises(ValueError, match="claim_sise"):
+                load_config(path, environ={})
+
+    def test_claim_skips_locked_rows(self):
+        """
+        Test that URLs are claimed with FOR UPDATE SKIP LOCKED and failed URLs are retried until the last attempt
+        """
+        from src.workqueue import WorkQueue
+        database = Database({}, pool=MagicMock())
+        mock_cur = database.pool.getconn.return_value.cursor.return_value
+        queue = WorkQueue(database, lease_seconds=60, max_attempts=2)
+
+        mock_cur.fetchall.return_value = [('https://www.blick.ch/a', 1)]
+        assert queue.claim('worker-1', 10) == {'https://www.blick.ch/a': 1}
+        sql, params = mock_cur.execute.call_args[0]
+        assert 'FOR UPDATE SKIP LOCKED' in sql
+        assert params == ('worker-1', 60, 2, 10)
+        # Expired leases without attempts left are failed before claiming
+        expire_sql, expire_params = mock_cur.execute.call_args_list[-2][0]
+        assert "error = 'Lease expired'" in expire_sql and expire_params == (60, 2)
+
+        assert queue.fail('worker-1', 'https://www.blick.ch/a', 1, "timeout") is True
+        assert mock_cur.execute.call_args[0][1][0] == 'queued'
+        assert queue.fail('worker-1', 'https://www.blick.ch/a', 2, "timeout") is False
+        assert mock_cur.execute.call_args[0][1][0] == 'failed'
+
+        # Only the worker holding the lease updates a URL
+        assert mock_cur.execute.call_args[0][0].endswith('WHERE url = %s AND locked_by = %s;')
+        assert mock_cur.execute.call_args[0][1][-2:] == ('https://www.blick.ch/a', 'worker-1')
+        queue.complete('worker-1', ['https://www.blick.ch/a'])
+        assert mock_cur.execute.call_args[0][1] == (['https://www.blick.ch/a'], 'worker-1')
+        queue.release('worker-1', ['https://www.blick.ch/b'])
+        assert 'locked_by = %s' in mock_cur.execute.call_args[0][0]
+        assert mock_cur.execute.call_args[0][1] == (['https://www.blick.ch/b'], 'worker-1')
+
+    @patch('builtins.print')
+    def test_process_claimed_batch(self, mock_print):
+        """
+        Test that the daemon stores the scraped pages, retries the failed ones and releases the rest when stopped
+        """
+        from src.config import load_config
+        from src.daemon import Daemon
+        database = MagicMock()
+        database.store_many.return_value = []
+        scraper = MagicMock()
+        urls = ['https://www.blick.ch/a', 'https://www.blick.ch/b', 'https://www.blick.ch/c', 'https://www.blick.ch/d']
+        daemon = Daemon(load_config(environ={}), database=database, scraper=scraper)
+        daemon.queue = MagicMock()
+        daemon.queue.fail.return_value = True
+
+        articles = [Article(title, None, 'Autor', 'Text', url) for title, url in zip('ABCD', urls)]
+
+        def results():
+            yield urls[0], articles[:1], None
+            yield urls[1], None, RequestException("timeout")
+            daemon.stop()
+            yield urls[2], articles[2:3], None
+            yield urls[3], articles[3:], None
+
+        scraper.scrape_many.return_value = results()
+        assert daemon.process({url: 1 for url in urls}) == (2, 1)
+        scraper.scrape_many.assert_called_once_with(urls, workers=0, scheduler=daemon.scheduler, pool=None)
+        database.store_many.assert_called_once_with([articles[0], articles[2]])
+        daemon.queue.complete.assert_called_once_with(daemon.worker, [urls[0], urls[2]])
+        daemon.queue.fail.assert_called_once_with(daemon.worker, urls[1], 1, "timeout")
+        daemon.queue.release.assert_called_once_with(daemon.worker, [urls[3]])
+
+        # Only the page of the article the database rejected is retried
+        database.store_many.return_value = [articles[2]]
+        daemon.queue.reset_mock()
+        daemon.store([articles[0], articles[2]], [urls[0], urls[2]], {url: 1 for url in urls})
+        daemon.queue.complete.assert_called_once_with(daemon.worker, [urls[0]])
+        daemon.queue.fail.assert_called_once_with(daemon.worker, urls[2], 1, "Failed to store the articles")
+
+
+class TestDiscovery(unittest.TestCase):
+    """
+    Test cases for the article discovery in discovery.py
+    """
+
+    @patch('builtins.print')
+    def test_discover_new_articles(self, mock_print):
+        """
+        Test that the section pages and sitemaps are followed up to the depth and only new articles are returned
+        """
+        from src.discovery import Discovery
+        pages = {
+            'https://www.blick.ch': b'<a href="/schweiz/a-id1.html?utm=x">A</a><a href="/schweiz">Schweiz</a>'
+                                    b'<a href="https://example.com/c-id3.html">C</a>',
+            'https://www.blick.ch/schweiz': b'<a href="/schweiz/b-id2.html">B</a><a href="/schweiz/a-id1.html">A</a>',
+            'https://www.blick.ch/robots.txt': b'User-agent: *\nSitemap: https://www.blick.ch/sitemap.xml\n',
+            'https://www.blick.ch/sitemap.xml':
+                b'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                b'<url><loc>https://www.blick.ch/news/d-id4.html</loc></url></urlset>',
+        }
+        scraper = Scraper(rates={})
+
+        def fetch_response(url):
+            if url not in pages:
+                raise Exception(f"Failed to load page {url}")
+            return Mock(content=pages[url])
+
+        with patch.object(scraper, 'fetch_response', side_effect=fetch_response):
+            discovery = Discovery(scraper, ['https://www.blick.ch'], depth=2)
+            assert sorted(discovery.discover()) == ['https://www.blick.ch/news/d-id4.html',
+                                                    'https://www.blick.ch/schweiz/a-id1.html',
+                                                    'https://www.blick.ch/schweiz/b-id2.html']
+            pages['https://www.blick.ch/schweiz'] += b'<a href="/schweiz/e-id5.html">E</a>'
+            assert discovery.discover() == ['https://www.blick.ch/schweiz/e-id5.html']
+
 
 class TestDatabase(unittest.TestCase):
     """
@@ -167,19 +865,59 @@ class TestDatabase(unittest.TestCase):
 
         # Test that the create_table method is called
         db.create_table()
-        calls = [
-            call(
-                '\n            CREATE TABLE IF NOT EXISTS lb2_m122 (\n                id SERIAL PRIMARY KEY,'
-                '\n                title varchar(255) UNIQUE NOT NULL,\n                time TIMESTAMP NOT NULL,'
-                '\n                autor varchar(255) NOT NULL,\n                text text NOT NULL\n            );\n '
-                '           '),
-            call(
-                '\n            CREATE TABLE IF NOT EXISTS lb2_m122 (\n                id SERIAL PRIMARY KEY,'
-                '\n                title varchar(255) UNIQUE NOT NULL,\n                time TIMESTAMP NOT NULL,'
-                '\n                autor varchar(255) NOT NULL,\n                text text NOT NULL\n            );\n '
-                '           '),
-        ]
+        create_query = (
+            '\n                CREATE TABLE IF NOT EXISTS lb2_m122 (\n                    id SERIAL PRIMARY KEY,'
+            '\n                    title varchar(255) UNIQUE NOT NULL,\n                    time TIMESTAMPTZ NOT NULL,'
+            '\n                    autor varchar(255) NOT NULL,\n                    text text NOT NULL,'
+            '\n                    url text\n                );'
+            '\n                ALTER TABLE lb2_m122 ADD COLUMN IF NOT EXISTS url text;'
+            '\n                CREATE INDEX IF NOT EXISTS lb2_m122_url_idx ON lb2_m122 (url);'
+            '\n                ALTER TABLE lb2_m122 ADD COLUMN IF NOT EXISTS search tsvector GENERATED ALWAYS AS ('
+            "\n                    setweight(to_tsvector('german', title), 'A') ||"
+            "\n                    setweight(to_tsvector('german', text), 'B')"
+            '\n                ) STORED;'
+            '\n                CREATE INDEX IF NOT EXISTS lb2_m122_search_idx ON lb2_m122 USING GIN (search);'
+            '\n                CREATE INDEX IF NOT EXISTS lb2_m122_time_idx ON lb2_m122 (time, id);'
+            '\n                CREATE INDEX IF NOT EXISTS lb2_m122_autor_idx ON lb2_m122 (autor, time);'
+            '\n                ALTER TABLE lb2_m122 ADD COLUMN IF NOT EXISTS content_hash bytea;'
+            '\n                ALTER TABLE lb2_m122 ADD COLUMN IF NOT EXISTS simhash bigint;'
+            '\n                CREATE INDEX IF NOT EXISTS lb2_m122_hash_idx ON lb2_m122 (url, content_hash);'
+            '\n                CREATE INDEX IF NOT EXISTS lb2_m122_simhash0_idx ON lb2_m122 '
+            '(((simhash >> 0) & 65535));'
+            '\n                CREATE INDEX IF NOT EXISTS lb2_m122_simhash1_idx ON lb2_m122 '
+            '(((simhash >> 16) & 65535));'
+            '\n                CREATE INDEX IF NOT EXISTS lb2_m122_simhash2_idx ON lb2_m122 '
+            '(((simhash >> 32) & 65535));'
+            '\n                CREATE INDEX IF NOT EXISTS lb2_m122_simhash3_idx ON lb2_m122 '
+            '(((simhash >> 48) & 65535));'
+            '\n                DO $$ BEGIN'
+            "\n                    IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'lb2_m122'"
+            "\n                               AND column_name = 'time' "
+            "AND data_type = 'timestamp without time zone') THEN"
+            '\n                        -- 20min.ch published UTC times, all other rows are Swiss local time'
+            '\n                        ALTER TABLE lb2_m122 ALTER COLUMN time TYPE TIMESTAMPTZ'
+            "\n                            USING time AT TIME ZONE CASE WHEN url LIKE '%20min.ch%' THEN 'UTC'"
+            "\n                                ELSE 'Europe/Zurich' END;"
+            '\n                    END IF;'
+            '\n                END $$;\n                ')
+        detect_query = call('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);', ('lb2_m122',))
+        check_query = call(ANY, ('lb2_m122', COLUMNS, len(COLUMNS), 'lb2_m122', 'lb2_m122',
+                                 sorted(db.index_names()), len(db.index_names())))
+        calls = [detect_query, check_query, call(create_query), detect_query, check_query, call(create_query)]
         mock_cur.execute.assert_has_calls(calls)
+        assert 'information_schema.columns' in mock_cur.execute.call_args_list[1].args[0]
+        assert db.unique_key == 'title'
+
+        # An up-to-date table is not altered, so a start never waits for the locks of other sessions
+        mock_cur.reset_mock()
+        mock_cur.fetchone.return_value = (True,)
+        db.create_table()
+        assert mock_cur.execute.call_count == 2
+
+        # The benchmark writes to a scratch table instead of the articles
+        scratch = Database(self.db_params, pool=MagicMock(), table_name='lb2_m122_benchmark')
+        scratch_cur = scratch.pool.getconn.return_value.cursor.return_value
+        assert scratch_cur.execute.call_args.args[0] == create_query.replace('lb2_m122', 'lb2_m122_benchmark')
 
     @patch('psycopg2.connect')
     def test_display(self, mock_connect):
@@ -198,7 +936,7 @@ class TestDatabase(unittest.TestCase):
 
         # Test that the display method is called
         db.display(1)
-        mock_cur.execute.assert_called_with('SELECT * FROM lb2_m122 WHERE id = 1;')
+        mock_cur.execute.assert_called_with('SELECT id, title, time, autor, text FROM lb2_m122 WHERE id = %s;', (1,))
 
     @patch('psycopg2.connect')
     def test_count_rows(self, mock_connect):
@@ -218,15 +956,32 @@ class TestDatabase(unittest.TestCase):
         # Create the table (this will call execute once)
         db.create_table()
 
-        # Test that the count_rows method is called
-        db.count_rows()
+        # Test that small tables are counted exactly
+        mock_cur.fetchone.return_value = (42,)
+        assert db.count_rows() == 42
         mock_cur.execute.assert_called_with('SELECT COUNT(*) FROM lb2_m122;')
 
+        # Test that large tables report the estimate without scanning
+        mock_cur.reset_mock()
+        mock_cur.fetchone.return_value = (5000000,)
+        assert db.count_rows() == 5000000
+        mock_cur.execute.assert_called_once_with(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass;', ('lb2_m122',))
+
+        # Test that the estimate of a partitioned table is the sum of its partitions
+        mock_cur.reset_mock()
+        db.partitioned = True
+        assert db.count_rows() == 5000000
+        assert 'pg_inherits' in mock_cur.execute.call_args.args[0]
+        mock_cur.execute.assert_called_once()
+
+    @patch('database.execute_values')
     @patch('psycopg2.connect')
-    def test_store_data(self, mock_connect):
+    def test_store_data(self, mock_connect, mock_execute_values):
         """
         Test the store_data method of the Database class with a mock connection and cursor
         :param mock_connect: Mocked psycopg2.connect method
+        :param mock_execute_values: Mocked psycopg2.extras.execute_values function
         """
         # Create a mock connection and cursor
         mock_conn = MagicMock()
@@ -238,11 +993,299 @@ class TestDatabase(unittest.TestCase):
         db = Database(self.db_params)
 
         # Test that the store_data method is called
-        data = ('Test Title', '2022-01-01 00:00:00', 'Test Author', 'Test Text')
-        db.store_data(data, 'https://example.com')
+        mock_execute_values.return_value = [(0, 1, 0)]
+        data = Article('Test Title', '2022-01-01 00:00:00', 'Test Author', 'Test Text', 'https://example.com')
+        db.store_data([data])
+        mock_execute_values.assert_called_with(
+            mock_cur, ANY,
+            [('Test Title', '2022-01-01 00:00:00', 'Test Author', 'Test Text', 'https://example.com',
+              content_hash('Test Text'), simhash('Test Text'))],
+            ANY, page_size=1, fetch=True)
+        query = mock_execute_values.call_args.args[1]
+        assert 'ON CONFLICT (title) DO UPDATE' in query
+        assert 'WHERE lb2_m122.content_hash IS DISTINCT FROM excluded.content_hash' in query
+
+        # Test that every article of a 20min.ch page is stored, not only the first one
+        articles = [Article('Title 1', '2022-01-01 00:00:00', 'Author', 'Text', 'https://www.20min.ch/story'),
+                    Article('Title 2', '2022-01-01 00:00:00', 'Author', 'Text', 'https://www.20min.ch/story')]
+        db.store_data(articles)
+        mock_execute_values.assert_called_with(
+            mock_cur, ANY,
+            [(*article[:5], content_hash('Text'), simhash('Text')) for article in articles],
+            ANY, page_size=2, fetch=True)
+
+    @patch('database.execute_values')
+    @patch('psycopg2.connect')
+    def test_store_many(self, mock_connect, mock_execute_values):
+        """
+        Test the store_many method of the Database class with a mock connection and cursor
+        :param mock_connect: Mocked psycopg2.connect method
+        :param mock_execute_values: Mocked psycopg2.extras.execute_values function
+        """
+        # Create a mock connection and cursor
+        mock_conn = MagicMock()
+        mock_cur = MagicMock()
+        mock_conn.cursor.return_value = mock_cur
+        mock_connect.return_value = mock_conn
+
+        # Create a Database instance
+        db = Database(self.db_params)
+        mock_conn.commit.reset_mock()
+
+        # Test that all records are inserted with one statement and one commit
+        fetched = datetime(2024, 6, 12, 14, 0, tzinfo=timezone.utc)
+        blick = Article('Blick Title', '2022-01-01 00:00:00', 'Blick Author', 'Blick Text', 'https://www.blick.ch/a',
+                        fetched)
+        twenty_min = Article('20min Title', '2022-01-01 00:00:00', '20min Author', '20min Text',
+                             'https://www.20min.ch/b', fetched)
+        second = twenty_min._replace(title='20min Second Title')
+        mock_execute_values.return_value = [(0, 2, 1)]
+        db.store_many([blick, twenty_min, second, blick])
+        fingerprints = {text: (content_hash(text), simhash(text)) for text in ['Blick Text', '20min Text']}
+        mock_execute_values.assert_called_once_with(
+            mock_cur, ANY,
+            [(*blick[:5], *fingerprints['Blick Text']),
+             (*twenty_min[:5], *fingerprints['20min Text']),
+             (*second[:5], *fingerprints['20min Text'])],
+            '(%s, %s::timestamptz, %s, %s, %s, %s::bytea, %s::bigint)', page_size=3, fetch=True)
+        mock_conn.commit.assert_called_once()
+
+        # The fingerprints attached by the parser are not computed again
+        parsed = blick.fingerprint()
+        with patch('src.article.simhash') as mock_simhash:
+            db.store_many([parsed])
+        mock_simhash.assert_not_called()
+        assert mock_execute_values.call_args.args[2] == [(*blick[:5], *fingerprints['Blick Text'])]
+
+    @patch('builtins.print')
+    @patch('database.execute_values')
+    def test_store_many_bad_rows(self, mock_execute_values, mock_print):
+        """
+        Test that invalid articles are skipped and a failing batch is stored one article at a time
+        """
+        db = Database(self.db_params, pool=MagicMock())
+        time = datetime(2024, 6, 12, 14, 0, tzinfo=timezone.utc)
+        good = Article('Good', time, 'Autor', 'Text', 'https://www.blick.ch/a')
+        undated = Article('Undated', None, 'Autor', 'Text', 'https://www.blick.ch/b')
+        long_title = good._replace(title='T' * 256, url='https://www.blick.ch/c')
+        mock_execute_values.return_value = [(0, 1, 0)]
+        assert db.store_many([good, undated, long_title]) == [undated, long_title]
+        assert mock_execute_values.call_args.args[2] == [(*good[:5], content_hash('Text'), simhash('Text'))]
+
+        # The database rejects the second article, only it is reported
+        second = good._replace(title='Second', url='https://www.blick.ch/d')
+
+        def execute(cur, query, rows, *args, **kwargs):
+            if [row[0] for row in rows] != ['Good']:
+                raise ValueError("bad row")
+            return [(0, 1, 0)]
+
+        mock_execute_values.side_effect = execute
+        assert db.store_many([good, second]) == [second]
+        assert mock_execute_values.call_count == 4
+
+    def test_bulk_load(self):
+        """
+        Test that the bulk loader streams escaped rows into the staging table and merges them chunk by chunk
+        """
+        db = Database(self.db_params, pool=MagicMock())
+        mock_cur = db.pool.getconn.return_value.cursor.return_value
+        copied = []
+        mock_cur.copy_expert.side_effect = lambda query, file: copied.append(file.read(10) + file.read())
+        mock_cur.fetchone.return_value = (1,)
+        time = datetime(2024, 6, 12, 14, 0, tzinfo=timezone.utc)
+        articles = [Article('Title\t1', time, 'Autor', 'Line\nC:\\', 'https://www.blick.ch/a'),
+                    Article('Title 2', time, 'Autor', 'Text', None),
+                    Article('Title 3', time, 'Autor', 'Text', 'https://www.blick.ch/c'),
+                    Article('Undated', None, 'Autor', 'Text', 'https://www.blick.ch/d')]
+
+        with patch('builtins.print'):
+            assert db.bulk_load(iter(articles), chunk_size=2) == (2, 1, articles[3:])
+        assert mock_cur.copy_expert.call_count == 2
+        assert mock_cur.copy_expert.call_args[0][0] == \
+            'COPY lb2_m122_staging (title, time, autor, text, url, content_hash, simhash) FROM STDIN;'
+        assert copied[0].splitlines()[0] == '\t'.join([
+            'Title\\t1', '2024-06-12T14:00:00+00:00', 'Autor', 'Line\\nC:\\\\', 'https://www.blick.ch/a',
+            '\\\\x' + content_hash('Line\nC:\\').hex(), str(simhash('Line\nC:\\'))])
+        assert copied[0].splitlines()[1].split('\t')[4] == '\\N'
+        assert len(copied[1].splitlines()) == 1
+        assert 'ON CONFLICT (title) DO NOTHING' in mock_cur.execute.call_args[0][0]
+
+    @patch('database.execute_values')
+    def test_partitions(self, mock_execute_values):
+        """
+        Test that a partitioned table is detected, the partitions are created on demand and old ones are dropped
+        """
+        from src.database import PARTITIONS_AHEAD, month_of
+        with pytest.raises(ValueError, match="--migrate-partitions"):
+            Database(self.db_params, pool=MagicMock()).apply_retention(12)
+
+        pool = MagicMock()
+        mock_cur = pool.getconn.return_value.cursor.return_value
+        mock_cur.fetchone.return_value = ('p',)
+        db = Database(self.db_params, pool=pool)
+        assert db.unique_key == 'title, time'
+        assert 'PARTITION BY RANGE (time)' in mock_cur.execute.call_args_list[2].args[0]
+        assert len(db.partitions) == PARTITIONS_AHEAD + 1
+        assert db.partition_month('lb2_m122_p202302') == date(2023, 2, 1)
+        assert db.partition_month('lb2_m122_flat') is None
+
+        # 23:30 UTC on January 31 is already February in Zurich
+        mock_execute_values.return_value = [(0, 1, 0)]
+        assert db.store_many([Article('Old', datetime(2023, 1, 31, 23, 30, tzinfo=timezone.utc), 'Autor', 'Text',
+                                      'https://www.blick.ch/old')]) == []
+        mock_cur.execute.assert_called_with(
+            "CREATE TABLE IF NOT EXISTS lb2_m122_p202302 PARTITION OF lb2_m122"
+            " FOR VALUES FROM ('2023-02-01 00:00 Europe/Zurich') TO ('2023-03-01 00:00 Europe/Zurich');")
+        assert 'ON CONFLICT (title, time) DO UPDATE' in mock_execute_values.call_args.args[1]
+
+        current = db.partition_name(month_of(datetime.now(timezone.utc)))
+        mock_cur.fetchall.return_value = [('lb2_m122_p202302',), (current,), ('lb2_m122_p202301',)]
+        assert db.apply_retention(12) == ['lb2_m122_p202301', 'lb2_m122_p202302']
+        mock_cur.execute.assert_called_with('DROP TABLE lb2_m122_p202302;')
+
+    def test_migrate_to_partitioned(self):
+        """
+        Test that the migration renames the flat table, creates the partitions of all stored months and copies the rows
+        """
+        from src.database import PARTITIONS_AHEAD, add_months, month_of
+        db = Database(self.db_params, pool=MagicMock())
+        mock_cur = db.pool.getconn.return_value.cursor.return_value
+        mock_cur.reset_mock()
+        db.pool.getconn.return_value.commit.reset_mock()
+        first = datetime(2023, 11, 15, tzinfo=timezone.utc)
+        last = datetime.now(timezone.utc) + timedelta(days=100)
+        mock_cur.fetchone.return_value = (first, last)
+        mock_cur.rowcount = 7
+
+        assert db.migrate_to_partitioned() == 7
+        statements = [args.args[0] for args in mock_cur.execute.call_args_list]
+        assert statements[0] == 'LOCK TABLE lb2_m122 IN ACCESS EXCLUSIVE MODE;'
+        assert 'ALTER TABLE lb2_m122 RENAME TO lb2_m122_flat;' in statements[1]
+        assert 'ALTER SEQUENCE IF EXISTS lb2_m122_id_seq RENAME TO lb2_m122_flat_id_seq;' in statements[1]
+        assert "index_name || '_flat'" in statements[1]
+        assert 'PARTITION BY RANGE (time)' in statements[2]
+        assert statements[3] == 'SELECT MIN(time), MAX(time) FROM lb2_m122_flat;'
+
+        months = [date(2023, 11, 1)]
+        while months[-1] < add_months(month_of(last), PARTITIONS_AHEAD):
+            months.append(add_months(months[-1], 1))
+        partitions = statements[4:4 + len(months)]
+        assert partitions == [
+            f"CREATE TABLE IF NOT EXISTS {db.partition_name(month)} PARTITION OF lb2_m122"
+            f" FOR VALUES FROM ('{month} 00:00 Europe/Zurich') TO ('{add_months(month, 1)} 00:00 Europe/Zurich');"
+            for month in months]
+        columns = 'id, title, time, autor, text, url, content_hash, simhash'
+        assert statements[4 + len(months):] == [
+            f"INSERT INTO lb2_m122 ({columns}) SELECT {columns} FROM lb2_m122_flat;",
+            "SELECT setval(pg_get_serial_sequence('lb2_m122', 'id'),"
+            " COALESCE((SELECT MAX(id) FROM lb2_m122), 0) + 1, false);"]
+        db.pool.getconn.return_value.commit.assert_called_once()
+        assert db.partitioned and db.partitions == set(months)
+
+        # A second migration does nothing
+        assert db.migrate_to_partitioned() is None
+
+    @patch('psycopg2.connect')
+    def test_stored_urls(self, mock_connect):
+        """
+        Test the stored_urls method of the Database class with a mock connection and cursor
+        :param mock_connect: Mocked psycopg2.connect method
+        """
+        # Create a mock connection and cursor
+        mock_conn = MagicMock()
+        mock_cur = MagicMock()
+        mock_conn.cursor.return_value = mock_cur
+        mock_connect.return_value = mock_conn
+        mock_cur.fetchall.return_value = [('https://www.blick.ch/a',)]
+
+        # Create a Database instance
+        db = Database(self.db_params)
+
+        # Test that all URLs are looked up with one query
+        urls = ['https://www.blick.ch/a', 'https://www.blick.ch/b']
+        self.assertEqual(db.stored_urls(urls), {'https://www.blick.ch/a'})
+        mock_cur.execute.assert_called_with('SELECT DISTINCT url FROM lb2_m122 WHERE url = ANY(%s);', (urls,))
+
+    @patch('psycopg2.connect')
+    def test_iter_articles(self, mock_connect):
+        """
+        Test that iter_articles streams the rows after the watermark with a named server-side cursor
+        :param mock_connect: Mocked psycopg2.connect method
+        """
+        mock_conn = MagicMock()
+        mock_cur = MagicMock()
+        mock_conn.cursor.return_value = mock_cur
+        mock_connect.return_value = mock_conn
+        mock_cur.__iter__.return_value = iter([(8, 'Title', None, 'Autor', 'Text', 'https://www.blick.ch/a')])
+        db = Database(self.db_params)
+
+        rows = list(db.iter_articles({'id': 7, 'time': '2024-06-12T14:00:00+00:00'}, by='time', itersize=500))
+        assert rows == [(8, 'Title', None, 'Autor', 'Text', 'https://www.blick.ch/a')]
+        mock_conn.cursor.assert_called_with('lb2_m122_export')
+        assert mock_cur.itersize == 500
         mock_cur.execute.assert_called_with(
-            '\n            INSERT INTO lb2_m122 (title, time, autor, text)\n            VALUES (%s, %s, %s, %s)\n            ON CONFLICT (title) DO NOTHING;\n        ',
-            ('Test Title', '2022-01-01 00:00:00', 'Test Author', 'Test Text'))
+            'SELECT id, title, time, autor, text, url FROM lb2_m122 WHERE (time, id) > (%s::timestamptz, %s)'
+            ' ORDER BY time, id;', ('2024-06-12T14:00:00+00:00', 7))
+
+    @patch('psycopg2.connect')
+    def test_search_and_list(self, mock_connect):
+        """
+        Test that the search and list methods of the Database class run parameterized queries
+        :param mock_connect: Mocked psycopg2.connect method
+        """
+        mock_conn = MagicMock()
+        mock_cur = MagicMock()
+        mock_conn.cursor.return_value = mock_cur
+        mock_connect.return_value = mock_conn
+        db = Database(self.db_params)
+
+        db.search("Bundesrat -Wahl", page=2, page_size=10, autor='Autor Name')
+        query, params = mock_cur.execute.call_args.args
+        assert 'search @@ query' in query and 'Bundesrat' not in query
+        assert params == {'query': 'Bundesrat -Wahl', 'autor': 'Autor Name', 'limit': 10, 'offset': 20}
+
+        before = (datetime(2024, 6, 12, 14, 0, tzinfo=timezone.utc), 7)
+        db.list_articles(page_size=10, before=before)
+        mock_cur.execute.assert_called_with(
+            'SELECT id, title, time, autor, url FROM lb2_m122 WHERE (time, id) < (%s, %s)'
+            ' ORDER BY time DESC, id DESC LIMIT %s;', (*before, 10))
+
+    def test_pool_checkout(self):
+        """
+        Test that concurrent operations check out their own connections and wait for a free one
+        """
+        import threading
+        mock_pool = MagicMock()
+        db = Database(self.db_params, max_connections=2, pool=mock_pool)
+        mock_pool.getconn.return_value.cursor.return_value.fetchone.return_value = (0,)
+
+        threads = [threading.Thread(target=db.count_rows) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = db.pool_stats()
+        assert stats['checkouts'] == 9
+        assert stats['in_use'] == 0
+        assert stats['max_connections'] == 2
+        assert mock_pool.getconn.call_count == mock_pool.putconn.call_count == 9
+
+    def test_rollback_on_error(self):
+        """
+        Test that a failing operation rolls back its transaction and returns the connection to the pool
+        """
+        mock_pool = MagicMock()
+        db = Database(self.db_params, pool=mock_pool)
+        mock_conn = mock_pool.getconn.return_value
+        mock_conn.cursor.return_value.execute.side_effect = Exception("connection lost")
+
+        with pytest.raises(Exception, match="connection lost"):
+            db.count_rows()
+        mock_conn.rollback.assert_called_once()
+        mock_pool.putconn.assert_called_with(mock_conn)
+        assert db.pool_stats()['in_use'] == 0
 
     @patch('psycopg2.connect')
     def test_close(self, mock_connect):
@@ -256,6 +1299,10 @@ class TestDatabase(unittest.TestCase):
         mock_conn.cursor.return_value = mock_cur
         mock_connect.return_value = mock_conn
 
+        # Return the connection to the pool as an idle connection
+        mock_conn.closed = False
+        mock_conn.info.transaction_status = TRANSACTION_STATUS_IDLE
+
         # Create a Database instance
         db = Database(self.db_params)
 
@@ -265,6 +1312,89 @@ class TestDatabase(unittest.TestCase):
         mock_conn.close.assert_called_once()
 
 
+@unittest.skipUnless(os.environ.get('SCRAPER_TEST_DSN'), "SCRAPER_TEST_DSN is not set")
+class TestPostgres(unittest.TestCase):
+    """
+    Test cases of the Database class against a real PostgreSQL server, given by the SCRAPER_TEST_DSN connection
+    string. The session runs in UTC, so the tests don't depend on the server's timezone.
+    """
+
+    def setUp(self):
+        self.params = {'dsn': os.environ['SCRAPER_TEST_DSN'], 'options': '-c TimeZone=UTC'}
+        self.db = Database(self.params, max_connections=2, partitioned=True, table_name='lb2_m122_test')
+
+    def tearDown(self):
+        with self.db.transaction() as cur:
+            cur.execute("DROP TABLE IF EXISTS lb2_m122_test, lb2_m122_test_flat;")
+        self.db.close()
+
+    def stored_partitions(self):
+        """
+        :return: Dictionary of the stored titles and the partition holding them
+        """
+        with self.db.transaction() as cur:
+            cur.execute("SELECT title, tableoid::regclass::text FROM lb2_m122_test;")
+            return dict(cur.fetchall())
+
+    def test_month_boundary(self):
+        """
+        Test that articles of the first hours of a month are stored in the partition of that month
+        """
+        early = datetime(2024, 6, 1, 0, 30, tzinfo=ZoneInfo('Europe/Zurich'))
+        loaded = Article('Loaded', early, 'Autor', 'Text', 'https://www.blick.ch/a')
+        assert self.db.bulk_load([loaded]) == (1, 0, [])
+        assert self.stored_partitions() == {'Loaded': 'lb2_m122_test_p202406'}
+
+        # The rows written by store_many are counted by result on the partitioned table
+        stored = Article('Stored', early.replace(month=7), 'Autor', 'Text', 'https://www.blick.ch/b')
+        from src.metrics import METRICS
+        METRICS.reset()
+        assert self.db.store_many([stored]) == []
+        assert self.db.store_many([stored._replace(text='Changed')]) == []
+        text = METRICS.prometheus()
+        assert 'database_rows_total{result="inserted"} 1' in text
+        assert 'database_rows_total{result="updated"} 1' in text
+        assert self.stored_partitions() == {'Loaded': 'lb2_m122_test_p202406', 'Stored': 'lb2_m122_test_p202407'}
+
+    def test_legacy_timestamps(self):
+        """
+        Test that the times of a TIMESTAMP column are converted as UTC for 20min.ch and as Swiss local time otherwise
+        """
+        with self.db.transaction() as cur:
+            cur.execute("""
+                CREATE TABLE lb2_m122_test_flat (id SERIAL PRIMARY KEY, title varchar(255) UNIQUE NOT NULL,
+                    time TIMESTAMP NOT NULL, autor varchar(255) NOT NULL, text text NOT NULL, url text);
+                INSERT INTO lb2_m122_test_flat (title, time, autor, text, url) VALUES
+                    ('Min', '2024-06-12 12:00', 'Autor', 'Text', 'https://www.20min.ch/a'),
+                    ('Blick', '2024-06-12 14:00', 'Autor', 'Text', 'https://www.blick.ch/b'),
+                    ('Old', '2024-06-12 14:00', 'Autor', 'Text', NULL);
+            """)
+        db = Database(self.params, max_connections=2, table_name='lb2_m122_test_flat')
+        try:
+            with db.transaction() as cur:
+                cur.execute("SELECT title, time FROM lb2_m122_test_flat;")
+                times = dict(cur.fetchall())
+        finally:
+            db.close()
+        assert set(times.values()) == {datetime(2024, 6, 12, 12, 0, tzinfo=timezone.utc)}
+
+    def test_rename_matches_one_row(self):
+        """
+        Test that an edited headline renames a single stored article even if several share its URL and text
+        """
+        db = Database(self.params, max_connections=2, table_name='lb2_m122_test_flat')
+        try:
+            time = datetime(2024, 6, 12, 14, 0, tzinfo=timezone.utc)
+            first = Article('First', time, 'Autor', 'Same text', 'https://www.20min.ch/a')
+            assert db.store_many([first, first._replace(title='Second')]) == []
+            assert db.store_many([first._replace(title='Edited')]) == []
+            with db.transaction() as cur:
+                cur.execute("SELECT title FROM lb2_m122_test_flat ORDER BY title;")
+                assert [row[0] for row in cur.fetchall()] == ['Edited', 'First']
+        finally:
+            db.close()
+
+
 class TestMain(unittest.TestCase):
     """
     Test cases for the main functions in main.py and scraper.py
@@ -300,9 +1430,27 @@ class TestMain(unittest.TestCase):
         with open('test_file.txt', 'w') as f:
             f.write('https://example.com\nhttps://example.org')
         self.assertEqual(check_file('test_file.txt'), ['https://example.com', 'https://example.org'])
-        import os
         os.remove('test_file.txt')
 
+    @patch('builtins.print')
+    def test_read_urls(self, mock_print):
+        """
+        Test the read_urls function in urls.py with gzip compressed CSV files, blank lines and duplicates
+        :param mock_print: Mocked print method
+        """
+        import gzip
+        with gzip.open('test_urls.csv.gz', 'wt') as f:
+            f.write('id,url\n1,https://www.blick.ch/a#top\n2,\n3,WWW.Blick.ch/a\n4,not a url\n'
+                    '5,https://www.20min.ch/b\n')
+        self.assertEqual(list(read_urls('test_urls.csv.gz', 'url')),
+                         ['https://www.blick.ch/a', 'https://www.20min.ch/b'])
+        with self.assertRaises(ValueError):
+            read_urls('test_urls.csv.gz', 'missing')
+        with self.assertRaises(ValueError):
+            read_urls('test_urls.json')
+        os.remove('test_urls.csv.gz')
+        self.assertEqual(normalize_url('HTTPS://WWW.20min.ch/Story?x=1#comments'), 'https://www.20min.ch/Story?x=1')
+
     def test_check_file_invalid(self):
         """
         Test the check_file function in main.py with an invalid file path
@@ -345,6 +1493,54 @@ class TestMain(unittest.TestCase):
         mock_print.assert_called_with(*[('title', 'time', 'author', 'text')])
         database.store_data.assert_not_called()
 
+    @patch('builtins.print')
+    def test_run_batch(self, mock_print):
+        """
+        Test the run_batch function in main.py with a mock scraper and database
+        :param mock_print: Mocked print method
+        """
+        with open('test_batch.txt', 'w') as f:
+            f.write('https://www.blick.ch/a\nhttps://www.blick.ch/stored\n\nhttps://www.blick.ch/b\n'
+                    'https://www.blick.ch/c\nhttps://www.blick.ch/a')
+        scraper = MagicMock()
+        database = MagicMock()
+        database.stored_urls.return_value = {'https://www.blick.ch/stored'}
+        database.store_many.return_value = []
+
+        scraper.scrape_many.side_effect = lambda urls, workers: [
+            (url, None, Exception("Failed to load page")) if url.endswith('b')
+            else (url, [Article('title', 'time', 'author', 'text', url)], None) for url in urls]
+
+        self.assertEqual(run_batch('test_batch.txt', scraper, database, batch_size=1), (2, 1))
+        database.stored_urls.assert_called_once_with(['https://www.blick.ch/a', 'https://www.blick.ch/stored',
+                                                      'https://www.blick.ch/b', 'https://www.blick.ch/c'])
+        database.store_many.assert_has_calls([
+            call([Article('title', 'time', 'author', 'text', 'https://www.blick.ch/a')]),
+            call([Article('title', 'time', 'author', 'text', 'https://www.blick.ch/c')]),
+        ])
+        os.remove('test_batch.txt')
+
+    @patch('builtins.input', return_value='')
+    @patch('builtins.print')
+    def test_browse(self, mock_print, mock_input):
+        """
+        Test that browse pages through the newest articles starting after the last row of each page
+        :param mock_print: Mocked print method
+        :param mock_input: Mocked input method
+        """
+        from main import browse
+        first = datetime(2024, 6, 12, 14, 0, tzinfo=timezone.utc)
+        database = MagicMock()
+        database.list_articles.side_effect = [
+            [(2, 'Second', first, 'Autor', 'https://www.blick.ch/b'),
+             (1, 'First', first, 'Autor', 'https://www.blick.ch/a')],
+            [(0, 'Oldest', first, 'Autor', 'https://www.blick.ch/c')],
+        ]
+        browse(database, page_size=2)
+        database.list_articles.assert_has_calls([call(2, None, None), call(2, (first, 1), None)])
+        database.search.assert_not_called()
+        mock_input.assert_called_once()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,120 @@
+import csv
+import gzip
+import re
+from hashlib import blake2b
+from itertools import islice
+from urllib.parse import urlsplit, urlunsplit
+
+from colorama import Fore, Style
+
+# URL regex pattern to validate a wide range of URLs
+url_pattern = re.compile(
+    r'^(https?://)?'                                # optional http or https
+    r'([\w-]+\.)+'                                  # subdomain or domain
+    r'([a-z.]{2,6})(:[0-9]{1,5})?'                  # domain extension and optional port
+    r'(/[\w.,@?^=%&:;/~+#-]*[\w@?^=%&;/~+#-])?$'    # path
+)
+
+# File types the URL reader accepts, each optionally gzip compressed
+ALLOWED_EXTENSIONS = ['.txt', '.csv']
+
+
+def normalize_url(url):
+    """
+    Normalize the URL so that the same page is always written the same way
+    :param url: URL to normalize
+    :return: URL with scheme, lowercase host and without fragment
+    """
+    if not re.match(r'^https?://', url, re.IGNORECASE):
+        url = 'https://' + url
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ''))
+
+
+class SeenUrls:
+    """
+    Compact set of the URLs already seen, storing an 8 byte hash per URL instead of the string
+    """
+
+    def __init__(self):
+        self.hashes = set()
+
+    def add(self, url):
+        """
+        Add the URL to the set
+        :param url: URL to add
+        :return: True if the URL was not seen before, False otherwise
+        """
+        key = int.from_bytes(blake2b(url.encode(), digest_size=8).digest(), 'big')
+        if key in self.hashes:
+            return False
+        self.hashes.add(key)
+        return True
+
+
+def read_urls(path, column=0):
+    """
+    Open a .txt or .csv file (optionally gzip compressed) and stream its validated, normalized and
+    de-duplicated URLs. The file is checked right away, the URLs are read lazily.
+    :param path: File path to read
+    :param column: Column name or index holding the URLs in a .csv file
+    :return: Generator of URLs
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    if not any(name.endswith(ext) for ext in ALLOWED_EXTENSIONS):
+        raise ValueError(f"Invalid file extension. Allowed extensions are: {', '.join(ALLOWED_EXTENSIONS)}"
+                         f" (optionally .gz compressed)")
+    f = gzip.open(path, 'rt', newline='') if path.endswith('.gz') else open(path, 'r', newline='')
+    lines = csv_column(f, column) if name.endswith('.csv') else f
+    return unique_urls(f, lines)
+
+
+def csv_column(f, column):
+    """
+    Read one column of a CSV file, a column name is looked up in the header row
+    :param f: Open CSV file
+    :param column: Column name or index
+    :return: Generator of the values in the column
+    """
+    reader = csv.reader(f)
+    if isinstance(column, str) and not column.isdigit():
+        header = next(reader, [])
+        if column not in header:
+            f.close()
+            raise ValueError(f"Column {column} not found in the CSV header.")
+        column = header.index(column)
+    column = int(column)
+    return (row[column] for row in reader if len(row) > column)
+
+
+def unique_urls(f, lines):
+    """
+    Validate, normalize and de-duplicate the URLs and close the file when done
+    :param f: Open file the lines are read from
+    :param lines: Iterable of raw lines
+    :return: Generator of URLs
+    """
+    seen = SeenUrls()
+    with f:
+        for line in lines:
+            url = line.strip()
+            if not url:
+                continue
+            if not url_pattern.match(url):
+                print(Fore.RED + f"Skipping invalid URL: {url}" + Style.RESET_ALL)
+                continue
+            url = normalize_url(url)
+            if seen.add(url):
+                yield url
+
+
+def batched(items, size):
+    """
+    Group the items into lists of the given size without reading ahead further than one batch
+    :param items: Iterable to group
+    :param size: Number of items per batch
+    :return: Generator of lists
+    """
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
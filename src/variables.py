@@ -1,17 +1,3 @@
-# Variables for the scraper for Blick.ch
+# Start pages of the supported sites, the selectors of their site adapters are configured in src/sites.json
 BLICK_URL = 'https://www.blick.ch'
-BLICK_TITLE = 'sc-42b0166d-0 htRjAb'
-BLICK_TIME = 'sc-bb3977dc-0 gsPNmc'
-BLICK_AUTOR = 'sc-4e82f8ca-0 kyLqjh'
-BLICK_ARTICLE = 'sc-845e3996-0 gMfVCb'
-
-# Variables for the scraper for 20min.ch
 MIN_URL = 'https://www.20min.ch'
-MIN_TITLE = '.Article_elementTitle__9QPjy h2'
-MIN_PARAGRAPH = 'Article_elementTextblockarray__WNyan'
-MIN_SUB_TITLE = 'Article_elementCrosshead__b9pyw'
-MIN_TIME = '.Article_elementPublishdate__qcso_ time'
-MIN_AUTOR = '.Article_elementAuthors__LsHcz'
-MIN_ARTICLE = '.Article_article__sV3bX.Article_siteAreaNews__Frmfx'
-MIN_TEXT = '.Article_body__60Liu'
-MIN_UNWANTED_VON_ELEMENT = 'sc-bea1a0f7-1 fvXKFu'
@@ -0,0 +1,151 @@
+from psycopg2.extras import execute_values
+
+from src.scheduler import backoff_delay
+
+# States of a URL in the work queue
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Seconds after which a URL claimed by a worker that stopped responding is handed out again
+LEASE_SECONDS = 600
+MAX_ATTEMPTS = 3
+
+
+class WorkQueue:
+    """
+    Persistent queue of URLs in PostgreSQL shared by scraper daemons on any number of machines.
+    Workers claim URLs with FOR UPDATE SKIP LOCKED, so no URL is handed to two workers at once, and only the
+    worker holding the lease of a URL can complete, fail or release it.
+    """
+
+    def __init__(self, database, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.database = database
+        self.table_name = f'{database.table_name}_queue'
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.create_table()
+
+    def create_table(self):
+        """
+        Create the queue table if it doesn't exist in the database
+        :return: None
+        """
+        with self.database.transaction() as cur:
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    url text PRIMARY KEY,
+                    state text NOT NULL DEFAULT '{QUEUED}',
+                    attempts integer NOT NULL DEFAULT 0,
+                    not_before timestamptz NOT NULL DEFAULT now(),
+                    locked_by text,
+                    locked_at timestamptz,
+                    error text,
+                    updated timestamptz NOT NULL DEFAULT now()
+                );
+                CREATE INDEX IF NOT EXISTS {self.table_name}_ready_idx ON {self.table_name} (not_before)
+                    WHERE state = '{QUEUED}';
+                CREATE INDEX IF NOT EXISTS {self.table_name}_running_idx ON {self.table_name} (locked_at)
+                    WHERE state = '{RUNNING}';
+                """
+            )
+
+    def enqueue(self, urls):
+        """
+        Add URLs to the queue, URLs which are already queued or were scraped before are ignored
+        :param urls: List of URLs
+        :return: Number of URLs added
+        """
+        if not urls:
+            return 0
+        with self.database.transaction() as cur:
+            added = execute_values(
+                cur, f"INSERT INTO {self.table_name} (url) VALUES %s ON CONFLICT (url) DO NOTHING RETURNING url;",
+                [(url,) for url in urls], page_size=len(urls), fetch=True)
+        return len(added)
+
+    def claim(self, worker, limit):
+        """
+        Claim the next URLs for a worker, including URLs whose lease expired because their worker stopped.
+        An expired URL is only claimed again until it used up its attempts, then it is marked as failed.
+        :param worker: ID of the worker
+        :param limit: Maximum number of URLs
+        :return: Dictionary of the claimed URLs and their attempt, starting at 1
+        """
+        with self.database.transaction() as cur:
+            cur.execute(
+                f"UPDATE {self.table_name} SET state = '{FAILED}', locked_by = NULL, error = 'Lease expired',"
+                f" updated = now() WHERE state = '{RUNNING}' AND locked_at < now() - %s * interval '1 second'"
+                f" AND attempts >= %s;", (self.lease_seconds, self.max_attempts))
+            cur.execute(
+                f"""
+                UPDATE {self.table_name} SET
+                    state = '{RUNNING}', locked_by = %s, locked_at = now(), attempts = attempts + 1, updated = now()
+                WHERE url IN (
+                    SELECT url FROM {self.table_name}
+                    WHERE (state = '{QUEUED}' AND not_before <= now())
+                        OR (state = '{RUNNING}' AND locked_at < now() - %s * interval '1 second'
+                            AND attempts < %s)
+                    ORDER BY not_before
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING url, attempts;
+                """,
+                (worker, self.lease_seconds, self.max_attempts, limit))
+            return dict(cur.fetchall())
+
+    def complete(self, worker, urls):
+        """
+        Mark the URLs as scraped, URLs claimed by another worker in the meantime are left alone
+        :param worker: ID of the worker which claimed the URLs
+        :param urls: List of URLs
+        :return: None
+        """
+        if urls:
+            with self.database.transaction() as cur:
+                cur.execute(
+                    f"UPDATE {self.table_name} SET state = '{DONE}', locked_by = NULL, error = NULL, updated = now()"
+                    f" WHERE url = ANY(%s) AND locked_by = %s;", (list(urls), worker))
+
+    def fail(self, worker, url, attempt, error):
+        """
+        Put a failed URL back into the queue with a backoff, or mark it as failed after the last attempt
+        :param worker: ID of the worker which claimed the URL
+        :param url: URL which failed
+        :param attempt: Number of the attempt which failed, starting at 1
+        :param error: Error message
+        :return: True if the URL will be retried, False if it failed for good
+        """
+        retry = attempt < self.max_attempts
+        with self.database.transaction() as cur:
+            cur.execute(
+                f"UPDATE {self.table_name} SET state = %s, not_before = now() + %s * interval '1 second',"
+                f" locked_by = NULL, error = %s, updated = now() WHERE url = %s AND locked_by = %s;",
+                (QUEUED if retry else FAILED, backoff_delay(attempt - 1) if retry else 0, error, url, worker))
+        return retry
+
+    def release(self, worker, urls):
+        """
+        Hand claimed URLs which were not scraped back to the queue, e.g. when the worker shuts down
+        :param worker: ID of the worker which claimed the URLs
+        :param urls: List of URLs
+        :return: None
+        """
+        if urls:
+            with self.database.transaction() as cur:
+                cur.execute(
+                    f"UPDATE {self.table_name} SET state = '{QUEUED}', attempts = attempts - 1, locked_by = NULL,"
+                    f" updated = now() WHERE url = ANY(%s) AND state = '{RUNNING}' AND locked_by = %s;",
+                    (list(urls), worker))
+
+    def counts(self):
+        """
+        Count the URLs per state
+        :return: Dictionary of state and number of URLs
+        """
+        with self.database.transaction() as cur:
+            cur.execute(f"SELECT state, COUNT(*) FROM {self.table_name} GROUP BY state;")
+            return dict(cur.fetchall())